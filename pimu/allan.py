@@ -0,0 +1,254 @@
+"""This module characterizes the noise of the sensor from long static
+recordings with the overlapping Allan deviation.
+
+For a cluster of m samples, with tau = m / rate, the overlapping Allan
+variance is computed from the integral theta of the signal as:
+    AVAR(tau) = sum_k (theta[k + 2m] - 2 theta[k + m] + theta[k])^2
+                / (2 tau^2 (N - 2m + 1))
+so each cluster size costs O(N) instead of O(N * m). The integral is
+built chunk by chunk from memory-mapped data, and spilled to a temporary
+memory-mapped file when it does not fit in a chunk, so recordings of tens
+of millions of samples can be processed with bounded memory.
+
+From the Allan deviation curve of every axis, the noise parameters used to
+tune the fusion are read:
+* random walk N, the noise density (angle random walk for the gyroscope,
+  velocity random walk for the accelerometer), on the -1/2 slope at tau = 1 s;
+* bias instability B, from the minimum of the curve;
+* rate random walk K, on the +1/2 slope at tau = 3 s.
+
+Usage:
+    python -m pimu.allan trace.bin --rate 1000
+
+See:
+    IEEE Std 952-1997, Annex C.
+"""
+import argparse
+import collections
+import logging
+import tempfile
+
+import numpy as np
+
+_logger = logging.getLogger(__name__)
+
+_DEFAULT_CHUNK_SIZE = 1 << 20
+_DEFAULT_NUM_TAUS = 100
+
+# Ratio between the bias instability and the minimum of the Allan
+# deviation: sqrt(2 ln(2) / pi).
+_BIAS_INSTABILITY_FACTOR = np.sqrt(2 * np.log(2) / np.pi)
+
+# Tuples (taus_s, deviations), where deviations has shape
+# (num_taus, num_channels).
+AllanDeviation = collections.namedtuple('AllanDeviation',
+                                        ['taus_s', 'deviations'])
+
+# Noise parameters of one channel, in the unit of the samples:
+#   random_walk: Noise density, in unit * sqrt(s).
+#   bias_instability: In unit.
+#   bias_instability_tau_s: Cluster time of the minimum of the deviation.
+#   rate_random_walk: In unit / sqrt(s). NaN if the +1/2 slope is not
+#       reached by the recording.
+NoiseParameters = collections.namedtuple('NoiseParameters',
+                                         ['random_walk',
+                                          'bias_instability',
+                                          'bias_instability_tau_s',
+                                          'rate_random_walk'])
+
+
+def cluster_sizes(num_samples, num_taus=_DEFAULT_NUM_TAUS):
+    """Returns about `num_taus` logarithmically spaced cluster sizes, from 1
+    to the largest one with two clusters in the recording.
+    """
+    max_size = (num_samples - 1) // 2
+    if max_size < 1:
+        raise ValueError('At least 3 samples are needed, '
+                         'but {} were provided'.format(num_samples))
+    sizes = np.logspace(0, np.log10(max_size), num_taus)
+    return np.unique(np.round(sizes).astype(np.int64))
+
+
+def _valid_chunks(samples, chunk_size):
+    """Yields chunks of the samples without the rows that contain NaNs."""
+    num_invalid = 0
+    for start in range(0, len(samples), chunk_size):
+        chunk = np.asarray(samples[start:start + chunk_size], dtype=float)
+        is_valid = ~np.isnan(chunk).any(axis=1)
+        if not is_valid.all():
+            num_invalid += np.count_nonzero(~is_valid)
+            chunk = chunk[is_valid]
+        yield chunk
+    if num_invalid:
+        _logger.warning('Skipped {} invalid samples'.format(num_invalid))
+
+
+def _integrate(samples, rate_hz, chunk_size, workdir):
+    """Returns the integral theta, with shape (N + 1, num_channels) and
+    theta[0] = 0, of the samples minus their mean. The mean is removed to
+    keep the cumulative sums small and the differences accurate.
+    """
+    num_channels = samples.shape[1]
+    total = np.zeros(num_channels)
+    num_valid = 0
+    for chunk in _valid_chunks(samples, chunk_size):
+        total += chunk.sum(axis=0)
+        num_valid += len(chunk)
+    mean = total / max(num_valid, 1)
+
+    shape = (num_valid + 1, num_channels)
+    if num_valid <= chunk_size:
+        theta = np.empty(shape)
+    else:
+        theta = np.memmap(tempfile.TemporaryFile(dir=workdir),
+                          dtype=float, mode='w+', shape=shape)
+
+    theta[0] = 0
+    position = 1
+    last = np.zeros(num_channels)
+    for chunk in _valid_chunks(samples, chunk_size):
+        cumulative = np.cumsum(chunk - mean, axis=0)
+        cumulative /= rate_hz
+        cumulative += last
+        theta[position:position + len(chunk)] = cumulative
+        if len(chunk):
+            last = cumulative[-1]
+        position += len(chunk)
+    return theta
+
+
+def allan_deviation(samples, rate_hz, sizes=None,
+                    chunk_size=_DEFAULT_CHUNK_SIZE, workdir=None):
+    """Computes the overlapping Allan deviation of every channel.
+
+    Args:
+        samples (:obj:`numpy.array`): Array with shape (N, num_channels),
+            possibly memory-mapped. Rows with NaNs are skipped.
+        rate_hz (float): Rate of the samples.
+        sizes (:obj:`numpy.array`): Cluster sizes in samples. If None,
+            `cluster_sizes` are used.
+        chunk_size (int): Number of samples processed at once.
+        workdir (str): Directory of the temporary file of the integral,
+            if it does not fit in a chunk. Defaults to the system one.
+
+    Returns:
+        An `AllanDeviation`.
+    """
+    samples = samples if samples.ndim == 2 else samples[:, np.newaxis]
+    theta = _integrate(samples, rate_hz, chunk_size, workdir)
+    num_samples = len(theta) - 1
+    sizes = cluster_sizes(num_samples) if sizes is None \
+        else np.asarray(sizes, dtype=np.int64)
+
+    variances = np.empty((len(sizes), samples.shape[1]))
+    for size_idx, size in enumerate(sizes):
+        num_terms = num_samples - 2 * size + 1
+        total = np.zeros(samples.shape[1])
+        for start in range(0, num_terms, chunk_size):
+            end = min(start + chunk_size, num_terms)
+            second_difference = theta[start + 2 * size:end + 2 * size] - \
+                2 * theta[start + size:end + size] + theta[start:end]
+            total += np.einsum('ij,ij->j', second_difference,
+                               second_difference)
+        tau_s = size / rate_hz
+        variances[size_idx] = total / (2 * tau_s ** 2 * num_terms)
+
+    return AllanDeviation(taus_s=sizes / rate_hz,
+                          deviations=np.sqrt(variances))
+
+
+def _value_on_slope(taus_s, deviations, slope, tau_s):
+    """Fits a line of the given slope in log-log scale to the points whose
+    local slope is closest to it, and returns its value at `tau_s`.
+    """
+    log_taus = np.log10(taus_s)
+    log_deviations = np.log10(deviations)
+    local_slopes = np.gradient(log_deviations, log_taus)
+    idx = int(np.argmin(np.abs(local_slopes - slope)))
+    if abs(local_slopes[idx] - slope) > 0.25:
+        return float('nan')
+    intercept = log_deviations[idx] - slope * log_taus[idx]
+    return 10 ** (intercept + slope * np.log10(tau_s))
+
+
+def noise_parameters(allan):
+    """Reads the noise parameters of every channel from the Allan deviation.
+
+    Returns:
+        A list of `NoiseParameters`, one per channel.
+    """
+    parameters = []
+    taus_s = allan.taus_s
+    for deviations in allan.deviations.T:
+        is_positive = deviations > 0
+        channel_taus_s = taus_s[is_positive]
+        deviations = deviations[is_positive]
+        min_idx = int(np.argmin(deviations))
+        parameters.append(NoiseParameters(
+            random_walk=_value_on_slope(channel_taus_s, deviations,
+                                        slope=-0.5, tau_s=1),
+            bias_instability=deviations[min_idx] / _BIAS_INSTABILITY_FACTOR,
+            bias_instability_tau_s=channel_taus_s[min_idx],
+            rate_random_walk=_value_on_slope(channel_taus_s, deviations,
+                                             slope=0.5, tau_s=3)))
+    return parameters
+
+
+def _load_samples(path):
+    if path.endswith('.npy'):
+        return np.load(path, mmap_mode='r')
+
+    # Only needed to read trace files.
+    from pimu.trace import read_trace
+    return read_trace(path, mmap=True)[1]
+
+
+def _main():
+    parser = argparse.ArgumentParser(
+        description='Noise characterization of a static recording.')
+    parser.add_argument('recording',
+                        type=str,
+                        help='File written by the server with --trace-file, '
+                             'or .npy file with shape (N, channels).')
+    parser.add_argument('--rate',
+                        required=True,
+                        type=float,
+                        help='Rate of the recorded samples, in Hertz.')
+    parser.add_argument('--channels',
+                        type=int,
+                        default=6,
+                        help='Number of leading columns analyzed. The '
+                             'default skips the temperature of trace files.')
+    parser.add_argument('--output',
+                        type=str,
+                        default=None,
+                        help='If set, the Allan deviation curves are saved '
+                             'to this .npz file.')
+    parser.add_argument('--workdir',
+                        type=str,
+                        default=None,
+                        help='Directory for the temporary files.')
+    args = parser.parse_args()
+
+    samples = _load_samples(args.recording)[:, :args.channels]
+    _logger.info('Analyzing {} samples ({:.1f} h)'.format(
+        len(samples), len(samples) / args.rate / 3600))
+    allan = allan_deviation(samples, args.rate, workdir=args.workdir)
+
+    if args.output is not None:
+        np.savez(args.output, taus_s=allan.taus_s,
+                 deviations=allan.deviations)
+        _logger.info('Allan deviation written to {}'.format(args.output))
+
+    print('{:>8} {:>14} {:>14} {:>10} {:>14}'.format(
+        'channel', 'random walk', 'bias instab.', 'at tau s',
+        'rate r. walk'))
+    for channel_idx, parameters in enumerate(noise_parameters(allan)):
+        print('{:>8} {:>14.4g} {:>14.4g} {:>10.1f} {:>14.4g}'.format(
+            channel_idx, *parameters))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO,
+                        format='[%(levelname)s][%(name)s] %(message)s')
+    _main()
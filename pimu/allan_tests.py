@@ -0,0 +1,72 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+import pimu.allan as allan
+from pimu.trace import BinaryTraceSink, read_trace
+
+
+def _naive_allan_deviation(samples, rate_hz, size):
+    """Overlapping Allan deviation from the cluster averages."""
+    num_clusters = len(samples) - size + 1
+    averages = np.array([samples[k:k + size].mean(axis=0)
+                         for k in range(num_clusters)])
+    differences = averages[size:] - averages[:-size]
+    return np.sqrt(0.5 * np.mean(differences ** 2, axis=0))
+
+
+class AllanDeviationTest(unittest.TestCase):
+
+    def test_matches_naive_implementation(self):
+        rng = np.random.default_rng(0)
+        samples = rng.normal(size=(300, 2)) + np.linspace(0, 1, 300)[:, None]
+        result = allan.allan_deviation(samples, rate_hz=100,
+                                       sizes=[1, 3, 10, 50])
+        expected = [_naive_allan_deviation(samples, 100, size)
+                    for size in (1, 3, 10, 50)]
+        np.testing.assert_allclose(expected, result.deviations)
+        np.testing.assert_allclose([0.01, 0.03, 0.1, 0.5], result.taus_s)
+
+    def test_chunks_and_temporary_file_do_not_change_result(self):
+        samples = np.random.default_rng(1).normal(size=(1000, 3))
+        whole = allan.allan_deviation(samples, rate_hz=10)
+        chunked = allan.allan_deviation(samples, rate_hz=10, chunk_size=64)
+        np.testing.assert_allclose(whole.deviations, chunked.deviations)
+
+    def test_invalid_samples_are_skipped(self):
+        samples = np.random.default_rng(2).normal(size=(200, 1))
+        with_gaps = np.insert(samples, [10, 150], np.nan, axis=0)
+        np.testing.assert_allclose(
+            allan.allan_deviation(samples, rate_hz=1).deviations,
+            allan.allan_deviation(with_gaps, rate_hz=1).deviations)
+
+    def test_white_noise_density(self):
+        # White noise of density 0.01 unit * sqrt(s) at 100 Hz.
+        rate_hz = 100
+        density = 0.01
+        samples = np.random.default_rng(3).normal(
+            scale=density * np.sqrt(rate_hz), size=(100000, 1))
+        parameters = allan.noise_parameters(
+            allan.allan_deviation(samples, rate_hz))[0]
+        self.assertAlmostEqual(density, parameters.random_walk,
+                               delta=0.1 * density)
+
+    def test_memory_mapped_trace(self):
+        samples = np.random.default_rng(4).normal(size=(500, 2))
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'trace.bin')
+            with BinaryTraceSink(path, num_values=2) as sink:
+                for idx, sample in enumerate(samples):
+                    sink.write(idx, sample)
+            _, values = read_trace(path, mmap=True)
+            result = allan.allan_deviation(values, rate_hz=50, chunk_size=100)
+            del values
+        np.testing.assert_allclose(
+            allan.allan_deviation(samples, rate_hz=50).deviations,
+            result.deviations)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,463 @@
+"""Benchmark suite of the per-sample processing paths.
+
+The MPU6050 is replaced by a `FakeBus`, so the suite runs on any machine.
+Every benchmark reports the time per operation and the operations per
+second, except the paced UDP ones, which report the median latency of
+a sample and the fraction lost. Results are written as JSON and can be
+compared against a stored baseline, failing when throughput drops, or
+latency or losses grow, by more than a tolerance, or when a benchmark of
+the baseline has no valid result.
+
+Usage:
+    python -m pimu.benchmarks --output results.json
+    python -m pimu.benchmarks --baseline baseline.json --tolerance 0.2
+"""
+import argparse
+import json
+import logging
+import platform
+import statistics
+import sys
+import time
+
+import numpy as np
+
+import pimu.geometry as geom
+import pimu.kernels as kernels
+import pimu.mpu6050.decoding as decoding
+import pimu.mpu6050.registers as regs
+import pimu.mpu6050.sensor as sensor
+import pimu.multistream as multistream
+import pimu.navigation as navigation
+import pimu.network as net
+import pimu.recording as recording
+import pimu.sensorboard as sb
+import pimu.spectrum as spectrum
+import pimu.transmission as tx
+from pimu.mpu6050.decoding import RawFrameDecoder
+from pimu.mpu6050.fakebus import FakeBus
+from pimu.mpu6050.mpu6050 import MPU6050
+
+_logger = logging.getLogger(__name__)
+
+_LOOPBACK_IP = '127.0.0.1'
+_LOOPBACK_PORT = 50500
+
+_DECODE_BLOCK_SIZE = 1000
+_UDP_BATCH_SIZES = (1, 10, 100)
+_UDP_RATES_hz = (100, 1000)
+
+_DEFAULT_TOLERANCE = 0.2
+
+
+def _time_per_op_ns(func, min_time_s, repeat):
+    """Returns the median over `repeat` runs of the time per call of `func`,
+    each run lasting at least `min_time_s`.
+    """
+    # Estimate how many calls fit in the minimum time.
+    num_calls = 1
+    while True:
+        start_ns = time.perf_counter_ns()
+        for _ in range(num_calls):
+            func()
+        elapsed_ns = time.perf_counter_ns() - start_ns
+        if elapsed_ns >= min_time_s * 1e9 / 10:
+            break
+        num_calls *= 10
+    num_calls = max(1, int(num_calls * min_time_s * 1e9 / max(elapsed_ns, 1)))
+
+    times_ns = []
+    for _ in range(repeat):
+        start_ns = time.perf_counter_ns()
+        for _ in range(num_calls):
+            func()
+        times_ns.append((time.perf_counter_ns() - start_ns) / num_calls)
+    return statistics.median(times_ns)
+
+
+def _result(ns_per_op, samples_per_op=1, **extra):
+    result = {
+        'ns_per_sample': ns_per_op / samples_per_op,
+        'samples_per_s': samples_per_op * 1e9 / ns_per_op,
+    }
+    result.update(extra)
+    return result
+
+
+def _fake_bus():
+    bus = FakeBus()
+    bus.set_raw_sample(acc=(120, -340, 16200), temperature=-1500,
+                       gyro=(25, -13, 7))
+    return bus
+
+
+################################################################################
+# Benchmarks
+
+def _bench_register_decode(min_time_s, repeat):
+    bus = _fake_bus()
+    address = regs.MPU6050_ADDRESS
+
+    def func():
+        sensor.read_accelerometer_data(bus, address, sensitivity=16384)
+        sensor.read_gyroscope_data(bus, address, sensitivity=131)
+        sensor.read_temperature_data(bus, address)
+
+    decoder = RawFrameDecoder(acc_sensitivity=16384, gyro_sensitivity=131)
+    frame = bus.read_i2c_block_data(address, regs.ACCEL_XOUT_H,
+                                    decoding.FRAME_SIZE)
+    block = np.tile(np.array(frame, dtype=np.uint8), (_DECODE_BLOCK_SIZE, 1))
+
+    def decode_frame():
+        decoder.decode(frame)
+
+    def decode_block():
+        decoder.decode_block(block)
+
+    return {
+        'register_decode':
+            _result(_time_per_op_ns(func, min_time_s, repeat)),
+        'frame_decode':
+            _result(_time_per_op_ns(decode_frame, min_time_s, repeat)),
+        'frame_decode_block{}'.format(_DECODE_BLOCK_SIZE):
+            _result(_time_per_op_ns(decode_block, min_time_s, repeat),
+                    samples_per_op=_DECODE_BLOCK_SIZE),
+    }
+
+
+def _bench_sensorboard(min_time_s, repeat):
+    def pitch_and_roll():
+        sb.pitch_and_roll_from_accelerometer_data(0.1, -0.2, 0.97)
+
+    def taitbryan_deltas():
+        sb.gyroscope_data_to_taitbryan_deltas(1.5, -0.3, 0.2,
+                                              delta_time_ms=10)
+
+    return {
+        'sensorboard_pitch_and_roll':
+            _result(_time_per_op_ns(pitch_and_roll, min_time_s, repeat)),
+        'sensorboard_taitbryan_deltas':
+            _result(_time_per_op_ns(taitbryan_deltas, min_time_s, repeat)),
+    }
+
+
+def _bench_geometry(min_time_s, repeat):
+    angles = np.deg2rad((30, 20, 10))
+    rotation_matrix = geom.build_rotation_matrix(*angles)
+
+    def build():
+        geom.build_rotation_matrix(*angles)
+
+    def decompose():
+        geom.tait_bryan_angles_from_rotation_matrix(rotation_matrix)
+
+    return {
+        'geometry_build_rotation_matrix':
+            _result(_time_per_op_ns(build, min_time_s, repeat)),
+        'geometry_tait_bryan_angles':
+            _result(_time_per_op_ns(decompose, min_time_s, repeat)),
+    }
+
+
+def _bench_fusion(min_time_s, repeat):
+    imu = MPU6050(gyro_sensitivity='250', acc_sensitivity='2g',
+                  bus=_fake_bus())
+    sample = imu.read_next()
+
+    def fuse():
+        imu.update(sample)
+
+    return {
+        'fusion_update': _result(_time_per_op_ns(fuse, min_time_s, repeat)),
+        'read_and_fuse': _result(_time_per_op_ns(imu.read_yaw_pitch_roll,
+                                                 min_time_s, repeat)),
+    }
+
+
+def _bench_dead_reckoning(min_time_s, repeat):
+    tracker = navigation.DeadReckoning(rate_hz=1000)
+    sample = (0.1, -0.05, 0.98, 1.5, -0.3, 0.2, 36.5)
+    angles = np.deg2rad((30, 20, 10))
+
+    def step():
+        tracker.step(sample, *angles)
+
+    return {'dead_reckoning_step': _result(_time_per_op_ns(step, min_time_s,
+                                                           repeat))}
+
+
+def _bench_spectrum(min_time_s, repeat):
+    """Feeds 1 kHz samples in blocks of 20, as the server does at 50 Hz."""
+    analyzer = spectrum.SpectrumAnalyzer(rate_hz=1000, window_size=1024,
+                                         hop=256)
+    block = np.random.default_rng(0).normal(size=(20, 6))
+
+    def func():
+        analyzer.extend(block)
+
+    return {'spectrum': _result(_time_per_op_ns(func, min_time_s, repeat),
+                                samples_per_op=len(block))}
+
+
+def _bench_recording(min_time_s, repeat):
+    """Encodes and compresses a chunk of 1 s of 1 kHz raw frames, the work
+    of the recording thread.
+    """
+    num_samples = 1000
+    rng = np.random.default_rng(0)
+    timestamps_ns = np.arange(num_samples) * 1000000
+    raw = np.cumsum(rng.integers(-20, 21, size=(num_samples, 7)),
+                    axis=0).astype(np.int16)
+    results = {}
+    for codec in ('zlib', 'lzma'):
+        def func():
+            recording._compress(recording._CODECS[codec],
+                                recording._encode_chunk(timestamps_ns, raw))
+
+        results['recording_chunk_{}'.format(codec)] = _result(
+            _time_per_op_ns(func, min_time_s, repeat),
+            samples_per_op=num_samples)
+    return results
+
+
+def _bench_multistream(min_time_s, repeat):
+    """Resamples 12 streams of 1 kHz samples on a 100 Hz grid, 10 ticks
+    at a time.
+    """
+    num_streams, num_samples, num_ticks = 12, 1000, 10
+    rng = np.random.default_rng(0)
+    period_ns = 1000000
+    streams = []
+    for _ in range(num_streams):
+        stream = multistream._Stream(client=None, clock=None, num_channels=4,
+                                     capacity=num_samples)
+        for idx, values in enumerate(rng.normal(size=(num_samples, 4))):
+            stream.append(idx * period_ns + rng.integers(period_ns // 2),
+                          values)
+        streams.append(stream)
+    grid_ns = np.arange(num_ticks) * 10 * period_ns + num_samples // 2 * \
+        period_ns
+    out = np.empty((num_ticks, num_streams, 4))
+
+    def func():
+        for idx, stream in enumerate(streams):
+            stream.resample(grid_ns, period_ns, out=out[:, idx])
+
+    return {'multistream_resample': _result(
+        _time_per_op_ns(func, min_time_s, repeat), samples_per_op=num_ticks)}
+
+
+def _bench_udp_roundtrip(min_time_s, repeat):
+    """Encodes, sends over the loopback interface, receives and decodes
+    batches of samples.
+    """
+    server = net.UDPServer(_LOOPBACK_IP, _LOOPBACK_PORT)
+    client = net.UDPClient(_LOOPBACK_IP, _LOOPBACK_PORT)
+    policy = tx.AlwaysSendPolicy()
+    decoder = tx.FrameDecoder()
+    values = (0.1, -0.2, 0.3, 36.5)
+
+    results = {}
+    try:
+        for batch_size in _UDP_BATCH_SIZES:
+            def func():
+                for _ in range(batch_size):
+                    server.send(policy.encode(values, time_s=0))
+                for data in client.receive_pending():
+                    decoder.decode(data)
+
+            ns_per_op = _time_per_op_ns(func, min_time_s, repeat)
+            results['udp_roundtrip_batch{}'.format(batch_size)] = \
+                _result(ns_per_op, samples_per_op=batch_size)
+
+        for rate_hz in _UDP_RATES_hz:
+            results['udp_paced_{}hz'.format(rate_hz)] = \
+                _paced_udp(server, client, policy, decoder, values,
+                           rate_hz=rate_hz, duration_s=min_time_s * repeat)
+    finally:
+        server.close()
+        client.close()
+    return results
+
+
+def _paced_udp(server, client, policy, decoder, values, rate_hz, duration_s):
+    """Sends at a fixed rate and measures the per-sample latency from
+    encoding to decoding, and the fraction of lost samples. Every packet
+    carries its send time, so that the packets received late are timed
+    against their own.
+
+    The reported latency is the median one, NaN if no sample arrived.
+    """
+    period_ns = int(1e9 / rate_hz)
+    num_samples = max(1, int(duration_s * rate_hz))
+    latencies_ns = []
+
+    def receive():
+        for data in client.receive_pending():
+            decoder.decode(data)
+            latencies_ns.append(time.perf_counter_ns() -
+                                decoder.timestamp_ns)
+
+    next_ns = time.perf_counter_ns()
+    for _ in range(num_samples):
+        while time.perf_counter_ns() < next_ns:
+            pass
+        server.send(policy.encode(values, time_s=0,
+                                  timestamp_ns=time.perf_counter_ns()))
+        receive()
+        next_ns += period_ns
+
+    # Collect the packets still in flight.
+    time.sleep(0.01)
+    receive()
+
+    median_latency_ns = statistics.median(latencies_ns) if latencies_ns \
+        else float('nan')
+    return {'latency_ns': median_latency_ns,
+            'loss_ratio': 1 - len(latencies_ns) / num_samples}
+
+
+_BENCHMARKS = (
+    _bench_register_decode,
+    _bench_sensorboard,
+    _bench_geometry,
+    _bench_fusion,
+    _bench_dead_reckoning,
+    _bench_spectrum,
+    _bench_recording,
+    _bench_multistream,
+    _bench_udp_roundtrip,
+)
+
+
+################################################################################
+# Running and comparing
+
+def run(min_time_s=0.2, repeat=5):
+    """Runs all the benchmarks and returns a JSON-serializable dictionary."""
+    results = {}
+    for benchmark in _BENCHMARKS:
+        _logger.info('Running {}'.format(benchmark.__name__))
+        results.update(benchmark(min_time_s=min_time_s, repeat=repeat))
+
+    return {
+        'metadata': {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': sys.version.split()[0],
+            'numpy': np.__version__,
+            'kernels': 'numpy' if kernels.load() is None else 'numba',
+            'platform': platform.platform(),
+            'machine': platform.machine(),
+        },
+        'results': results,
+    }
+
+
+# Compared values of the results, with whether higher is better.
+_METRICS = (
+    ('samples_per_s', True),
+    ('latency_ns', False),
+    ('loss_ratio', False),
+)
+
+
+def compare(results, baseline, tolerance=_DEFAULT_TOLERANCE):
+    """Compares every benchmark against a baseline: the samples per second,
+    or the latency and the loss ratio of the paced benchmarks.
+
+    Args:
+        results (dict): Output of `run`.
+        baseline (dict): Output of a previous `run`.
+        tolerance (float): Maximum accepted relative drop of samples per
+            second, or growth of latency or loss ratio. Any loss regresses
+            against a baseline without losses.
+
+    Returns:
+        The list of tuples (name, key, baseline value, current value) of
+        the values that regressed by more than the tolerance, including
+        the ones missing, as None, or NaN.
+    """
+    regressions = []
+    for name, baseline_result in baseline['results'].items():
+        for key, is_higher_better in _METRICS:
+            if key not in baseline_result:
+                continue
+            baseline_value = baseline_result[key]
+            value = results['results'].get(name, {}).get(key)
+            if value is None:
+                regressions.append((name, key, baseline_value, None))
+                continue
+            # Written so that NaN values regress.
+            if is_higher_better:
+                is_ok = value >= baseline_value * (1 - tolerance)
+            else:
+                is_ok = value <= baseline_value * (1 + tolerance)
+            if not is_ok:
+                regressions.append((name, key, baseline_value, value))
+    return regressions
+
+
+def _format_results(results):
+    lines = ['{:<36} {:>14} {:>14} {:>14}'.format(
+        'benchmark', 'ns/sample', 'samples/s', 'latency ns')]
+    for name, result in results['results'].items():
+        lines.append('{:<36} {:>14} {:>14} {:>14}'.format(
+            name, *('{:.0f}'.format(result[key]) if key in result else '-'
+                    for key in ('ns_per_sample', 'samples_per_s',
+                                'latency_ns'))))
+    return '\n'.join(lines)
+
+
+def _main():
+    parser = argparse.ArgumentParser(description='IMU pipeline benchmarks.')
+    parser.add_argument('--output',
+                        type=str,
+                        default=None,
+                        help='JSON file where the results are written.')
+    parser.add_argument('--baseline',
+                        type=str,
+                        default=None,
+                        help='JSON file with the results to compare against. '
+                             'Exits with an error on regressions.')
+    parser.add_argument('--tolerance',
+                        type=float,
+                        default=_DEFAULT_TOLERANCE,
+                        help='Maximum accepted relative drop of samples per '
+                             'second, or growth of latency or losses, with '
+                             'respect to the baseline.')
+    parser.add_argument('--min-time',
+                        type=float,
+                        default=0.2,
+                        dest='min_time',
+                        help='Minimum duration in seconds of each run.')
+    parser.add_argument('--repeat',
+                        type=int,
+                        default=5,
+                        help='Number of runs per benchmark.')
+    args = parser.parse_args()
+
+    results = run(min_time_s=args.min_time, repeat=args.repeat)
+    print(_format_results(results))
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        _logger.info('Results written to {}'.format(args.output))
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, tolerance=args.tolerance)
+        for name, key, baseline_value, value in regressions:
+            _logger.error('{}: {} {}, baseline {:.4g}'.format(
+                name, 'missing' if value is None else
+                '{:.4g}'.format(value), key, baseline_value))
+        if regressions:
+            sys.exit(1)
+        _logger.info('No regressions against {}'.format(args.baseline))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO,
+                        format='[%(levelname)s][%(name)s] %(message)s')
+    _main()
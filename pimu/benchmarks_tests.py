@@ -0,0 +1,60 @@
+import unittest
+
+import pimu.benchmarks as bench
+
+
+def _results(**samples_per_s):
+    return {'results': {name: {'samples_per_s': rate}
+                        for name, rate in samples_per_s.items()}}
+
+
+class CompareTest(unittest.TestCase):
+
+    def test_no_regressions_within_tolerance(self):
+        regressions = bench.compare(_results(read=850, fuse=2000),
+                                    _results(read=1000, fuse=1000),
+                                    tolerance=0.2)
+        self.assertListEqual([], regressions)
+
+    def test_regression_beyond_tolerance(self):
+        regressions = bench.compare(_results(read=700, fuse=1000),
+                                    _results(read=1000, fuse=1000),
+                                    tolerance=0.2)
+        self.assertListEqual([('read', 'samples_per_s', 1000, 700)],
+                             regressions)
+
+    def test_missing_and_nan_results_are_regressions(self):
+        regressions = bench.compare(_results(read=float('nan')),
+                                    _results(read=1000, fuse=1000))
+        self.assertEqual(['read', 'fuse'],
+                         [name for name, _, _, _ in regressions])
+        self.assertIsNone(regressions[1][3])
+
+    def test_latency_is_lower_is_better(self):
+        baseline = {'results': {'udp': {'latency_ns': 10000,
+                                        'loss_ratio': 0}}}
+        for latency_ns, is_regression in ((5000, False), (11000, False),
+                                          (13000, True),
+                                          (float('nan'), True)):
+            with self.subTest(latency_ns=latency_ns):
+                results = {'results': {'udp': {'latency_ns': latency_ns,
+                                               'loss_ratio': 0}}}
+                self.assertEqual(is_regression, bool(
+                    bench.compare(results, baseline, tolerance=0.2)))
+
+    def test_loss_ratio_is_lower_is_better(self):
+        baseline = {'results': {'udp': {'latency_ns': 10000,
+                                        'loss_ratio': 0.1}}}
+        for loss_ratio, is_regression in ((0, False), (0.11, False),
+                                          (0.5, True), (1, True)):
+            with self.subTest(loss_ratio=loss_ratio):
+                results = {'results': {'udp': {'latency_ns': 10000,
+                                               'loss_ratio': loss_ratio}}}
+                self.assertEqual(
+                    [('udp', 'loss_ratio', 0.1, loss_ratio)]
+                    if is_regression else [],
+                    bench.compare(results, baseline, tolerance=0.2))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,267 @@
+"""This module synchronizes the monotonic clock of the IMU server with
+the one of a client, so that the server timestamps of the samples can be
+mapped into the client clock.
+
+The client periodically sends a ping on a side channel, at the data port
+plus one, and the server answers right away. As in NTP, every exchange
+gives four timestamps:
+    t1: ping sent, client clock;
+    t2: ping received, server clock;
+    t3: pong sent, server clock;
+    t4: pong received, client clock;
+from which the round trip time and the offset of the server clock are:
+    rtt = (t4 - t1) - (t3 - t2)
+    offset = ((t2 - t1) + (t3 - t4)) / 2
+The offset estimate is exact when the two directions take the same time,
+so only the exchanges with the lowest round trip times of a sliding window
+are kept, and a line is fitted through their offsets to follow the drift
+between the two clocks.
+"""
+import logging
+import socket
+import struct
+import threading
+import time
+
+import numpy as np
+
+from pimu.ringbuffer import RingBuffer
+
+_logger = logging.getLogger(__name__)
+
+# Magic, sequence number, t1.
+_PING = struct.Struct('<4sIq')
+_PING_MAGIC = b'PING'
+# Magic, sequence number, t1, t2, t3.
+_PONG = struct.Struct('<4sIqqq')
+_PONG_MAGIC = b'PONG'
+
+_DEFAULT_WINDOW_SIZE = 256
+_DEFAULT_PING_INTERVAL_s = 0.5
+
+
+def sync_port(data_port):
+    """Returns the port of the side channel of a data link."""
+    return data_port + 1
+
+
+class ClockOffsetEstimator:
+    """Estimates the offset and the drift of a remote clock from NTP-style
+    exchanges.
+
+    Args:
+        window_size (int): Number of most recent exchanges considered.
+        best_fraction (float): Fraction of the exchanges of the window, with
+            the lowest round trip times, used for the estimate.
+    """
+
+    def __init__(self, window_size=_DEFAULT_WINDOW_SIZE, best_fraction=0.25):
+        # Local time, offset and round trip time of every exchange, in ns.
+        self._exchanges = RingBuffer(window_size, 3, dtype=np.int64)
+        self._best_fraction = best_fraction
+
+        self._reference_ns = None
+        self._offset_ns = 0.
+        self._drift = 0.
+        self._lock = threading.Lock()
+
+    @property
+    def num_exchanges(self):
+        return self._exchanges.num_written
+
+    @property
+    def is_synchronized(self):
+        return self._reference_ns is not None
+
+    @property
+    def drift_ppm(self):
+        """Drift of the remote clock with respect to the local one."""
+        return self._drift * 1e6
+
+    def add(self, t1_ns, t2_ns, t3_ns, t4_ns):
+        """Adds the timestamps of an exchange and updates the estimate.
+
+        Returns:
+            The round trip time in ns.
+        """
+        rtt_ns = (t4_ns - t1_ns) - (t3_ns - t2_ns)
+        offset_ns = ((t2_ns - t1_ns) + (t3_ns - t4_ns)) // 2
+        local_ns = (t1_ns + t4_ns) // 2
+        self._exchanges.append((local_ns, offset_ns, rtt_ns))
+        self._fit()
+        return rtt_ns
+
+    def _fit(self):
+        exchanges = self._exchanges.last(len(self._exchanges))
+        num_best = max(1, int(round(len(exchanges) * self._best_fraction)))
+        best = exchanges[np.argsort(exchanges[:, 2])[:num_best]]
+
+        reference_ns = int(best[:, 0].max())
+        local_s = (best[:, 0] - reference_ns) / 1e9
+        offsets_ns = best[:, 1].astype(float)
+        if num_best >= 3 and np.ptp(local_s) > 0:
+            drift_ns_per_s, offset_ns = np.polyfit(local_s, offsets_ns, 1)
+            drift = drift_ns_per_s / 1e9
+        else:
+            offset_ns = offsets_ns.mean()
+            drift = 0.
+
+        with self._lock:
+            self._reference_ns = reference_ns
+            self._offset_ns = offset_ns
+            self._drift = drift
+
+    def offset_ns(self, local_ns=None):
+        """Returns the offset of the remote clock at the given local time,
+        by default now.
+        """
+        if local_ns is None:
+            local_ns = time.monotonic_ns()
+        with self._lock:
+            if self._reference_ns is None:
+                return 0.
+            return self._offset_ns + \
+                self._drift * (local_ns - self._reference_ns)
+
+    def to_local(self, remote_ns):
+        """Maps a timestamp of the remote clock into the local clock.
+
+        Returns:
+            The local timestamp in ns, or None if no exchange was completed.
+        """
+        with self._lock:
+            if self._reference_ns is None:
+                return None
+            # Solves local = remote - offset(local) for the local time.
+            return (remote_ns - self._offset_ns +
+                    self._drift * self._reference_ns) / (1 + self._drift)
+
+
+class ClockSyncResponder:
+    """Answers the pings of the clients from a background thread. Runs next
+    to the IMU server.
+
+    Args:
+        port (int): Port of the side channel.
+        ip (str): Address to listen on. All the interfaces by default.
+    """
+
+    _POLL_INTERVAL_s = 0.1
+
+    def __init__(self, port, ip=''):
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.bind((ip, port))
+        self._socket.settimeout(self._POLL_INTERVAL_s)
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._respond_loop,
+                                        name=self.__class__.__name__,
+                                        daemon=True)
+        self.num_pings = 0
+
+    @property
+    def address(self):
+        return self._socket.getsockname()
+
+    def _respond_loop(self):
+        while not self._stop_event.is_set():
+            try:
+                data, address = self._socket.recvfrom(_PING.size)
+            except socket.timeout:
+                continue
+            except OSError as e:
+                _logger.warning('Clock sync receive failed: {}'.format(e))
+                continue
+            t2_ns = time.monotonic_ns()
+            if len(data) != _PING.size:
+                continue
+            magic, sequence, t1_ns = _PING.unpack(data)
+            if magic != _PING_MAGIC:
+                continue
+            self.num_pings += 1
+            try:
+                self._socket.sendto(_PONG.pack(_PONG_MAGIC, sequence, t1_ns,
+                                               t2_ns, time.monotonic_ns()),
+                                    address)
+            except OSError as e:
+                _logger.warning('Clock sync send failed: {}'.format(e))
+
+    def start(self):
+        self._thread.start()
+        _logger.info('Clock sync responder on port {}'.format(
+            self.address[1]))
+
+    def stop(self):
+        self._stop_event.set()
+        self._thread.join()
+        self._socket.close()
+
+
+class ClockSyncClient:
+    """Pings the server periodically from a background thread and keeps
+    an estimate of its clock.
+
+    Args:
+        server_address: Tuple (ip, port) of the responder, or a callable
+            returning it or None while it is not known yet, e.g. until the
+            first data packet from the server arrives.
+        interval_s (float): Time between two pings.
+        estimator (:obj:`ClockOffsetEstimator`): If None, one with the
+            default parameters is used.
+    """
+
+    def __init__(self, server_address, interval_s=_DEFAULT_PING_INTERVAL_s,
+                 estimator=None):
+        self._server_address = server_address if callable(server_address) \
+            else (lambda: server_address)
+        self._interval_s = interval_s
+        self.estimator = estimator or ClockOffsetEstimator()
+
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.bind(('', 0))
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._ping_loop,
+                                        name=self.__class__.__name__,
+                                        daemon=True)
+        self._sequence = 0
+        self.last_rtt_ns = None
+
+    def _ping_loop(self):
+        while not self._stop_event.is_set():
+            address = self._server_address()
+            if address is not None:
+                self._exchange(address)
+            self._stop_event.wait(self._interval_s)
+
+    def _exchange(self, address):
+        self._sequence = (self._sequence + 1) & 0xFFFFFFFF
+        self._socket.settimeout(self._interval_s)
+        try:
+            self._socket.sendto(_PING.pack(_PING_MAGIC, self._sequence,
+                                           time.monotonic_ns()), address)
+            while True:
+                data = self._socket.recv(_PONG.size)
+                t4_ns = time.monotonic_ns()
+                if len(data) != _PONG.size:
+                    continue
+                magic, sequence, t1_ns, t2_ns, t3_ns = _PONG.unpack(data)
+                # Late answers to previous pings are skipped.
+                if magic == _PONG_MAGIC and sequence == self._sequence:
+                    break
+        except socket.timeout:
+            return
+        except OSError as e:
+            _logger.debug('Clock sync exchange failed: {}'.format(e))
+            return
+        self.last_rtt_ns = self.estimator.add(t1_ns, t2_ns, t3_ns, t4_ns)
+
+    def to_local(self, remote_ns):
+        return self.estimator.to_local(remote_ns)
+
+    def start(self):
+        self._thread.start()
+        _logger.info('{} started'.format(self.__class__.__name__))
+
+    def stop(self):
+        self._stop_event.set()
+        self._thread.join()
+        self._socket.close()
@@ -0,0 +1,68 @@
+import time
+import unittest
+
+import numpy as np
+
+from pimu.clocksync import (ClockOffsetEstimator, ClockSyncClient,
+                            ClockSyncResponder)
+
+_PORT = 50331
+
+
+class ClockOffsetEstimatorTest(unittest.TestCase):
+
+    def test_offset_and_drift_with_asymmetric_delays(self):
+        # The server clock is ahead by 5 s and runs 20 ppm faster.
+        offset_ns = 5e9
+        drift = 20e-6
+        rng = np.random.default_rng(0)
+        estimator = ClockOffsetEstimator()
+
+        def server_time(local_ns):
+            return int(local_ns + offset_ns + drift * local_ns)
+
+        for idx in range(400):
+            t1 = int(idx * 0.5e9)
+            # 100 us each way, plus 1 ms of queuing on average.
+            forward_ns = 100000 + rng.exponential(1e6)
+            backward_ns = 100000 + rng.exponential(1e6)
+            t2 = server_time(t1 + forward_ns)
+            t3 = t2 + 20000
+            t4 = int(t1 + forward_ns + 20000 + backward_ns)
+            estimator.add(t1, t2, t3, t4)
+
+        self.assertAlmostEqual(20, estimator.drift_ppm, delta=2)
+        local_ns = 210e9
+        mapped_ns = estimator.to_local(server_time(local_ns))
+        self.assertAlmostEqual(local_ns, mapped_ns, delta=200000)
+
+    def test_not_synchronized_before_exchanges(self):
+        estimator = ClockOffsetEstimator()
+        self.assertFalse(estimator.is_synchronized)
+        self.assertIsNone(estimator.to_local(123))
+
+
+class ClockSyncLoopbackTest(unittest.TestCase):
+
+    def test_same_clock_on_loopback(self):
+        responder = ClockSyncResponder(_PORT, ip='127.0.0.1')
+        client = ClockSyncClient(('127.0.0.1', _PORT), interval_s=0.01)
+        responder.start()
+        client.start()
+        try:
+            deadline_s = time.monotonic() + 5
+            while client.estimator.num_exchanges < 10 and \
+                    time.monotonic() < deadline_s:
+                time.sleep(0.01)
+        finally:
+            client.stop()
+            responder.stop()
+
+        self.assertGreaterEqual(client.estimator.num_exchanges, 10)
+        now_ns = time.monotonic_ns()
+        # Both ends share the clock: the offset is only measurement error.
+        self.assertLess(abs(client.to_local(now_ns) - now_ns), 1e6)
+
+
+if __name__ == '__main__':
+    unittest.main()
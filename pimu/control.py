@@ -0,0 +1,252 @@
+"""This module changes the settings of a running IMU server: sample rate,
+full scale ranges and DLPF bandwidth, without restarting it nor calibrating
+again.
+
+Requests and replies are JSON datagrams on a side channel, at the data port
+plus two. A request holds an identifier and the settings to change, named
+as the fields of `SensorSettings`; without settings it only queries them:
+    {"id": 7, "set": {"sample_rate_hz": 200, "dlpf_bandwidth": "44"}}
+The server answers with the settings in effect after the request, and
+an error message if it could not be applied completely:
+    {"id": 7, "ok": true, "settings": {"sample_rate_hz": 200.0, ...}}
+Settings are absolute, so a request can be sent again when its reply is
+lost.
+
+The server reads the requests between two samples, from its sampling
+loop, so that the device and the decoder never change while a sample is
+processed. Anyone who can reach the port can reconfigure the server.
+
+Usage:
+    python -m pimu.control 192.168.1.20 5000 --sample-rate 200 --acc-fsr 4g
+"""
+import argparse
+import json
+import logging
+import socket
+
+from pimu.mpu6050.initialization import SensorSettings
+
+_logger = logging.getLogger(__name__)
+
+_MAX_DATAGRAM_SIZE = 4096
+_ENCODING = 'utf-8'
+
+_DEFAULT_TIMEOUT_s = 0.5
+_DEFAULT_MAX_ATTEMPTS = 3
+
+
+class ControlError(Exception):
+    """Raised when the server rejects a request, or does not answer.
+
+    Attributes:
+        settings (:obj:`SensorSettings`): Settings in effect, if the server
+            answered.
+    """
+
+    def __init__(self, message, settings=None):
+        super().__init__(message)
+        self.settings = settings
+
+
+def control_port(data_port):
+    """Returns the port of the control channel of a data link."""
+    return data_port + 2
+
+
+class ControlChannel:
+    """Receives the requests of the clients and applies them, when polled.
+
+    Args:
+        port (int): Port of the control channel.
+        reconfigure: Callable taking the settings to change as keyword
+            arguments and returning the `SensorSettings` in effect, e.g.
+            `MPU6050Server.reconfigure`. Called without arguments it must
+            change nothing.
+        ip (str): Address to listen on. All the interfaces by default.
+    """
+
+    def __init__(self, port, reconfigure, ip=''):
+        self._reconfigure = reconfigure
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.bind((ip, port))
+        self._socket.setblocking(False)
+        self.num_requests = 0
+        _logger.info('Control channel on port {}'.format(self.address[1]))
+
+    @property
+    def address(self):
+        return self._socket.getsockname()
+
+    def poll(self):
+        """Applies the requests received since the last call and answers
+        them. Never blocks.
+
+        Returns:
+            The number of requests handled.
+        """
+        num_handled = 0
+        while True:
+            try:
+                data, address = self._socket.recvfrom(_MAX_DATAGRAM_SIZE)
+            except BlockingIOError:
+                return num_handled
+            except OSError as e:
+                _logger.warning('Control receive failed: {}'.format(e))
+                return num_handled
+            reply = self._handle(data)
+            num_handled += 1
+            try:
+                self._socket.sendto(json.dumps(reply).encode(_ENCODING),
+                                    address)
+            except OSError as e:
+                _logger.warning('Control send failed: {}'.format(e))
+
+    def _handle(self, data):
+        self.num_requests += 1
+        request = {}
+        try:
+            request = json.loads(data.decode(_ENCODING))
+            if not isinstance(request, dict):
+                request = {}
+                raise ValueError('not a JSON object')
+            changes = request.get('set') or {}
+            if not isinstance(changes, dict):
+                raise ValueError('"set" is not a JSON object')
+            unknown = sorted(set(changes) - set(SensorSettings._fields))
+            if unknown:
+                raise ValueError('unknown settings {}'.format(
+                    ', '.join(unknown)))
+        except ValueError as e:
+            return self._reply(request, error='Invalid request: {}'.format(e))
+
+        _logger.info('Control request: {}'.format(changes))
+        try:
+            settings = self._reconfigure(**changes)
+        except (ValueError, TypeError, OSError) as e:
+            _logger.warning('Reconfiguration failed: {}'.format(e))
+            return self._reply(request, error=str(e))
+        return self._reply(request, settings=settings)
+
+    def _reply(self, request, settings=None, error=None):
+        if settings is None:
+            # The settings of a request that failed halfway.
+            settings = self._reconfigure()
+        reply = {'id': request.get('id'),
+                 'ok': error is None,
+                 'settings': settings._asdict()}
+        if error is not None:
+            reply['error'] = error
+        return reply
+
+    def close(self):
+        self._socket.close()
+
+
+class ControlClient:
+    """Sends requests to the control channel of a server.
+
+    Args:
+        server_address: Tuple (ip, port) of the control channel.
+        timeout_s (float): Time to wait for a reply before sending
+            the request again.
+        max_attempts (int): Number of times a request is sent.
+    """
+
+    def __init__(self, server_address, timeout_s=_DEFAULT_TIMEOUT_s,
+                 max_attempts=_DEFAULT_MAX_ATTEMPTS):
+        self._server_address = server_address
+        self._max_attempts = max_attempts
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.settimeout(timeout_s)
+        self._id = 0
+
+    def reconfigure(self, **changes):
+        """Changes the given settings, named as the fields of
+        `SensorSettings`. Without arguments, queries the settings.
+
+        Returns:
+            The `SensorSettings` in effect.
+
+        Raises:
+            ControlError: The request failed or timed out.
+        """
+        self._id += 1
+        request = json.dumps({'id': self._id, 'set': changes})
+        for _ in range(self._max_attempts):
+            self._socket.sendto(request.encode(_ENCODING),
+                                self._server_address)
+            reply = self._receive_reply()
+            if reply is None:
+                continue
+            settings = SensorSettings(**reply['settings'])
+            if not reply['ok']:
+                raise ControlError(reply.get('error'), settings)
+            return settings
+        raise ControlError('No reply from {}:{}'.format(
+            *self._server_address))
+
+    def _receive_reply(self):
+        """Returns the reply to the last request, or None on timeout."""
+        while True:
+            try:
+                data = self._socket.recv(_MAX_DATAGRAM_SIZE)
+            except socket.timeout:
+                return None
+            reply = json.loads(data.decode(_ENCODING))
+            # Late replies to previous attempts or requests are skipped.
+            if reply.get('id') == self._id:
+                return reply
+
+    def close(self):
+        self._socket.close()
+
+
+def _main():
+    parser = argparse.ArgumentParser(
+        description='Changes the settings of a running IMU server.')
+    parser.add_argument('ip',
+                        type=str,
+                        help='IP address of the server.')
+    parser.add_argument('port',
+                        type=int,
+                        help='Data port of the server, as its --port.')
+    parser.add_argument('--sample-rate',
+                        type=float,
+                        default=None,
+                        dest='sample_rate_hz',
+                        help='Output rate of the sensor, in Hertz.')
+    parser.add_argument('--gyro-fsr',
+                        type=str,
+                        default=None,
+                        dest='gyro_sensitivity',
+                        help='Gyroscope full scale range, in deg/s.')
+    parser.add_argument('--acc-fsr',
+                        type=str,
+                        default=None,
+                        dest='acc_sensitivity',
+                        help='Accelerometer full scale range, e.g. 4g.')
+    parser.add_argument('--dlpf',
+                        type=str,
+                        default=None,
+                        dest='dlpf_bandwidth',
+                        help='Bandwidth in Hertz of the digital low pass '
+                             'filter. 260 disables it.')
+    args = parser.parse_args()
+
+    changes = {name: value for name, value in vars(args).items()
+               if name in SensorSettings._fields and value is not None}
+    client = ControlClient((args.ip, control_port(args.port)))
+    try:
+        settings = client.reconfigure(**changes)
+    except ControlError as e:
+        _logger.error('{} Settings: {}'.format(e, e.settings))
+        raise SystemExit(1)
+    finally:
+        client.close()
+    _logger.info('Settings: {}'.format(settings))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO,
+                        format='[%(levelname)s][%(name)s] %(message)s')
+    _main()
@@ -0,0 +1,132 @@
+import json
+import socket
+import threading
+import unittest
+
+from pimu.control import ControlChannel, ControlClient, ControlError
+from pimu.imu_server import EventMode, MPU6050Server
+from pimu.mpu6050.fakebus import FakeBus
+from pimu.mpu6050.initialization import SensorSettings
+
+_DATA_PORT = 50361
+_CONTROL_PORT = 50363
+
+
+class ControlChannelTest(unittest.TestCase):
+
+    def setUp(self):
+        self.bus = FakeBus()
+
+    def _server(self, **kwargs):
+        server = MPU6050Server(ip='127.0.0.1', port=_DATA_PORT, rate_hz=10,
+                               calibrate=False, gyro_sensitivity='250',
+                               acc_sensitivity='2g', bus=self.bus,
+                               sample_rate_hz=1000, control_port=_CONTROL_PORT,
+                               **kwargs)
+        self.addCleanup(server.close)
+        self.addCleanup(server._control.close)
+        return server
+
+    def _request(self, server, **changes):
+        """Sends a request while the server polls its channel."""
+        client = ControlClient(('127.0.0.1', _CONTROL_PORT), timeout_s=0.05,
+                               max_attempts=40)
+        result = {}
+
+        def send():
+            try:
+                result['settings'] = client.reconfigure(**changes)
+            except ControlError as e:
+                result['error'] = e
+
+        thread = threading.Thread(target=send)
+        thread.start()
+        while thread.is_alive():
+            server._control.poll()
+            thread.join(0.01)
+        client.close()
+        if 'error' in result:
+            raise result['error']
+        return result['settings']
+
+    def test_sensor_rate_change_adapts_the_decimation(self):
+        server = self._server()
+        self.assertEqual(100, server._send_every)
+
+        settings = self._request(server, sample_rate_hz=200,
+                                 dlpf_bandwidth='94')
+        self.assertEqual(SensorSettings(sample_rate_hz=200,
+                                        gyro_sensitivity='250',
+                                        acc_sensitivity='2g',
+                                        dlpf_bandwidth='94'), settings)
+        self.assertEqual(20, server._send_every)
+        self.assertEqual(0.005, server._sensor_period_s)
+        self.assertEqual(settings, self._request(server))
+
+    def test_rejected_request_reports_the_settings(self):
+        server = self._server()
+        with self.assertRaises(ControlError) as context:
+            self._request(server, acc_sensitivity='3g')
+        self.assertEqual('2g', context.exception.settings.acc_sensitivity)
+        with self.assertRaises(ControlError):
+            self._request(server, gain=2)
+
+    def test_value_of_the_wrong_type_is_rejected(self):
+        server = self._server()
+        for sample_rate_hz in ['200', [200], {}, True, float('nan')]:
+            with self.subTest(sample_rate_hz=sample_rate_hz):
+                with self.assertRaises(ControlError) as context:
+                    self._request(server, sample_rate_hz=sample_rate_hz)
+                self.assertEqual(1000,
+                                 context.exception.settings.sample_rate_hz)
+        self.assertEqual(100, server._send_every)
+        self.assertEqual(200, self._request(
+            server, sample_rate_hz=200).sample_rate_hz)
+
+    def test_invalid_datagram(self):
+        server = self._server()
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.settimeout(1)
+        self.addCleanup(sock.close)
+        sock.sendto(b'[1, 2', ('127.0.0.1', _CONTROL_PORT))
+        while not server._control.poll():
+            pass
+        reply = json.loads(sock.recv(4096))
+        self.assertFalse(reply['ok'])
+        self.assertEqual(1000, reply['settings']['sample_rate_hz'])
+
+    def test_idle_server_stays_at_the_idle_rate(self):
+        server = self._server(event_mode=EventMode(idle_rate_hz=50))
+        server._go_idle()
+        with self.assertRaises(ControlError):
+            self._request(server, sample_rate_hz='500')
+        self.assertEqual(1000, server._full_rate_hz)
+
+        settings = self._request(server, sample_rate_hz=500)
+        self.assertEqual(500, settings.sample_rate_hz)
+        self.assertEqual(50, server.sensor_rate_hz)
+        self.assertEqual(50, server._send_every)
+        server._wake_up()
+        self.assertEqual(500, server.sensor_rate_hz)
+
+    def test_channel_calls_back_without_changes_on_query(self):
+        calls = []
+
+        def reconfigure(**changes):
+            calls.append(changes)
+            return SensorSettings(100, '250', '2g', '260')
+
+        channel = ControlChannel(_CONTROL_PORT, reconfigure, ip='127.0.0.1')
+        self.addCleanup(channel.close)
+        client = ControlClient(('127.0.0.1', _CONTROL_PORT), timeout_s=0.05)
+        self.addCleanup(client.close)
+        thread = threading.Thread(target=client.reconfigure)
+        thread.start()
+        while thread.is_alive():
+            channel.poll()
+            thread.join(0.01)
+        self.assertEqual([{}], calls)
+
+
+if __name__ == '__main__':
+    unittest.main()
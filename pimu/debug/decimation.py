@@ -0,0 +1,40 @@
+"""This module contains functions to reduce the number of points to draw
+without hiding peaks.
+"""
+import numpy as np
+
+
+def min_max_decimate(values, num_buckets):
+    """Splits the values into buckets and keeps only the minimum and maximum
+    of each bucket, in the order they occur.
+
+    If the number of values is not a multiple of the number of buckets,
+    the oldest values that do not fill a bucket are dropped.
+
+    Args:
+        values (:obj:`numpy.array`): Array with shape (N,).
+        num_buckets (int): Number of buckets.
+
+    Returns:
+        A tuple (indices, decimated_values) of arrays with shape
+        (2 * num_buckets,), where indices are the positions of the kept values
+        in the input array. If the input has no more than 2 * num_buckets
+        values, they are all returned.
+    """
+    values = np.asarray(values)
+    num_values = len(values)
+    if num_values <= 2 * num_buckets:
+        return np.arange(num_values), values
+
+    bucket_size = num_values // num_buckets
+    start = num_values - bucket_size * num_buckets
+    buckets = values[start:].reshape(num_buckets, bucket_size)
+
+    bucket_starts = start + bucket_size * np.arange(num_buckets)
+    argmins = bucket_starts + np.argmin(buckets, axis=1)
+    argmaxs = bucket_starts + np.argmax(buckets, axis=1)
+
+    indices = np.empty(2 * num_buckets, dtype=int)
+    indices[0::2] = np.minimum(argmins, argmaxs)
+    indices[1::2] = np.maximum(argmins, argmaxs)
+    return indices, values[indices]
@@ -0,0 +1,30 @@
+import unittest
+
+import numpy as np
+
+import pimu.debug.decimation as dec
+
+
+class MinMaxDecimateTest(unittest.TestCase):
+
+    def test_few_values_are_not_decimated(self):
+        values = np.array([3., 1., 2.])
+        indices, decimated = dec.min_max_decimate(values, num_buckets=2)
+        np.testing.assert_array_equal(np.arange(3), indices)
+        np.testing.assert_array_equal(values, decimated)
+
+    def test_peaks_are_kept_in_order(self):
+        values = np.array([0., 5., 1., 2., -3., 1., 0., 0.])
+        indices, decimated = dec.min_max_decimate(values, num_buckets=2)
+        np.testing.assert_array_equal([0, 1, 4, 5], indices)
+        np.testing.assert_array_equal([0., 5., -3., 1.], decimated)
+
+    def test_oldest_remainder_is_dropped(self):
+        values = np.arange(11.)
+        indices, decimated = dec.min_max_decimate(values, num_buckets=2)
+        np.testing.assert_array_equal([1, 5, 6, 10], indices)
+        np.testing.assert_array_equal([1., 5., 6., 10.], decimated)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,293 @@
+"""This module renders recorded sessions without a display.
+
+The plots are the same as the ones of the `VisualDebugger`, drawn with
+the non-interactive Agg backend. The static parts of the figure are drawn
+only once and every frame only redraws the updated artists on top of them
+(blitting). Frames can be rendered to PNG images, split across worker
+processes, or piped to ffmpeg to produce a video.
+
+Usage:
+    python -m pimu.debug.offline samples.npy --rate 100 --output-dir frames
+    python -m pimu.debug.offline samples.npy --rate 100 --video session.mp4
+"""
+import argparse
+import concurrent.futures
+import logging
+import os
+import shutil
+import subprocess
+
+import matplotlib.image as mpimg
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+from pimu.debug.visual import VisualDebugger
+
+_logger = logging.getLogger(__name__)
+
+_FRAME_NAME_FORMAT = 'frame_{:06d}.png'
+
+
+def load_samples(source):
+    """Returns an array of samples with shape (N, 7) in the format expected
+    by the `VisualDebugger`.
+
+    Args:
+        source: Either an array or the path to a .npy file. The array has
+            shape (N, 7), or (N, 4) with columns yaw, pitch, roll and
+            temperature, as sent by the IMU server.
+
+    Raises:
+        ValueError: Invalid number of columns.
+    """
+    samples = np.load(source, mmap_mode='r') if isinstance(source, str) \
+        else np.asarray(source)
+
+    if samples.ndim != 2 or samples.shape[1] not in (4, 7):
+        raise ValueError('Expected samples with shape (N, 4) or (N, 7), '
+                         'but provided have shape {}'.format(samples.shape))
+
+    if samples.shape[1] == 4:
+        expanded = np.zeros((len(samples), 7))
+        expanded[:, :3] = samples[:, :3]
+        expanded[:, 6] = samples[:, 3]
+        samples = expanded
+    return samples
+
+
+class OfflineRenderer(VisualDebugger):
+    """Renders frames of a recorded session to RGBA arrays.
+
+    Args:
+        rate (float): Rate of the recorded samples, in Hertz.
+        fps (float): Frames per second of the output.
+        dpi (int): Resolution of the output frames.
+    """
+
+    _FIGURE_SIZE_in = (12.8, 7.2)
+
+    def __init__(self, rate, fps, dpi=100):
+        super().__init__(rate=rate)
+        self._rate = rate
+        self._fps = fps
+
+        self._fig = Figure(figsize=self._FIGURE_SIZE_in, dpi=dpi)
+        self._canvas = FigureCanvasAgg(self._fig)
+        self._build_figure(self._fig)
+        for artist in self._artists:
+            artist.set_animated(True)
+
+        # Draw once everything that does not change between frames.
+        self._canvas.draw()
+        self._background = self._canvas.copy_from_bbox(self._fig.bbox)
+
+    @property
+    def frame_size(self):
+        """Tuple (width, height) of the frames in pixels."""
+        width, height = self._canvas.get_width_height()
+        return width, height
+
+    def frame_sample_indices(self, num_samples):
+        """Returns the index of the last sample shown in each frame."""
+        num_frames = int(num_samples * self._fps / self._rate)
+        frame_times_s = np.arange(num_frames) / self._fps
+        return np.minimum((frame_times_s * self._rate).astype(int),
+                          num_samples - 1)
+
+    def prefill(self, samples):
+        """Fills the plots with the samples preceding the first frame."""
+        self._append_samples(samples)
+
+    def render(self, samples):
+        """Draws the samples received since the previous frame and returns
+        the frame as an array with shape (height, width, 4).
+        """
+        self._animate(samples)
+
+        self._canvas.restore_region(self._background)
+        for artist in self._artists:
+            self._fig.draw_artist(artist)
+        self._canvas.blit(self._fig.bbox)
+        return np.asarray(self._canvas.buffer_rgba())
+
+    def iter_frames(self, samples, first_frame=0, last_frame=None,
+                    sample_offset=0):
+        """Yields the frames in the given range, as returned by `render`.
+
+        Args:
+            samples: Array with shape (N, 7), the samples of the session
+                starting from index `sample_offset`.
+            first_frame (int): Index of the first frame to render.
+            last_frame (int): Index after the last frame to render. If None,
+                all the frames until the end of the session are rendered.
+            sample_offset (int): Index in the session of the first given
+                sample. The samples visible in the first rendered frame must
+                be included.
+        """
+        frame_sample_indices = self.frame_sample_indices(
+            sample_offset + len(samples)) - sample_offset
+        last_frame = len(frame_sample_indices) if last_frame is None \
+            else min(last_frame, len(frame_sample_indices))
+        if first_frame >= last_frame:
+            return
+
+        # Samples from this one on have not been drawn yet.
+        next_sample_idx = frame_sample_indices[first_frame]
+        window_start = max(0, next_sample_idx - self._num_samples)
+        self.prefill(samples[window_start:next_sample_idx])
+
+        for frame_idx in range(first_frame, last_frame):
+            end = frame_sample_indices[frame_idx] + 1
+            yield self.render(samples[next_sample_idx:end])
+            next_sample_idx = max(next_sample_idx, end)
+
+
+def _render_png_range(samples, sample_offset, rate, fps, dpi, output_dir,
+                      first_frame, last_frame):
+    renderer = OfflineRenderer(rate=rate, fps=fps, dpi=dpi)
+    frames = renderer.iter_frames(samples,
+                                  first_frame=first_frame,
+                                  last_frame=last_frame,
+                                  sample_offset=sample_offset)
+    paths = []
+    for frame_idx, frame in enumerate(frames, start=first_frame):
+        path = os.path.join(output_dir, _FRAME_NAME_FORMAT.format(frame_idx))
+        mpimg.imsave(path, frame)
+        paths.append(path)
+    return paths
+
+
+def render_png_frames(samples, rate, output_dir, fps=30, dpi=100,
+                      num_workers=1):
+    """Renders a session to numbered PNG images.
+
+    The frames are split in contiguous ranges, one per worker process. Each
+    worker only needs the samples of its range, plus the ones preceding it
+    that are visible in its first frame.
+
+    Args:
+        samples: Array or path to a .npy file, see `load_samples`.
+        rate (float): Rate of the recorded samples, in Hertz.
+        output_dir (str): Directory where the images are written.
+        fps (float): Frames per second of the output.
+        dpi (int): Resolution of the output frames.
+        num_workers (int): Number of worker processes.
+
+    Returns:
+        The list of paths of the written images.
+    """
+    samples = load_samples(samples)
+    os.makedirs(output_dir, exist_ok=True)
+
+    num_frames = int(len(samples) * fps / rate)
+    num_workers = max(1, min(num_workers, num_frames))
+    bounds = np.linspace(0, num_frames, num_workers + 1).astype(int)
+    _logger.info('Rendering {} frames with {} workers'.format(num_frames,
+                                                              num_workers))
+
+    if num_workers == 1:
+        return _render_png_range(samples, 0, rate, fps, dpi, output_dir,
+                                 0, num_frames)
+
+    num_window_samples = int(round(rate * VisualDebugger._SHOW_TIME_s))
+    with concurrent.futures.ProcessPoolExecutor(num_workers) as executor:
+        futures = []
+        for first_frame, last_frame in zip(bounds[:-1], bounds[1:]):
+            # Every worker receives only the samples it draws.
+            first_sample = int(first_frame * rate / fps)
+            last_sample = int(last_frame * rate / fps) + 1
+            start = max(0, first_sample - num_window_samples)
+            futures.append(executor.submit(_render_png_range,
+                                           np.array(samples[start:last_sample]),
+                                           start, rate, fps, dpi, output_dir,
+                                           first_frame, last_frame))
+        return [path for future in futures for path in future.result()]
+
+
+def render_video(samples, rate, path, fps=30, dpi=100):
+    """Renders a session to a video file by piping raw frames to ffmpeg.
+
+    Args:
+        samples: Array or path to a .npy file, see `load_samples`.
+        rate (float): Rate of the recorded samples, in Hertz.
+        path (str): Output video file.
+        fps (float): Frames per second of the output.
+        dpi (int): Resolution of the output frames.
+
+    Raises:
+        RuntimeError: ffmpeg is not available or failed.
+    """
+    ffmpeg = shutil.which('ffmpeg')
+    if ffmpeg is None:
+        raise RuntimeError('ffmpeg is required to render a video')
+
+    samples = load_samples(samples)
+    renderer = OfflineRenderer(rate=rate, fps=fps, dpi=dpi)
+    width, height = renderer.frame_size
+
+    command = [ffmpeg, '-y', '-loglevel', 'error',
+               '-f', 'rawvideo', '-pix_fmt', 'rgba',
+               '-s', '{}x{}'.format(width, height), '-r', str(fps),
+               '-i', '-',
+               '-pix_fmt', 'yuv420p', path]
+    process = subprocess.Popen(command, stdin=subprocess.PIPE)
+    try:
+        for frame in renderer.iter_frames(samples):
+            process.stdin.write(frame.tobytes())
+    finally:
+        process.stdin.close()
+        return_code = process.wait()
+
+    if return_code != 0:
+        raise RuntimeError('ffmpeg exited with code {}'.format(return_code))
+    _logger.info('Video written to {}'.format(path))
+
+
+def _main():
+    parser = argparse.ArgumentParser(description='Renders a recorded IMU '
+                                                 'session without a display.')
+    parser.add_argument('samples',
+                        type=str,
+                        help='.npy file with the recorded samples.')
+    parser.add_argument('--rate',
+                        required=True,
+                        type=float,
+                        help='Rate of the recorded samples, in Hertz.')
+    parser.add_argument('--fps',
+                        type=float,
+                        default=30,
+                        help='Frames per second of the output.')
+    parser.add_argument('--dpi',
+                        type=int,
+                        default=100,
+                        help='Resolution of the output frames.')
+    parser.add_argument('--output-dir',
+                        type=str,
+                        dest='output_dir',
+                        help='Directory where PNG frames are written.')
+    parser.add_argument('--video',
+                        type=str,
+                        help='Video file to write. Requires ffmpeg.')
+    parser.add_argument('--workers',
+                        type=int,
+                        default=os.cpu_count(),
+                        help='Number of processes rendering PNG frames.')
+    args = parser.parse_args()
+
+    if (args.output_dir is None) == (args.video is None):
+        raise ValueError('Either --output-dir or --video must be set.')
+
+    if args.video is not None:
+        render_video(args.samples, rate=args.rate, path=args.video,
+                     fps=args.fps, dpi=args.dpi)
+    else:
+        render_png_frames(args.samples, rate=args.rate,
+                          output_dir=args.output_dir, fps=args.fps,
+                          dpi=args.dpi, num_workers=args.workers)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO,
+                        format='[%(levelname)s][%(name)s] %(message)s')
+    _main()
@@ -0,0 +1,50 @@
+import unittest
+
+import numpy as np
+
+import pimu.debug.offline as offline
+
+
+class LoadSamplesTest(unittest.TestCase):
+
+    def test_server_samples_are_expanded(self):
+        samples = np.array([[0.1, 0.2, 0.3, 25.]])
+        expected_samples = np.array([[0.1, 0.2, 0.3, 0., 0., 0., 25.]])
+        np.testing.assert_array_equal(expected_samples,
+                                      offline.load_samples(samples))
+
+    def test_invalid_shape(self):
+        with self.assertRaisesRegex(ValueError, r'Expected samples'):
+            offline.load_samples(np.zeros((3, 5)))
+
+
+class OfflineRendererTest(unittest.TestCase):
+
+    def setUp(self):
+        time_s = np.arange(1000) / 100
+        self._samples = offline.load_samples(
+            np.stack([np.sin(time_s), np.cos(time_s), time_s, 20 + time_s],
+                     axis=1))
+
+    def test_one_frame_per_output_period(self):
+        renderer = offline.OfflineRenderer(rate=100, fps=10, dpi=20)
+        frames = list(renderer.iter_frames(self._samples))
+        self.assertEqual(100, len(frames))
+        width, height = renderer.frame_size
+        self.assertTupleEqual((height, width, 4), frames[0].shape)
+
+    def test_frame_range_matches_full_session(self):
+        full_renderer = offline.OfflineRenderer(rate=100, fps=10, dpi=20)
+        expected_frame = \
+            [frame.copy() for frame in full_renderer.iter_frames(
+                self._samples)][80]
+
+        renderer = offline.OfflineRenderer(rate=100, fps=10, dpi=20)
+        frame = next(renderer.iter_frames(self._samples[300:],
+                                          first_frame=80,
+                                          sample_offset=300))
+        np.testing.assert_array_equal(expected_frame, frame)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -7,6 +7,8 @@ import seaborn as sns
 from mpl_toolkits.mplot3d import Axes3D
 
 import pimu.geometry as geom
+from pimu.debug.decimation import min_max_decimate
+from pimu.ringbuffer import RingBuffer
 
 _logger = logging.getLogger()
 sns.set()
@@ -22,13 +24,24 @@ class VisualDebugger:
     _NUM_SUBPLOTS_ROWS = 4
     _NUM_SUBPLOTS_COLS = 2
 
+    # The plots are redrawn at this rate, independently of the data rate.
+    _DISPLAY_FPS = 30
+
+    # Above this number of samples per plot, only the minimum and maximum
+    # of each group of samples are drawn.
+    _MAX_DISPLAY_POINTS = 1000
+
     def __init__(self, rate):
         self._num_samples = int(round(rate * self._SHOW_TIME_s))
 
-        # Zero-initialize all the plots.
-        self._xs = list(range(self._num_samples))
-        self._caches = [[0 for _ in range(self._num_samples)]
-                        for _ in range(7)]
+        # Time of each sample in seconds, relative to the last one.
+        self._xs = (np.arange(self._num_samples) - self._num_samples + 1) / rate
+
+        # Zero-initialize all the plots. One channel per time series:
+        # yaw, pitch, roll, filtered yaw, filtered pitch, filtered roll,
+        # temperature.
+        self._caches = RingBuffer(capacity=self._num_samples, num_channels=7)
+        self._last_sample = np.zeros(7)
 
         # Create the artist elements that will be updated.
         self._artists = [
@@ -42,7 +55,9 @@ class VisualDebugger:
             None,   # X axis
             None,   # Y axis
             None,   # Z axis
+            None,   # status text
         ]
+        self._status_func = None
 
         self._init_board_axes = np.diag(np.ones(3))
 
@@ -79,12 +94,9 @@ class VisualDebugger:
         ax_temp.grid(True)
 
         # Common axis formatting.
-        tick_step = int(round(self._num_samples / self._SHOW_TIME_s))
-        ticklabel_step = int(round(self._SHOW_TIME_s // self._SHOW_TIME_s))
-        xtickslabels = range(-self._SHOW_TIME_s, 1, ticklabel_step)
         for ax in axes:
-            ax.set_xticks(range(-1, self._num_samples, tick_step))
-            ax.set_xticklabels(xtickslabels)
+            ax.set_xlim(-self._SHOW_TIME_s, 0)
+            ax.set_xticks(range(-self._SHOW_TIME_s, 1))
             ax.yaxis.set_label_position('right')
             ax.yaxis.tick_right()
 
@@ -108,46 +120,42 @@ class VisualDebugger:
         ax_3d.set_aspect('equal')
         ax_3d.grid(False)
 
-    def _update_cache(self, cache, value):
-        cache.append(value)
-        cache = cache[-self._num_samples:]
-        return cache
-
-    def _animate(self, values):
-        (yaw_rad, pitch_rad, roll_rad,
-         filtered_yaw_rad, filtered_pitch_rad, filtered_roll_rad,
-         temperature_deg) = values
-
-        (yaw_deg, pitch_deg, roll_deg,
-         filtered_yaw_deg, filtered_pitch_deg, filtered_roll_deg) = \
-            map(np.rad2deg,
-                (yaw_rad, pitch_rad, roll_rad,
-                 filtered_yaw_rad, filtered_pitch_rad, filtered_roll_rad))
-
-        _logger.debug('yaw={:> 6.1f}°, '
-                      'pitch={:> 6.1f}°, '
-                      'roll={:> 6.1f}°, '
-                      'temp={:> 5.1f}°C'.format(yaw_deg, pitch_deg, roll_deg,
-                                                temperature_deg))
-
-        self._caches[0] = self._update_cache(self._caches[0], yaw_deg)
-        self._caches[1] = self._update_cache(self._caches[1], pitch_deg)
-        self._caches[2] = self._update_cache(self._caches[2], roll_deg)
-        self._caches[3] = self._update_cache(self._caches[3],
-                                             filtered_yaw_deg)
-        self._caches[4] = self._update_cache(self._caches[4],
-                                             filtered_pitch_deg)
-        self._caches[5] = self._update_cache(self._caches[5],
-                                             filtered_roll_deg)
-        self._caches[6] = self._update_cache(self._caches[6], temperature_deg)
-
-        self._artists[0].set_ydata(self._caches[0])
-        self._artists[1].set_ydata(self._caches[1])
-        self._artists[2].set_ydata(self._caches[2])
-        self._artists[3].set_ydata(self._caches[3])
-        self._artists[4].set_ydata(self._caches[4])
-        self._artists[5].set_ydata(self._caches[5])
-        self._artists[6].set_ydata(self._caches[6])
+    def _decimated(self, values):
+        indices, decimated_values = \
+            min_max_decimate(values, num_buckets=self._MAX_DISPLAY_POINTS // 2)
+        return self._xs[indices], decimated_values
+
+    def _append_samples(self, samples):
+        if len(samples):
+            samples = np.array(samples, dtype=float)
+            self._last_sample = samples[-1].copy()
+            samples[:, :6] = np.rad2deg(samples[:, :6])
+            self._caches.extend(samples)
+
+    def _animate(self, samples):
+        """Draws all the samples received since the previous frame.
+
+        Args:
+            samples (list): Tuples (yaw, pitch, roll, filtered yaw,
+                filtered pitch, filtered roll, temperature), the oldest first.
+                Angles are in radians.
+        """
+        self._append_samples(samples)
+
+        yaw_rad, pitch_rad, roll_rad, *_, temperature_deg = self._last_sample
+
+        if _logger.isEnabledFor(logging.DEBUG):
+            _logger.debug('yaw={:> 6.1f}°, '
+                          'pitch={:> 6.1f}°, '
+                          'roll={:> 6.1f}°, '
+                          'temp={:> 5.1f}°C'.format(np.rad2deg(yaw_rad),
+                                                    np.rad2deg(pitch_rad),
+                                                    np.rad2deg(roll_rad),
+                                                    temperature_deg))
+
+        caches = self._caches.view()
+        for idx in range(7):
+            self._artists[idx].set_data(*self._decimated(caches[:, idx]))
 
         rotation_matrix = geom.build_rotation_matrix(yaw_rad=yaw_rad,
                                                      pitch_rad=pitch_rad,
@@ -172,43 +180,67 @@ class VisualDebugger:
         self._artists[9].set_data(lines[2, :, 0], lines[2, :, 1])
         self._artists[9].set_3d_properties(lines[2, :, 2])
 
+        if self._status_func is not None:
+            self._artists[10].set_text(self._status_func())
+
         return self._artists
 
-    def run(self, updating_func):
-        fig, axes = plt.subplots(nrows=self._NUM_SUBPLOTS_ROWS,
-                                 ncols=self._NUM_SUBPLOTS_COLS,
-                                 sharex='col',
-                                 sharey='none')
-        ax_3d = \
-            plt.subplot(1, self._NUM_SUBPLOTS_COLS, 1, projection=Axes3D.name)
+    def run(self, updating_func, status_func=None):
+        """Shows the plots and keeps them updated.
+
+        Args:
+            updating_func (callable): Returns an iterator that yields, once
+                per displayed frame, the list of samples received since
+                the previous frame. See `_animate` for the sample format.
+            status_func (callable): If set, called once per frame, returns
+                a text shown in the figure, e.g. receiving statistics.
+        """
+        self._status_func = status_func
+
+        fig = plt.figure()
+        self._build_figure(fig)
+
+        _logger.debug('{} ready to run'.format(self.__class__.__name__))
+
+        _ = animation.FuncAnimation(fig=fig,
+                                    func=self._animate,
+                                    frames=updating_func,
+                                    interval=1000 / self._DISPLAY_FPS,
+                                    blit=True,
+                                    cache_frame_data=False)
+        plt.show()
+
+    def _build_figure(self, fig):
+        """Creates the axes and the artists updated by `_animate`."""
+        axes = fig.subplots(nrows=self._NUM_SUBPLOTS_ROWS,
+                            ncols=self._NUM_SUBPLOTS_COLS,
+                            sharex='col',
+                            sharey='none')
+        ax_3d = fig.add_subplot(1, self._NUM_SUBPLOTS_COLS, 1,
+                                projection=Axes3D.name)
 
         self._format_axes(axes[:, -1])
         self._format_axes3d(ax_3d)
 
+        caches = self._caches.view()
         for idx in range(3):
             self._artists[idx] = axes[idx, 1].plot(self._xs,
-                                                   self._caches[idx],
+                                                   caches[:, idx],
                                                    color='k',
                                                    label='raw')[0]
 
         for idx in range(3):
             self._artists[idx + 3] = axes[idx, 1].plot(self._xs,
-                                                       self._caches[idx + 3],
+                                                       caches[:, idx + 3],
                                                        color='r',
                                                        label='filtered')[0]
 
         self._artists[6] = \
-            axes[3, 1].plot(self._xs, self._caches[6], color='k')[0]
+            axes[3, 1].plot(self._xs, caches[:, 6], color='k')[0]
 
         self._artists[7] = ax_3d.plot([0, 1], [0, 0], [0, 0], color='r')[0]
         self._artists[8] = ax_3d.plot([0, 0], [0, 1], [0, 0], color='g')[0]
         self._artists[9] = ax_3d.plot([0, 0], [0, 0], [0, 1], color='b')[0]
-
-        _logger.debug('{} ready to run'.format(self.__class__.__name__))
-
-        _ = animation.FuncAnimation(fig=fig,
-                                    func=self._animate,
-                                    frames=updating_func,
-                                    interval=1,
-                                    blit=True)
-        plt.show()
+        self._artists[10] = ax_3d.text2D(0.02, 0.98, '',
+                                         transform=ax_3d.transAxes,
+                                         verticalalignment='top')
@@ -0,0 +1,259 @@
+"""This module contains a streaming anti-aliasing decimator, to lower the rate
+of the sensor stream without folding vibrations into the output.
+
+Samples are processed in blocks of any size. The filter keeps its history
+between blocks, so the output is the same however the stream is split, and
+only the retained outputs are computed, as in a polyphase implementation:
+the cost per input sample is the number of taps divided by the decimation
+factor.
+
+Usage:
+    decimator = FirDecimator(decimation=20, num_channels=7)
+    for block in blocks:  # Arrays with shape (N, 7) at 1 kHz.
+        output = decimator.process(block)  # Shape (K, 7) at 50 Hz.
+
+`first_order_recursion` runs a first-order recursive filter, such as
+the complementary filter of the fusion, over whole recordings without
+a Python loop over the samples.
+"""
+import math
+
+import numpy as np
+
+# Number of taps of the filter per unit of decimation factor. The output
+# is delayed by about half as many output periods.
+_DEFAULT_TAPS_PER_PHASE = 16
+
+# Cutoff frequency as a fraction of the output Nyquist frequency. The
+# transition band ends close to the output Nyquist frequency.
+_DEFAULT_CUTOFF = 0.8
+
+# Kaiser window parameter: about 80 dB of stopband attenuation.
+_KAISER_BETA = 8
+
+# Decades a block of `first_order_recursion` spans: the response to
+# the first input of a block has decayed by this many decades at its end.
+_RECURSION_BLOCK_DECADES = 15
+
+
+def lowpass_taps(decimation, taps_per_phase=_DEFAULT_TAPS_PER_PHASE,
+                 cutoff=_DEFAULT_CUTOFF):
+    """Designs a windowed-sinc low pass filter for the given decimation.
+
+    Args:
+        decimation (int): Ratio between the input and the output rate.
+        taps_per_phase (int): Number of taps per decimation unit. More taps
+            give a sharper transition and a longer delay, of about
+            `taps_per_phase / 2` output periods.
+        cutoff (float): Cutoff frequency as a fraction of the Nyquist
+            frequency of the output.
+
+    Returns:
+        An array with the taps, normalized to unit gain at 0 Hz.
+
+    Raises:
+        ValueError: Less than one tap per phase.
+    """
+    if taps_per_phase < 1:
+        raise ValueError('At least one tap per phase is needed, but {} was '
+                         'provided'.format(taps_per_phase))
+    if decimation == 1:
+        return np.ones(1)
+
+    num_taps = decimation * taps_per_phase
+    # Cutoff in cycles per input sample.
+    cutoff_frequency = cutoff * 0.5 / decimation
+    n = np.arange(num_taps) - (num_taps - 1) / 2
+    taps = np.sinc(2 * cutoff_frequency * n) * \
+        np.kaiser(num_taps, _KAISER_BETA)
+    return taps / taps.sum()
+
+
+class FirDecimator:
+    """Low pass filters and decimates a multi-channel stream.
+
+    The output sample k is the filtered value at input sample k * decimation,
+    delayed by `delay_samples` input samples.
+
+    Args:
+        decimation (int): Ratio between the input and the output rate.
+        num_channels (int): Number of values per sample.
+        taps (:obj:`numpy.array`): Filter taps. If None, they are designed
+            with `lowpass_taps`.
+        taps_per_phase (int): Length of the designed filter, see
+            `lowpass_taps`.
+
+    Raises:
+        ValueError: Invalid decimation factor or filter length.
+    """
+
+    def __init__(self, decimation, num_channels, taps=None,
+                 taps_per_phase=_DEFAULT_TAPS_PER_PHASE):
+        if decimation < 1:
+            raise ValueError('The decimation factor must be at least 1, '
+                             'but {} was provided'.format(decimation))
+
+        self._decimation = decimation
+        self._num_channels = num_channels
+        taps = lowpass_taps(decimation, taps_per_phase) if taps is None \
+            else np.asarray(taps)
+        # Reversed, so that the filter is a dot product with the window of
+        # the most recent samples.
+        self._reversed_taps = np.ascontiguousarray(taps[::-1], dtype=float)
+        self._history_size = len(taps) - 1
+
+        # History followed by the current block. Grown when a larger block
+        # arrives.
+        self._buffer = np.empty((self._history_size, num_channels))
+        self._is_initialized = False
+
+        # Index in the next block of the next input sample with an output.
+        self._phase = 0
+
+    @property
+    def decimation(self):
+        return self._decimation
+
+    @property
+    def delay_samples(self):
+        """Delay of the output, in input samples."""
+        return self._history_size / 2
+
+    def _ensure_capacity(self, num_samples):
+        size = self._history_size + num_samples
+        if len(self._buffer) >= size:
+            return
+        buffer = np.empty((size, self._num_channels))
+        buffer[:self._history_size] = self._buffer[:self._history_size]
+        self._buffer = buffer
+
+    def process(self, samples):
+        """Filters a block of samples with shape (N, num_channels), the oldest
+        first, and returns the decimated output with shape (K, num_channels).
+        """
+        samples = np.asarray(samples, dtype=float)
+        num_samples = len(samples)
+        if num_samples == 0:
+            return np.empty((0, self._num_channels))
+
+        self._ensure_capacity(num_samples)
+        if not self._is_initialized:
+            # Start as if the first sample had always been there, to avoid
+            # a transient from zero.
+            self._buffer[:self._history_size] = samples[0]
+            self._is_initialized = True
+
+        end = self._history_size + num_samples
+        self._buffer[self._history_size:end] = samples
+
+        windows = np.lib.stride_tricks.sliding_window_view(
+            self._buffer[:end], len(self._reversed_taps), axis=0)
+        output = windows[self._phase::self._decimation] @ self._reversed_taps
+
+        self._phase = (self._phase - num_samples) % self._decimation
+        self._buffer[:self._history_size] = \
+            self._buffer[num_samples:end].copy()
+        return output
+
+    def reset(self):
+        self._is_initialized = False
+        self._phase = 0
+
+
+class DecimatingFanout:
+    """Feeds a full-rate stream to subscribers, each with its own decimation
+    factor.
+
+    Args:
+        num_channels (int): Number of values per sample.
+    """
+
+    def __init__(self, num_channels):
+        self._num_channels = num_channels
+        self._subscribers = []
+
+    def subscribe(self, decimation, callback,
+                  taps_per_phase=_DEFAULT_TAPS_PER_PHASE):
+        """Registers a callback called with the blocks of decimated samples,
+        arrays with shape (K, num_channels), whenever K > 0. Fewer taps per
+        phase lower the delay of the samples, and the rejection of
+        the frequencies that alias.
+
+        Returns:
+            The :obj:`FirDecimator` of the subscriber.
+        """
+        decimator = FirDecimator(decimation, self._num_channels,
+                                 taps_per_phase=taps_per_phase)
+        self._subscribers.append((decimator, callback))
+        return decimator
+
+    def unsubscribe(self, callback):
+        self._subscribers = [(decimator, c) for decimator, c in
+                             self._subscribers if c is not callback]
+
+    def reset(self):
+        """Restarts all the decimators, e.g. after a gap in the stream."""
+        for decimator, _ in self._subscribers:
+            decimator.reset()
+
+    def process(self, samples):
+        for decimator, callback in self._subscribers:
+            output = decimator.process(samples)
+            if len(output):
+                callback(output)
+
+
+def first_order_recursion(inputs, pole, initial=0.):
+    """Returns the outputs of the recursion
+        y[n] = pole * y[n - 1] + inputs[n]
+    along the first axis, with y[-1] = initial.
+
+    The samples are split in blocks, long enough for the response to an
+    input to decay below the float64 precision within one block. In every
+    block the response to its inputs is a scaled cumulative sum, and only
+    the previous block carries over, so all blocks are computed at once.
+
+    Args:
+        inputs (:obj:`numpy.array`): Array with shape (N,) or (N, C).
+        pole (float): Between 0 and 1.
+        initial: Output before the first input, a scalar or an array with
+            shape (C,).
+
+    Raises:
+        ValueError: Pole out of range.
+    """
+    if not 0 <= pole <= 1:
+        raise ValueError('The pole must be between 0 and 1, '
+                         'but {} was provided'.format(pole))
+    inputs = np.asarray(inputs, dtype=float)
+    if pole == 0 or len(inputs) == 0:
+        return inputs.copy()
+    if pole == 1:
+        return np.cumsum(inputs, axis=0) + initial
+
+    num_samples = len(inputs)
+    block_size = min(num_samples, max(1, int(
+        _RECURSION_BLOCK_DECADES / -math.log10(pole))))
+    num_blocks = -(-num_samples // block_size)
+    padded = np.zeros((num_blocks * block_size,) + inputs.shape[1:])
+    padded[:num_samples] = inputs
+    blocks = padded.reshape((num_blocks, block_size) + inputs.shape[1:])
+
+    # Response of every block to its own inputs, from a zero state:
+    #   y[i] = pole^i * sum_{k <= i} inputs[k] / pole^k
+    powers = pole ** np.arange(block_size)
+    powers = powers.reshape((1, block_size) + (1,) * (inputs.ndim - 1))
+    outputs = np.cumsum(blocks / powers, axis=1) * powers
+
+    # State at the end of the previous block. The response to the states of
+    # older blocks has decayed below the precision.
+    carry = pole ** block_size
+    ends = outputs[:, -1]
+    states = np.empty_like(ends)
+    states[0] = initial
+    if num_blocks > 1:
+        states[1:] = ends[:-1]
+        states[2:] += carry * ends[:-2]
+        states[1] += carry * np.asarray(initial)
+    outputs += pole * powers * states[:, np.newaxis]
+    return outputs.reshape(padded.shape)[:num_samples]
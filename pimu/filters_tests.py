@@ -0,0 +1,111 @@
+import unittest
+
+import numpy as np
+
+from pimu.filters import DecimatingFanout, FirDecimator, \
+    first_order_recursion, lowpass_taps
+
+
+def _sine(frequency_hz, rate_hz, num_samples):
+    return np.sin(2 * np.pi * frequency_hz * np.arange(num_samples) / rate_hz)
+
+
+class LowpassTapsTest(unittest.TestCase):
+
+    def test_unit_gain_at_zero_frequency(self):
+        self.assertAlmostEqual(1, lowpass_taps(decimation=20).sum())
+
+    def test_no_filter_without_decimation(self):
+        np.testing.assert_array_equal([1], lowpass_taps(decimation=1))
+
+    def test_at_least_one_tap_per_phase(self):
+        with self.assertRaises(ValueError):
+            lowpass_taps(decimation=3, taps_per_phase=0)
+
+
+class FirDecimatorTest(unittest.TestCase):
+
+    def test_block_splitting_does_not_change_output(self):
+        samples = np.random.default_rng(0).normal(size=(500, 3))
+        whole = FirDecimator(decimation=7, num_channels=3).process(samples)
+
+        decimator = FirDecimator(decimation=7, num_channels=3)
+        blocks = [decimator.process(block) for block in
+                  np.split(samples, [1, 4, 50, 51, 300])]
+        np.testing.assert_allclose(whole, np.concatenate(blocks))
+        self.assertEqual(int(np.ceil(500 / 7)), len(whole))
+
+    def test_constant_is_preserved(self):
+        samples = np.tile([0, 0, 1], (200, 1))
+        output = FirDecimator(decimation=20, num_channels=3).process(samples)
+        np.testing.assert_allclose(np.tile([0, 0, 1], (10, 1)), output)
+
+    def test_fewer_taps_lower_the_delay(self):
+        # 1 kHz to 50 Hz: 8 output periods by default, 1 with 2 taps.
+        self.assertAlmostEqual(
+            159.5, FirDecimator(decimation=20, num_channels=1).delay_samples)
+        decimator = FirDecimator(decimation=20, num_channels=1,
+                                 taps_per_phase=2)
+        self.assertAlmostEqual(19.5, decimator.delay_samples)
+        # A ramp, once the filter has filled.
+        output = decimator.process(np.arange(200.)[:, np.newaxis])
+        np.testing.assert_allclose(np.arange(2, 10) * 20 - 19.5,
+                                   output[2:, 0])
+
+    def test_vibration_above_output_nyquist_is_removed(self):
+        # 1 kHz to 50 Hz: a 180 Hz vibration would alias to 20 Hz.
+        rate_hz = 1000
+        decimator = FirDecimator(decimation=20, num_channels=1)
+        vibration = _sine(180, rate_hz, 4000)[:, np.newaxis]
+        output = decimator.process(vibration)
+        # Skip the start-up transient.
+        self.assertLess(np.max(np.abs(output[20:])), 1e-3)
+
+        # Plain subsampling keeps it.
+        self.assertGreater(np.max(np.abs(vibration[::20])), 0.5)
+
+    def test_passband_signal_is_kept(self):
+        decimator = FirDecimator(decimation=20, num_channels=1)
+        signal = _sine(5, 1000, 4000)[:, np.newaxis]
+        output = decimator.process(signal)
+        # RMS of a unit sine.
+        self.assertAlmostEqual(np.sqrt(0.5), np.std(output[20:]), delta=0.01)
+
+
+class DecimatingFanoutTest(unittest.TestCase):
+
+    def test_each_subscriber_has_its_own_rate(self):
+        fanout = DecimatingFanout(num_channels=2)
+        received = {2: [], 5: []}
+        for decimation, outputs in received.items():
+            fanout.subscribe(decimation, outputs.append)
+
+        for block in np.split(np.ones((100, 2)), 10):
+            fanout.process(block)
+
+        self.assertEqual(50, sum(len(o) for o in received[2]))
+        self.assertEqual(20, sum(len(o) for o in received[5]))
+
+
+class FirstOrderRecursionTest(unittest.TestCase):
+
+    def test_matches_a_loop(self):
+        inputs = np.random.default_rng(0).normal(size=(1000, 2))
+        initial = np.array([3., -2.])
+        for pole in (0, 0.2, 0.9, 0.999, 1):
+            expected = np.empty_like(inputs)
+            output = initial
+            for idx, value in enumerate(inputs):
+                output = pole * output + value
+                expected[idx] = output
+            np.testing.assert_allclose(
+                expected, first_order_recursion(inputs, pole, initial),
+                atol=1e-9)
+
+    def test_pole_out_of_range(self):
+        with self.assertRaises(ValueError):
+            first_order_recursion(np.ones(10), 1.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -71,6 +71,41 @@ def build_rotation_matrix(yaw_rad, pitch_rad, roll_rad):
     return rotation_matrix
 
 
+def build_rotation_matrices(yaw_rad, pitch_rad, roll_rad, out=None):
+    """Builds the rotation matrices of arrays of angles at once, with the same
+    convention as `build_rotation_matrix`.
+
+    Args:
+        yaw_rad (:obj:`numpy.array`): Array with shape (N,) of rotations
+            around the Z axis in radians.
+        pitch_rad (:obj:`numpy.array`): Array with shape (N,) of rotations
+            around the Y axis in radians.
+        roll_rad (:obj:`numpy.array`): Array with shape (N,) of rotations
+            around the X axis in radians.
+        out (:obj:`numpy.array`): If set, array with shape (N, 3, 3) where
+            the matrices are written.
+
+    Returns:
+        A numpy array with shape (N, 3, 3).
+    """
+    cy, sy = np.cos(yaw_rad), np.sin(yaw_rad)
+    cp, sp = np.cos(pitch_rad), np.sin(pitch_rad)
+    cr, sr = np.cos(roll_rad), np.sin(roll_rad)
+
+    if out is None:
+        out = np.empty(np.shape(yaw_rad) + (3, 3))
+    out[..., 0, 0] = cy * cp
+    out[..., 0, 1] = cy * sp * sr - sy * cr
+    out[..., 0, 2] = cy * sp * cr + sy * sr
+    out[..., 1, 0] = sy * cp
+    out[..., 1, 1] = sy * sp * sr + cy * cr
+    out[..., 1, 2] = sy * sp * cr - cy * sr
+    out[..., 2, 0] = -sp
+    out[..., 2, 1] = cp * sr
+    out[..., 2, 2] = cp * cr
+    return out
+
+
 def tait_bryan_angles_from_rotation_matrix(rotation_matrix):
     """Returns a tuple of Tait-Bryan angles in radians (yaw, pitch, roll)
     that generated the provided rotation matrix.
@@ -129,3 +164,81 @@ def tait_bryan_angles_from_rotation_matrix(rotation_matrix):
     yaw = np.arctan2(R21 / np.cos(pitch), R11 / np.cos(pitch))
 
     return yaw, pitch, roll
+
+
+def quaternions_from_tait_bryan_angles(yaw_rad, pitch_rad, roll_rad):
+    """Returns the unit quaternions (w, x, y, z) of the rotations given by
+    arrays of Tait-Bryan angles, with the same convention as
+    `build_rotation_matrix`.
+
+    Returns:
+        A numpy array with shape (N, 4).
+    """
+    half_yaw = np.multiply(yaw_rad, 0.5)
+    half_pitch = np.multiply(pitch_rad, 0.5)
+    half_roll = np.multiply(roll_rad, 0.5)
+    cy, sy = np.cos(half_yaw), np.sin(half_yaw)
+    cp, sp = np.cos(half_pitch), np.sin(half_pitch)
+    cr, sr = np.cos(half_roll), np.sin(half_roll)
+
+    quaternions = np.empty(np.shape(yaw_rad) + (4,))
+    quaternions[..., 0] = cr * cp * cy + sr * sp * sy
+    quaternions[..., 1] = sr * cp * cy - cr * sp * sy
+    quaternions[..., 2] = cr * sp * cy + sr * cp * sy
+    quaternions[..., 3] = cr * cp * sy - sr * sp * cy
+    return quaternions
+
+
+def tait_bryan_angles_from_quaternions(quaternions):
+    """Returns the Tait-Bryan angles of arrays of unit quaternions, the
+    inverse of `quaternions_from_tait_bryan_angles`.
+
+    Args:
+        quaternions (:obj:`numpy.array`): Array with shape (N, 4) of
+            quaternions (w, x, y, z).
+
+    Returns:
+        A tuple of arrays with shape (N,) of angles in radians (yaw, pitch,
+        roll).
+    """
+    w, x, y, z = np.moveaxis(quaternions, -1, 0)
+    yaw = np.arctan2(2 * (w * z + x * y), 1 - 2 * (y * y + z * z))
+    pitch = np.arcsin(np.clip(2 * (w * y - z * x), -1, 1))
+    roll = np.arctan2(2 * (w * x + y * z), 1 - 2 * (x * x + y * y))
+    return yaw, pitch, roll
+
+
+def slerp(quaternions_from, quaternions_to, fractions):
+    """Spherical linear interpolation between arrays of unit quaternions.
+
+    The shortest path is taken, so that interpolating between q and a
+    rotation close to -q does not go the long way around.
+
+    Args:
+        quaternions_from (:obj:`numpy.array`): Array with shape (N, 4).
+        quaternions_to (:obj:`numpy.array`): Array with shape (N, 4).
+        fractions (:obj:`numpy.array`): Array with shape (N,) of fractions of
+            the way from `quaternions_from` to `quaternions_to`.
+
+    Returns:
+        A numpy array with shape (N, 4) of unit quaternions.
+    """
+    fractions = np.asarray(fractions, dtype=float)[..., np.newaxis]
+    cos_angle = np.einsum('...i,...i->...', quaternions_from,
+                          quaternions_to)[..., np.newaxis]
+    quaternions_to = np.where(cos_angle < 0, -quaternions_to, quaternions_to)
+    cos_angle = np.abs(cos_angle)
+
+    # Almost parallel quaternions are linearly interpolated, where the sine
+    # of the angle vanishes.
+    is_linear = cos_angle > 1 - _EPS
+    angle = np.arccos(np.minimum(cos_angle, 1))
+    sin_angle = np.where(is_linear, 1, np.sin(angle))
+    weight_from = np.where(is_linear, 1 - fractions,
+                           np.sin((1 - fractions) * angle) / sin_angle)
+    weight_to = np.where(is_linear, fractions,
+                         np.sin(fractions * angle) / sin_angle)
+
+    quaternions = weight_from * quaternions_from + weight_to * quaternions_to
+    quaternions /= np.linalg.norm(quaternions, axis=-1, keepdims=True)
+    return quaternions
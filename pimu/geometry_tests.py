@@ -96,6 +96,18 @@ class BuildRotationMatrixTest(unittest.TestCase):
                                        rotation_matrix)
 
 
+class BuildRotationMatricesTest(unittest.TestCase):
+
+    def test_matches_single_matrices(self):
+        angles = np.random.default_rng(0).uniform(-_PI, _PI, size=(10, 3))
+        rotation_matrices = geom.build_rotation_matrices(*angles.T)
+        self.assertEqual((10, 3, 3), rotation_matrices.shape)
+        for rotation_matrix, sample_angles in zip(rotation_matrices, angles):
+            np.testing.assert_allclose(
+                geom.build_rotation_matrix(*sample_angles), rotation_matrix,
+                atol=1e-12)
+
+
 class TaitBryanAnglesFromRotationMatrixTest(unittest.TestCase):
 
     def test_pitch_not_90_deg(self):
@@ -214,5 +226,35 @@ class TaitBryanAnglesFromRotationMatrixTest(unittest.TestCase):
             geom.tait_bryan_angles_from_rotation_matrix(np.zeros(3))
 
 
+class QuaternionTest(unittest.TestCase):
+
+    def test_round_trip_and_rotation_matrix(self):
+        angles_rad = np.deg2rad([[30, 10, -5], [-170, 60, 120], [0, 0, 0]])
+        quaternions = geom.quaternions_from_tait_bryan_angles(*angles_rad.T)
+        np.testing.assert_allclose(
+            angles_rad.T,
+            geom.tait_bryan_angles_from_quaternions(quaternions), atol=1e-12)
+
+        # Rotating a vector with the quaternion, q v q*, as with the matrix.
+        w, x, y, z = quaternions[0]
+        vector = np.array([1., 2., 3.])
+        u = np.array([x, y, z])
+        rotated = vector + 2 * np.cross(u, np.cross(u, vector) + w * vector)
+        np.testing.assert_allclose(
+            geom.build_rotation_matrix(*angles_rad[0]) @ vector, rotated)
+
+    def test_slerp(self):
+        quaternions = geom.quaternions_from_tait_bryan_angles(
+            np.deg2rad([170, -170]), np.zeros(2), np.zeros(2))
+        # The shortest path crosses 180 degrees.
+        midpoint = geom.slerp(quaternions[:1], quaternions[1:], [0.5])
+        yaw, pitch, roll = geom.tait_bryan_angles_from_quaternions(midpoint)
+        self.assertAlmostEqual(_PI, abs(yaw[0]), places=9)
+
+        ends = geom.slerp(quaternions, quaternions[::-1], [0, 1])
+        np.testing.assert_allclose(np.abs(quaternions),
+                                   np.abs(ends[[0, 0]]), atol=1e-12)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,24 +1,44 @@
 import logging
+import math
 import time
 
 import numpy as np
-from tqdm import tqdm
 
+import pimu.kernels as kernels
 import pimu.sensorboard as sb
+from pimu.instrumentation import NULL_INSTRUMENTATION
 
 _logger = logging.getLogger(__name__)
 
+# Returned by `Imu.read_next` in place of a sample that could not be read.
+INVALID_SAMPLE = (float('nan'),) * 7
+
+
+def is_valid(sample):
+    return not math.isnan(sample[0])
+
 
 class Imu:
 
     NUMBER_OF_CALIBRATION_SAMPLES = 1000
 
-    def __init__(self):
+    def __init__(self, instrumentation=None):
+        self._instrumentation = instrumentation or NULL_INSTRUMENTATION
+
         self._yaw_rad = 0
         self._pitch_rad = 0
         self._roll_rad = 0
         self._prev_time_ms = int(round(time.time() * 1000))
 
+        # The compiled kernels when available, the NumPy functions otherwise.
+        compiled = kernels.load()
+        if compiled is None:
+            self._pitch_and_roll = sb.pitch_and_roll_from_accelerometer_data
+            self._taitbryan_deltas = sb.gyroscope_data_to_taitbryan_deltas
+        else:
+            self._pitch_and_roll = compiled.pitch_and_roll
+            self._taitbryan_deltas = compiled.taitbryan_deltas
+
         # Bias that can be removed through calibration.
         self._acc_x_bias = 0
         self._acc_y_bias = 0
@@ -32,17 +52,33 @@ class Imu:
                                   'to implement this function')
 
     def read_yaw_pitch_roll(self):
-        acc_x, acc_y, acc_z, gyro_x, gyro_y, gyro_z, *other = self.read_next()
+        start_ns = self._instrumentation.start()
+        sample = self.read_next()
+        start_ns = self._instrumentation.stop('read', start_ns)
+        output = self.update(sample)
+        self._instrumentation.stop('fuse', start_ns)
+        return output
+
+    def update(self, sample):
+        """Updates the orientation with a new sample, as returned by
+        `read_next`, and returns the tuple (yaw, pitch, roll, *other).
+
+        An invalid sample leaves the orientation untouched and all the
+        returned values are NaN.
+        """
+        if not is_valid(sample):
+            return INVALID_SAMPLE[:3] + tuple(sample[6:])
+
+        acc_x, acc_y, acc_z, gyro_x, gyro_y, gyro_z, *other = sample
         curr_time_ms = int(round(time.time() * 1000))
         delta_time_ms = curr_time_ms - self._prev_time_ms
         self._prev_time_ms = curr_time_ms
 
         acc_pitch_rad, acc_roll_rad = \
-            sb.pitch_and_roll_from_accelerometer_data(acc_x, acc_y, acc_z)
+            self._pitch_and_roll(acc_x, acc_y, acc_z)
 
         gyro_yaw_delta_rad, gyro_pitch_delta_rad, gyro_roll_delta_rad = \
-            sb.gyroscope_data_to_taitbryan_deltas(gyro_x, gyro_y, gyro_z,
-                                                  delta_time_ms=delta_time_ms)
+            self._taitbryan_deltas(gyro_x, gyro_y, gyro_z, delta_time_ms)
 
         # self._yaw_rad += gyro_yaw_delta_rad
         # self._pitch_rad = 0.8 * acc_pitch_rad + \
@@ -57,6 +93,9 @@ class Imu:
         return output
 
     def calibrate(self):
+        # Only needed for the interactive calibration.
+        from tqdm import tqdm
+
         input('Place the IMU on a flat surface and press '
               'any key when you are ready. ')
 
@@ -70,7 +109,8 @@ class Imu:
             calibration_samples[sample_idx] = \
                 np.array([acc_x, acc_y, acc_z, gyro_x, gyro_y, gyro_z])
 
-        calibration = np.mean(calibration_samples, axis=0)
+        # Samples that could not be read are NaN.
+        calibration = np.nanmean(calibration_samples, axis=0)
 
         # When calibrating we assume the board's Z axis is pointing to ground.
         self._acc_x_bias = calibration[0]
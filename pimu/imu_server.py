@@ -1,29 +1,401 @@
-import json
+import collections
 import logging
+import math
 import time
 
 import numpy as np
 
+from pimu.control import ControlChannel
+from pimu.filters import DecimatingFanout
+from pimu.imu import is_valid
+from pimu.instrumentation import NULL_INSTRUMENTATION
+from pimu.metrics import Registry
+from pimu.mpu6050.bus import BusError
+from pimu.mpu6050.initialization import MotionDetection
 from pimu.mpu6050.mpu6050 import MPU6050
 from pimu.network import UDPServer
+from pimu.ringbuffer import RingBuffer
+from pimu.trace import SampledTrace
+from pimu.transmission import AlwaysSendPolicy, encode_full_frame
 
 _logger = logging.getLogger(__name__)
 
 
+# Fraction of the sensor period the loop sleeps after a sample, before
+# polling for the next one.
+_SLEEP_FRACTION = 0.8
+
+# Length of the anti-aliasing filter of the sent samples, in taps per unit
+# of decimation. One delays the angles by half an output period at most,
+# while the subscribers default to a longer, sharper filter.
+DEFAULT_FILTER_TAPS_PER_PHASE = 1
+
+# Time between two reads of the control channel.
+_CONTROL_POLL_INTERVAL_ns = 50000000
+
+# Accelerometer X, Y, Z, gyroscope X, Y, Z, temperature.
+_NUM_SAMPLE_VALUES = 7
+
+# Configuration of the event mode of `MPU6050Server`.
+#   idle_rate_hz: output rate of the sensor while the board is still,
+#       limited to the full rate.
+#   keepalive_s: time between two samples sent while the board is still.
+#   pre_trigger_s: how long before the motion interrupt the samples read
+#       while idle are sent when motion starts.
+EventMode = collections.namedtuple(
+    'EventMode', ['idle_rate_hz', 'keepalive_s', 'pre_trigger_s'],
+    defaults=(50, 1.0, 0.5))
+
+
 class MPU6050Server(UDPServer):
+    """Reads every sample of the MPU6050 once, as soon as it is ready, fuses
+    it, and sends the samples at `rate_hz`, timestamped with the server
+    monotonic clock.
+
+    The sensor output rate is set with the `sample_rate_hz` keyword argument
+    of `MPU6050`, and defaults to `rate_hz`. When it is higher, the raw
+    samples are low pass filtered and decimated before fusion, so that
+    vibrations do not alias into the angles. The filter delays the angles
+    by about `filter_taps_per_phase / 2` output periods, see
+    `filters.lowpass_taps`: the short default keeps the display responsive,
+    more taps reject the vibrations better. Other consumers of the filtered
+    raw samples, at their own rate and with their own filter, can be added
+    with `subscribe`.
+
+    In event mode the motion interrupts of the MPU6050 are enabled. When
+    the board becomes still, the sensor rate drops to the idle rate, so that
+    the host wakes up rarely, and only a keepalive sample is sent every
+    `EventMode.keepalive_s`. The samples read while idle are kept for
+    `EventMode.pre_trigger_s`: when motion starts they are sent first, so
+    that the client sees how the motion began, then the server streams at
+    full rate again. Subscribers only receive the full-rate samples.
+
+    With a `control_port`, the settings of the sensor can be changed while
+    running, see `pimu.control`.
+
+    With a `stream`, a started `network.StreamServer`, every sample read
+    from the sensor is queued on it, for consumers that must not lose any,
+    e.g. recorders: at the sensor rate, before filtering, decimation and
+    the send policy, and while idle too. The samples are full frames, see
+    `pimu.transmission`, of the 7 values of `MPU6050.read_next` timestamped
+    with the time they became ready. Samples that could not be read are
+    not sent.
+    """
 
-    def __init__(self, ip, port, rate_hz, calibrate, **kwargs):
+    def __init__(self, ip, port, rate_hz, calibrate, send_policy=None,
+                 trace_every=1, instrumentation=None, event_mode=None,
+                 control_port=None, stream=None,
+                 filter_taps_per_phase=DEFAULT_FILTER_TAPS_PER_PHASE,
+                 **kwargs):
         super().__init__(ip, port)
         self._rate_hz = rate_hz
-        self._mpu6050 = MPU6050(**kwargs)
+        self._filter_taps_per_phase = filter_taps_per_phase
+
+        self.metrics = Registry()
+        self._samples_total = self.metrics.counter(
+            'pimu_samples_total', 'Samples read from the sensor.')
+        self._packets_sent_total = self.metrics.counter(
+            'pimu_packets_sent_total', 'Packets sent to the client.')
+        self._send_errors_total = self.metrics.counter(
+            'pimu_send_errors_total', 'Packets that could not be sent.')
+        self._i2c_errors_total = self.metrics.counter(
+            'pimu_i2c_errors_total', 'Failed transfers on the I2C bus.')
+        self._invalid_samples_total = self.metrics.counter(
+            'pimu_invalid_samples_total',
+            'Samples that could not be read from the sensor, replaced by '
+            'the last valid one in packets flagged as held.')
+        self._loop_overruns_total = self.metrics.counter(
+            'pimu_loop_overruns_total',
+            'Sensor periods elapsed before a sample was read, where samples '
+            'may have been missed.')
+        self._sample_rate = self.metrics.gauge(
+            'pimu_sample_rate_hz', 'Measured sampling rate.')
+        self._temperature = self.metrics.gauge(
+            'pimu_temperature_celsius', 'Temperature of the sensor.')
+        self._idle = self.metrics.gauge(
+            'pimu_idle', '1 while the board is still in event mode.')
+        self._motion_events_total = self.metrics.counter(
+            'pimu_motion_events_total',
+            'Times streaming resumed because motion was detected.')
+
+        self._stream = stream
+        self._stream_dropped_total = self.metrics.counter(
+            'pimu_stream_dropped_total',
+            'Samples dropped by the backpressure policy of the stream.')
+
+        self._send_policy = send_policy or AlwaysSendPolicy()
+        self._trace = SampledTrace(_logger, every=trace_every)
+        self._instrumentation = instrumentation or NULL_INSTRUMENTATION
+        kwargs.setdefault('sample_rate_hz', rate_hz)
+        if event_mode is not None:
+            kwargs.setdefault('motion_detection', MotionDetection())
+        self._mpu6050 = MPU6050(trace_every=trace_every,
+                                instrumentation=instrumentation,
+                                **kwargs)
+
+        self._last_valid_sample = None
+        self._fanout = DecimatingFanout(num_channels=_NUM_SAMPLE_VALUES)
+        # The same bound method, so that it can be unsubscribed.
+        self._send_callback = self._fuse_and_send
+        self._block_start_ns = 0
+        # Whether the current block holds samples that could not be read.
+        self._block_is_held = False
+        self._set_full_rate(self._mpu6050.sensor_rate_hz)
+
+        self._event_mode = event_mode
+        self._is_idle = False
+        if event_mode is not None:
+            capacity = max(1, int(math.ceil(event_mode.pre_trigger_s *
+                                            event_mode.idle_rate_hz)))
+            self._pre_trigger = RingBuffer(capacity, _NUM_SAMPLE_VALUES)
+            self._pre_trigger_times_ns = RingBuffer(capacity, dtype=np.int64)
+            self._keepalive_ns = int(event_mode.keepalive_s * 1e9)
+            self._last_sent_ns = None
         if calibrate:
             self._mpu6050.calibrate()
 
-    def run(self):
+        self._control = None
+        if control_port is not None:
+            self._control = ControlChannel(control_port, self.reconfigure)
+        self._next_control_poll_ns = 0
+
+    @property
+    def sensor_rate_hz(self):
+        return self._mpu6050.sensor_rate_hz
+
+    @property
+    def settings(self):
+        """The `SensorSettings` of the sensor, with the full rate also while
+        idle in event mode.
+        """
+        return self._mpu6050.settings._replace(
+            sample_rate_hz=self._full_rate_hz)
+
+    def _set_full_rate(self, sensor_rate_hz):
+        """Sets up the filtering and decimation of the full-rate samples
+        to the output rate.
+        """
+        self._full_rate_hz = sensor_rate_hz
+        self._sensor_period_s = 1 / sensor_rate_hz
+        self._send_every = max(1, int(round(sensor_rate_hz / self._rate_hz)))
+        _logger.info('Sending one sample every {} at {:.2f} Hz'.format(
+            self._send_every, sensor_rate_hz / self._send_every))
+
+        # Raw samples are filtered in blocks of one output sample.
+        self._block = np.empty((self._send_every, _NUM_SAMPLE_VALUES))
+        self._num_block_samples = 0
+        self._fanout.unsubscribe(self._send_callback)
+        self._fanout.reset()
+        decimator = self._fanout.subscribe(
+            self._send_every, self._send_callback,
+            taps_per_phase=self._filter_taps_per_phase)
+
+        # Samples are timestamped with the time their first raw sample was
+        # ready, minus the delay of the filter.
+        self._sensor_period_ns = int(1e9 / sensor_rate_hz)
+        self._filter_delay_ns = \
+            int(decimator.delay_samples * self._sensor_period_ns)
+
+    def reconfigure(self, **changes):
+        """Changes the settings of the sensor between two samples, see
+        `MPU6050.reconfigure`, and adapts the decimation to the new sensor
+        rate. The output rate is unchanged, while the subscribers keep their
+        decimation factor. In event mode the rate is the full one, and
+        the sensor stays at the idle rate until motion is detected.
+
+        Returns:
+            The `SensorSettings` in effect.
+        """
+        if not changes:
+            return self.settings
+        if self._is_idle:
+            changes.setdefault('sample_rate_hz', self._full_rate_hz)
+        previous_rate_hz = self._mpu6050.sensor_rate_hz
+        is_applied = False
+        try:
+            self._mpu6050.reconfigure(**changes)
+            is_applied = True
+        finally:
+            sensor_rate_hz = self._mpu6050.sensor_rate_hz
+            # A rejected request leaves the sensor, and the full rate,
+            # unchanged.
+            if is_applied or sensor_rate_hz != previous_rate_hz:
+                if self._is_idle:
+                    self._set_full_rate(sensor_rate_hz)
+                    self._set_sensor_rate(self._idle_rate_hz)
+                elif sensor_rate_hz != self._full_rate_hz:
+                    self._set_full_rate(sensor_rate_hz)
+        return self.settings
+
+    def _poll_control(self, now_ns):
+        if self._control is not None and now_ns >= self._next_control_poll_ns:
+            self._next_control_poll_ns = now_ns + _CONTROL_POLL_INTERVAL_ns
+            self._control.poll()
+
+    def subscribe(self, decimation, callback):
+        """Calls `callback` with the blocks of raw samples, as returned by
+        `MPU6050.read_next`, filtered and decimated by the given factor with
+        respect to the sensor rate. Blocks are delivered at `rate_hz`.
+        """
+        return self._fanout.subscribe(decimation, callback)
+
+    def _update_sample_rate(self, now_s):
+        elapsed_s = now_s - self._rate_time_s
+        if elapsed_s >= 1:
+            self._sample_rate.set(
+                (self._samples_total.value - self._rate_num_samples) /
+                elapsed_s)
+            self._rate_num_samples = self._samples_total.value
+            self._rate_time_s = now_s
+
+    def run(self, profile_s=None, profile_output=None):
+        """Samples until interrupted.
+
+        Args:
+            profile_s (float): If set, the loop is profiled for this many
+                seconds from its start, see `Instrumentation.profile`, which
+                leaves out the initialization and the calibration.
+            profile_output (str): File where the profile is written.
+        """
+        instr = self._instrumentation
+        if profile_s is not None:
+            instr.profile(duration_s=profile_s, output_path=profile_output)
+        self._rate_time_s = time.monotonic()
+        self._rate_num_samples = 0
         while True:
-            yaw_rad, pitch_rad, roll_rad, temperature_deg = \
-                self._mpu6050.read_yaw_pitch_roll()
+            if not self._mpu6050.wait_for_data(
+                    timeout_s=self._sensor_period_s):
+                self._poll_control(time.monotonic_ns())
+                continue
+            ready_ns = time.monotonic_ns()
+            loop_start_ns = instr.start()
+            self._process_next_sample(ready_ns)
+            instr.stop('loop', loop_start_ns)
+            instr.maybe_report()
+            self._poll_control(ready_ns)
+            self._sleep_until_next_sample(ready_ns / 1e9)
+
+    def _process_next_sample(self, ready_ns):
+        """Reads the sample that became ready at `ready_ns`, in ns of
+        the monotonic clock, and sends or buffers it.
+        """
+        instr = self._instrumentation
+        start_ns = instr.start()
+        sample = self._mpu6050.read_next()
+        start_ns = instr.stop('read', start_ns)
+        self._samples_total.inc()
+        self._i2c_errors_total.value = self._mpu6050.num_bus_errors
+
+        is_held = not is_valid(sample)
+        if not is_held:
+            self._last_valid_sample = sample
+            if self._stream is not None:
+                start_ns = self._send_to_stream(sample, ready_ns)
+        else:
+            self._invalid_samples_total.inc()
+            # Hold the last valid sample, since NaNs would spread through
+            # the filter, and flag the packets computed from it.
+            sample = self._last_valid_sample
+        if self._event_mode is not None:
+            self._update_motion_state()
+        if sample is not None and self._is_idle:
+            self._process_idle_sample(sample, ready_ns, is_held)
+        elif sample is not None:
+            if self._num_block_samples == 0:
+                self._block_start_ns = ready_ns
+                self._block_is_held = False
+            self._block_is_held |= is_held
+            self._block[self._num_block_samples] = sample
+            self._num_block_samples += 1
+            if self._num_block_samples == self._send_every:
+                self._num_block_samples = 0
+                self._fanout.process(self._block)
+                instr.stop('filter', start_ns)
+
+    def _update_motion_state(self):
+        is_moving = self._mpu6050.poll_motion()
+        if is_moving is None or is_moving != self._is_idle:
+            return
+        if is_moving:
+            self._wake_up()
+        else:
+            self._go_idle()
 
+    @property
+    def _idle_rate_hz(self):
+        """The idle rate, never above the full one."""
+        return min(self._event_mode.idle_rate_hz, self._full_rate_hz)
+
+    def _set_sensor_rate(self, rate_hz):
+        try:
+            rate_hz = self._mpu6050.set_sample_rate(rate_hz)
+        except BusError as e:
+            _logger.warning('Sensor rate not changed: {}'.format(e))
+            rate_hz = self._mpu6050.sensor_rate_hz
+        self._sensor_period_s = 1 / rate_hz
+        return rate_hz
+
+    def _go_idle(self):
+        rate_hz = self._set_sensor_rate(self._idle_rate_hz)
+        self._is_idle = True
+        self._idle.set(1)
+        # The partial block is dropped, the filter restarts on wake up.
+        self._num_block_samples = 0
+        self._last_sent_ns = None
+        _logger.info('Board still, sensor rate {:.2f} Hz'.format(rate_hz))
+
+    def _wake_up(self):
+        rate_hz = self._set_sensor_rate(self._full_rate_hz)
+        self._is_idle = False
+        self._idle.set(0)
+        self._motion_events_total.inc()
+        self._fanout.reset()
+        _logger.info('Motion detected, sensor rate {:.2f} Hz'.format(rate_hz))
+        if self._last_sent_ns is not None:
+            self._send_pre_trigger()
+
+    def _send_pre_trigger(self):
+        """Sends the samples read since the last keepalive, within
+        the pre-trigger time, in order.
+        """
+        num_samples = len(self._pre_trigger)
+        times_ns = self._pre_trigger_times_ns.last(num_samples)
+        samples = self._pre_trigger.last(num_samples)
+        is_new = times_ns > self._last_sent_ns
+        for sample, timestamp_ns in zip(samples[is_new], times_ns[is_new]):
+            self._fuse_and_send_sample(tuple(sample.tolist()),
+                                      int(timestamp_ns))
+
+    def _process_idle_sample(self, sample, ready_ns, is_held):
+        # Held samples are repeats, not worth replaying on wake up.
+        if not is_held:
+            self._pre_trigger.append(sample)
+            self._pre_trigger_times_ns.append(ready_ns)
+        if self._last_sent_ns is None or \
+                ready_ns - self._last_sent_ns >= self._keepalive_ns:
+            self._last_sent_ns = ready_ns
+            self._fuse_and_send_sample(sample, ready_ns, is_held)
+
+    def _fuse_and_send(self, samples):
+        timestamp_ns = self._block_start_ns - self._filter_delay_ns
+        for sample in samples:
+            self._fuse_and_send_sample(sample, timestamp_ns,
+                                       self._block_is_held)
+            timestamp_ns += self._send_every * self._sensor_period_ns
+
+    def _fuse_and_send_sample(self, sample, timestamp_ns, is_held=False):
+        start_ns = self._instrumentation.start()
+        yaw_rad, pitch_rad, roll_rad, temperature_deg = \
+            self._mpu6050.update(sample)
+        self._instrumentation.stop('fuse', start_ns)
+        self._temperature.set(temperature_deg)
+        self._send(yaw_rad, pitch_rad, roll_rad, temperature_deg,
+                   timestamp_ns, is_held)
+
+    def _send(self, yaw_rad, pitch_rad, roll_rad, temperature_deg,
+              timestamp_ns, is_held):
+        instr = self._instrumentation
+        if self._trace():
             _logger.debug('yaw={:> 6.1f}°, '
                           'pitch={:> 6.1f}°, '
                           'roll={:> 6.1f}°, '
@@ -32,6 +404,42 @@ class MPU6050Server(UDPServer):
                                                     np.rad2deg(roll_rad),
                                                     temperature_deg))
 
-            data = json.dumps([yaw_rad, pitch_rad, roll_rad, temperature_deg])
-            self.send(data)
-            time.sleep(1 / self._rate_hz)
+        start_ns = instr.start()
+        data = self._send_policy.encode(
+            (yaw_rad, pitch_rad, roll_rad, temperature_deg),
+            time_s=time.monotonic(),
+            timestamp_ns=timestamp_ns,
+            is_held=is_held)
+        start_ns = instr.stop('encode', start_ns)
+        if data is not None:
+            try:
+                self.send(data)
+                self._packets_sent_total.inc()
+            except OSError as e:
+                self._send_errors_total.inc()
+                _logger.warning('Send failed: {}'.format(e))
+            instr.stop('send', start_ns)
+
+    def _send_to_stream(self, sample, ready_ns):
+        """Queues a raw sample on the stream, and returns the time the stage
+        ended as `Instrumentation.stop`.
+        """
+        start_ns = self._instrumentation.start()
+        if not self._stream.send(encode_full_frame(sample, ready_ns)):
+            self._stream_dropped_total.inc()
+        return self._instrumentation.stop('stream', start_ns)
+
+    def _sleep_until_next_sample(self, ready_s):
+        """Sleeps for most of the sensor period after the sample that became
+        ready at `ready_s`, so that the bus is polled only shortly before
+        the next one. The schedule follows the sensor clock rather than
+        the host one.
+        """
+        now_s = time.monotonic()
+        self._update_sample_rate(now_s)
+        if now_s - ready_s > self._sensor_period_s:
+            self._loop_overruns_total.inc()
+            return
+        wake_s = ready_s + _SLEEP_FRACTION * self._sensor_period_s
+        if wake_s > now_s:
+            time.sleep(wake_s - now_s)
@@ -0,0 +1,206 @@
+import unittest
+from unittest import mock
+
+import pimu.transmission as tx
+from pimu.imu import INVALID_SAMPLE
+from pimu.imu_server import EventMode, MPU6050Server
+from pimu.instrumentation import Instrumentation
+from pimu.mpu6050.fakebus import FakeBus
+
+_PORT = 50371
+_MS_ns = 1000000
+
+
+class EventModeTest(unittest.TestCase):
+    """Drives the sampling loop of the server one sample at a time, with
+    the motion interrupts of a `FakeBus`.
+    """
+
+    def setUp(self):
+        self.bus = FakeBus()
+        # Sent packets, as tuples (timestamp_ns, values).
+        self.sent = []
+
+    def _server(self, rate_hz=50, sample_rate_hz=1000, **event_mode):
+        server = MPU6050Server(ip='127.0.0.1', port=_PORT, rate_hz=rate_hz,
+                               calibrate=False, gyro_sensitivity='250',
+                               acc_sensitivity='2g', bus=self.bus,
+                               sample_rate_hz=sample_rate_hz,
+                               event_mode=EventMode(**event_mode))
+        self.addCleanup(server.close)
+        decoder = tx.FrameDecoder()
+
+        def send(data):
+            values = decoder.decode(data)
+            self.sent.append((decoder.timestamp_ns, values))
+
+        server.send = send
+        return server
+
+    def _sample(self, server, ready_ns, is_moving=None):
+        if is_moving is not None:
+            self.bus.set_motion(is_moving)
+        self.bus.set_raw_sample(acc=(0, 0, 16384), temperature=0,
+                                gyro=(0, 0, 0))
+        # Reads INT_STATUS, with the motion interrupts, as the loop.
+        self.assertTrue(server._mpu6050.wait_for_data(timeout_s=0))
+        server._process_next_sample(ready_ns)
+
+    def test_going_idle_lowers_the_sensor_rate(self):
+        server = self._server(idle_rate_hz=50)
+        self._sample(server, 0, is_moving=False)
+        self.assertTrue(server._is_idle)
+        self.assertEqual(1, server._idle.value)
+        self.assertEqual(50, server.sensor_rate_hz)
+        # The full rate is kept for the wake up.
+        self.assertEqual(1000, server.settings.sample_rate_hz)
+
+    def test_idle_rate_is_limited_to_the_full_rate(self):
+        server = self._server(rate_hz=10, sample_rate_hz=10, idle_rate_hz=50)
+        full_rate_hz = server.sensor_rate_hz
+        self.assertLess(full_rate_hz, 50)
+        self._sample(server, 0, is_moving=False)
+        self.assertTrue(server._is_idle)
+        self.assertEqual(full_rate_hz, server.sensor_rate_hz)
+
+    def test_keepalive_pacing(self):
+        server = self._server(idle_rate_hz=50, keepalive_s=1.0)
+        for time_ms in range(0, 3000, 20):
+            self._sample(server, time_ms * _MS_ns,
+                         is_moving=False if time_ms == 0 else None)
+        self.assertEqual([0, 1000 * _MS_ns, 2000 * _MS_ns],
+                         [timestamp_ns for timestamp_ns, _ in self.sent])
+
+    def test_pre_trigger_samples_are_sent_on_wake_up(self):
+        server = self._server(idle_rate_hz=50, keepalive_s=1.0,
+                              pre_trigger_s=0.2)
+        for time_ms in range(0, 1500, 20):
+            self._sample(server, time_ms * _MS_ns,
+                         is_moving=False if time_ms == 0 else None)
+        self.sent.clear()
+
+        self._sample(server, 1500 * _MS_ns, is_moving=True)
+        self.assertFalse(server._is_idle)
+        self.assertEqual(1000, server.sensor_rate_hz)
+        self.assertEqual(1, server._motion_events_total.value)
+        # The last 0.2 s of idle samples, in order.
+        self.assertEqual([time_ms * _MS_ns for time_ms in range(1300, 1500,
+                                                                 20)],
+                         [timestamp_ns for timestamp_ns, _ in self.sent])
+
+        # Then the full-rate samples are sent at the output rate.
+        for time_ms in range(1501, 1600):
+            self._sample(server, time_ms * _MS_ns)
+        self.assertEqual(10 + 5, len(self.sent))
+
+
+class HeldSampleTest(unittest.TestCase):
+
+    def test_packets_of_held_samples_are_flagged(self):
+        bus = FakeBus()
+        server = MPU6050Server(ip='127.0.0.1', port=_PORT, rate_hz=50,
+                               calibrate=False, gyro_sensitivity='250',
+                               acc_sensitivity='2g', bus=bus,
+                               sample_rate_hz=1000)
+        self.addCleanup(server.close)
+        decoder = tx.FrameDecoder()
+        held = []
+
+        def send(data):
+            decoder.decode(data)
+            held.append(decoder.is_held)
+
+        server.send = send
+        bus.set_raw_sample(acc=(0, 0, 16384), temperature=0, gyro=(0, 0, 0))
+        for idx in range(60):
+            if idx == 25:
+                with mock.patch.object(server._mpu6050, 'read_next',
+                                       return_value=INVALID_SAMPLE):
+                    server._process_next_sample(idx * _MS_ns)
+            else:
+                server._process_next_sample(idx * _MS_ns)
+        self.assertEqual([False, True, False], held)
+        self.assertEqual(1, server._invalid_samples_total.value)
+
+
+class FilterTest(unittest.TestCase):
+
+    def test_filter_length_sets_the_delay(self):
+        # The default is below half an output period.
+        for kwargs, delay_ms in (({}, 9.5),
+                                 ({'filter_taps_per_phase': 16}, 159.5)):
+            server = MPU6050Server(ip='127.0.0.1', port=_PORT, rate_hz=50,
+                                   calibrate=False, gyro_sensitivity='250',
+                                   acc_sensitivity='2g', bus=FakeBus(),
+                                   sample_rate_hz=1000, **kwargs)
+            self.addCleanup(server.close)
+            self.assertEqual(int(delay_ms * _MS_ns), server._filter_delay_ns)
+
+
+class ProfileTest(unittest.TestCase):
+
+    def test_profile_starts_with_the_loop(self):
+        instrumentation = Instrumentation()
+        with mock.patch.object(instrumentation, 'profile') as profile:
+            server = MPU6050Server(ip='127.0.0.1', port=_PORT, rate_hz=50,
+                                   calibrate=False, gyro_sensitivity='250',
+                                   acc_sensitivity='2g', bus=FakeBus(),
+                                   instrumentation=instrumentation)
+            self.addCleanup(server.close)
+            profile.assert_not_called()
+            with mock.patch.object(server._mpu6050, 'wait_for_data',
+                                   side_effect=KeyboardInterrupt):
+                with self.assertRaises(KeyboardInterrupt):
+                    server.run(profile_s=5, profile_output='loop.prof')
+        profile.assert_called_once_with(duration_s=5,
+                                        output_path='loop.prof')
+
+
+class _Stream:
+    """Stands for a `network.StreamServer` whose queue holds `capacity`
+    frames.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.frames = []
+
+    def send(self, data):
+        if len(self.frames) == self.capacity:
+            return False
+        self.frames.append(data)
+        return True
+
+
+class StreamTest(unittest.TestCase):
+
+    def test_every_sample_is_streamed_at_the_sensor_rate(self):
+        bus = FakeBus()
+        stream = _Stream(capacity=95)
+        server = MPU6050Server(ip='127.0.0.1', port=_PORT, rate_hz=50,
+                               calibrate=False, gyro_sensitivity='250',
+                               acc_sensitivity='2g', bus=bus,
+                               sample_rate_hz=1000, stream=stream)
+        self.addCleanup(server.close)
+        sent = []
+        server.send = sent.append
+
+        for idx in range(100):
+            bus.set_raw_sample(acc=(0, 0, 16384), temperature=0,
+                               gyro=(131 * idx, 0, 0))
+            server._process_next_sample(idx * _MS_ns)
+        # The UDP packets are decimated, the stream holds the raw samples.
+        self.assertEqual(5, len(sent))
+        decoder = tx.FrameDecoder()
+        for idx, data in enumerate(stream.frames):
+            values = decoder.decode(data)
+            self.assertEqual(idx * _MS_ns, decoder.timestamp_ns)
+            self.assertEqual(7, len(values))
+            self.assertAlmostEqual(1, values[2])
+            # The X axis of the sensor is the Y axis of the board.
+            self.assertAlmostEqual(idx, values[4])
+        self.assertEqual(5, server._stream_dropped_total.value)
+
+
+if __name__ == '__main__':
+    unittest.main()
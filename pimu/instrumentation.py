@@ -0,0 +1,276 @@
+"""This module contains a lightweight instrumentation of the processing
+pipeline.
+
+The time spent in each named stage (span) is measured with
+`time.perf_counter_ns` and accumulated in a fixed-size histogram, so that
+recording a span costs a few hundred nanoseconds and no allocation.
+A summary with the latency percentiles of every stage is logged
+periodically.
+
+Usage:
+    instr = Instrumentation(report_interval_s=10)
+    start_ns = instr.start()
+    ...  # read
+    start_ns = instr.stop('read', start_ns)
+    ...  # fuse
+    instr.stop('fuse', start_ns)
+    instr.maybe_report()
+
+When instrumentation is disabled, `NULL_INSTRUMENTATION` offers the same
+interface and does nothing.
+
+A profiler can also be attached for a bounded time window: cProfile in
+process, or py-spy as an external sampling profiler.
+"""
+import io
+import logging
+import os
+import shutil
+import subprocess
+import time
+
+import numpy as np
+
+_logger = logging.getLogger(__name__)
+
+
+class LatencyHistogram:
+    """Fixed-size histogram of latencies in nanoseconds with log-linear
+    buckets, in the spirit of HDR histograms.
+
+    Values are grouped by their power of two and each power of two is split
+    in linear sub-buckets, so that every value keeps `precision_bits`
+    significant bits and the relative error of any reported value is below
+    2^(1 - precision_bits).
+
+    Args:
+        precision_bits (int): Number of significant bits kept per value.
+        max_value_bits (int): Values above 2^max_value_bits ns are clamped.
+    """
+
+    def __init__(self, precision_bits=5, max_value_bits=40):
+        self._precision_bits = precision_bits
+        self._num_linear_buckets = 1 << precision_bits
+        self._num_sub_buckets = self._num_linear_buckets // 2
+        self._max_value = (1 << max_value_bits) - 1
+        num_buckets = self._num_linear_buckets + \
+            (max_value_bits - precision_bits) * self._num_sub_buckets
+        self._counts = np.zeros(num_buckets, dtype=np.int64)
+
+        self.count = 0
+        self.total_ns = 0
+        self.min_ns = None
+        self.max_ns = 0
+
+    def _bucket_index(self, value_ns):
+        # Values below 2^precision_bits have one bucket each.
+        shift = value_ns.bit_length() - self._precision_bits
+        if shift <= 0:
+            return value_ns
+        return self._num_linear_buckets + \
+            (shift - 1) * self._num_sub_buckets + \
+            (value_ns >> shift) - self._num_sub_buckets
+
+    def _bucket_value(self, index):
+        """Returns the lower bound of the values in the bucket."""
+        if index < self._num_linear_buckets:
+            return index
+        shift, sub_bucket = divmod(index - self._num_linear_buckets,
+                                   self._num_sub_buckets)
+        return (sub_bucket + self._num_sub_buckets) << (shift + 1)
+
+    def record(self, value_ns):
+        value_ns = min(max(value_ns, 0), self._max_value)
+        self._counts[self._bucket_index(value_ns)] += 1
+        self.count += 1
+        self.total_ns += value_ns
+        if self.min_ns is None or value_ns < self.min_ns:
+            self.min_ns = value_ns
+        if value_ns > self.max_ns:
+            self.max_ns = value_ns
+
+    def percentile(self, percent):
+        """Returns the value in nanoseconds below which the given percentage
+        of the recorded values falls, or None if nothing was recorded.
+        """
+        if self.count == 0:
+            return None
+        rank = max(1, int(np.ceil(percent / 100 * self.count)))
+        index = int(np.searchsorted(np.cumsum(self._counts), rank))
+        return min(self._bucket_value(index), self.max_ns)
+
+    @property
+    def mean_ns(self):
+        return self.total_ns / self.count if self.count else None
+
+    def reset(self):
+        self._counts[:] = 0
+        self.count = 0
+        self.total_ns = 0
+        self.min_ns = None
+        self.max_ns = 0
+
+
+class _NullInstrumentation:
+    """Instrumentation that records nothing."""
+
+    enabled = False
+
+    def start(self):
+        return 0
+
+    def stop(self, name, start_ns):
+        return 0
+
+    def record(self, name, duration_ns):
+        pass
+
+    def maybe_report(self):
+        pass
+
+
+NULL_INSTRUMENTATION = _NullInstrumentation()
+
+
+class Instrumentation:
+    """Collects per-stage latencies and periodically logs a summary.
+
+    Args:
+        report_interval_s (float): Time between two summaries. If None,
+            summaries are only produced by calling `report`.
+        reset_on_report (bool): If True, the histograms are cleared after
+            each summary, so that each one covers only its interval.
+    """
+
+    enabled = True
+
+    _REPORTED_PERCENTILES = (50, 90, 99)
+
+    def __init__(self, report_interval_s=10, reset_on_report=True):
+        self._report_interval_s = report_interval_s
+        self._reset_on_report = reset_on_report
+        self._histograms = {}
+        self._last_report_s = time.monotonic()
+
+        self._profiler = None
+        self._profile_end_s = None
+        self._profile_output_path = None
+
+    @property
+    def histograms(self):
+        return dict(self._histograms)
+
+    def start(self):
+        return time.perf_counter_ns()
+
+    def stop(self, name, start_ns):
+        """Records the time elapsed since `start_ns` for the named stage and
+        returns the current time, to be used as start of the next stage.
+        """
+        now_ns = time.perf_counter_ns()
+        self.record(name, now_ns - start_ns)
+        return now_ns
+
+    def record(self, name, duration_ns):
+        histogram = self._histograms.get(name)
+        if histogram is None:
+            histogram = self._histograms[name] = LatencyHistogram()
+        histogram.record(duration_ns)
+
+    def summary(self):
+        """Returns a multi-line text with the latency statistics of every
+        stage, in microseconds.
+        """
+        header = '{:>12} {:>9} {:>9}'.format('stage', 'count', 'mean') + \
+            ''.join(' {:>9}'.format('p{}'.format(p))
+                    for p in self._REPORTED_PERCENTILES) + \
+            ' {:>9}'.format('max')
+        lines = [header]
+        for name, histogram in self._histograms.items():
+            if histogram.count == 0:
+                continue
+            values_us = [histogram.mean_ns / 1000] + \
+                [histogram.percentile(p) / 1000
+                 for p in self._REPORTED_PERCENTILES] + \
+                [histogram.max_ns / 1000]
+            lines.append('{:>12} {:>9}'.format(name, histogram.count) +
+                         ''.join(' {:>9.1f}'.format(v) for v in values_us))
+        return '\n'.join(lines)
+
+    def report(self):
+        _logger.info('Latency per stage (us):\n{}'.format(self.summary()))
+        if self._reset_on_report:
+            for histogram in self._histograms.values():
+                histogram.reset()
+        self._last_report_s = time.monotonic()
+
+    def maybe_report(self):
+        """Logs a summary if the report interval has elapsed, and stops
+        the profiler if its window is over. Meant to be called once per
+        iteration of the main loop.
+        """
+        now_s = time.monotonic()
+        if self._profiler is not None and now_s >= self._profile_end_s:
+            self._stop_profile()
+        if self._report_interval_s is not None \
+                and now_s - self._last_report_s >= self._report_interval_s:
+            self.report()
+
+    def profile(self, duration_s, output_path=None):
+        """Runs cProfile on the calling thread for the given time window.
+
+        The profile is stopped by `maybe_report` once the window is over,
+        then the top functions are logged and, if `output_path` is set,
+        the full statistics are dumped there for `pstats` or snakeviz.
+        """
+        import cProfile
+
+        if self._profiler is not None:
+            raise RuntimeError('A profile is already running')
+
+        self._profiler = cProfile.Profile()
+        self._profile_end_s = time.monotonic() + duration_s
+        self._profile_output_path = output_path
+        _logger.info('Profiling for {} s'.format(duration_s))
+        self._profiler.enable()
+
+    def _stop_profile(self):
+        import pstats
+
+        self._profiler.disable()
+
+        stream = io.StringIO()
+        stats = pstats.Stats(self._profiler, stream=stream)
+        stats.sort_stats('cumulative').print_stats(20)
+        _logger.info('Profile:\n{}'.format(stream.getvalue()))
+
+        if self._profile_output_path is not None:
+            stats.dump_stats(self._profile_output_path)
+            _logger.info('Profile written to '
+                         '{}'.format(self._profile_output_path))
+
+        self._profiler = None
+
+
+def attach_sampling_profiler(duration_s, output_path):
+    """Starts py-spy on the current process for the given time window.
+
+    py-spy samples the stacks from another process, so the overhead on
+    the profiled process is negligible. It usually needs root privileges.
+
+    Returns:
+        The `subprocess.Popen` of the profiler.
+
+    Raises:
+        RuntimeError: py-spy is not available.
+    """
+    py_spy = shutil.which('py-spy')
+    if py_spy is None:
+        raise RuntimeError('py-spy is required for sampling profiling')
+
+    command = [py_spy, 'record',
+               '--pid', str(os.getpid()),
+               '--duration', str(int(duration_s)),
+               '--output', output_path]
+    _logger.info('Sampling profiler writing to {}'.format(output_path))
+    return subprocess.Popen(command)
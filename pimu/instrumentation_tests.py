@@ -0,0 +1,70 @@
+import unittest
+
+import numpy as np
+
+import pimu.instrumentation as instr
+
+
+class LatencyHistogramTest(unittest.TestCase):
+
+    def test_small_values_are_exact(self):
+        histogram = instr.LatencyHistogram()
+        for value_ns in range(10):
+            histogram.record(value_ns)
+        self.assertEqual(4, histogram.percentile(50))
+        self.assertEqual(9, histogram.percentile(100))
+
+    def test_relative_error_is_bounded(self):
+        histogram = instr.LatencyHistogram(precision_bits=5)
+        values_ns = np.random.RandomState(0).randint(1, 10 ** 9, size=1000)
+        for value_ns in values_ns:
+            histogram.record(int(value_ns))
+
+        for percent in (10, 50, 90, 99):
+            expected_value = np.percentile(values_ns, percent,
+                                           method='inverted_cdf')
+            self.assertLessEqual(abs(histogram.percentile(percent) -
+                                     expected_value) / expected_value,
+                                 1 / 16)
+
+    def test_statistics(self):
+        histogram = instr.LatencyHistogram()
+        for value_ns in (100, 300):
+            histogram.record(value_ns)
+        self.assertEqual(2, histogram.count)
+        self.assertEqual(200, histogram.mean_ns)
+        self.assertEqual(100, histogram.min_ns)
+        self.assertEqual(300, histogram.max_ns)
+
+        histogram.reset()
+        self.assertEqual(0, histogram.count)
+        self.assertIsNone(histogram.percentile(50))
+
+
+class InstrumentationTest(unittest.TestCase):
+
+    def test_spans_are_chained(self):
+        instrumentation = instr.Instrumentation(report_interval_s=None)
+        start_ns = instrumentation.start()
+        start_ns = instrumentation.stop('first', start_ns)
+        instrumentation.stop('second', start_ns)
+
+        histograms = instrumentation.histograms
+        self.assertSetEqual({'first', 'second'}, set(histograms))
+        self.assertEqual(1, histograms['first'].count)
+
+    def test_summary_lists_stages(self):
+        instrumentation = instr.Instrumentation(report_interval_s=None)
+        instrumentation.record('read', 1500)
+        summary = instrumentation.summary()
+        self.assertIn('read', summary)
+        self.assertIn('1.5', summary)
+
+    def test_null_instrumentation_records_nothing(self):
+        null = instr.NULL_INSTRUMENTATION
+        self.assertFalse(null.enabled)
+        self.assertEqual(0, null.stop('read', null.start()))
+
+
+if __name__ == '__main__':
+    unittest.main()
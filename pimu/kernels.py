@@ -0,0 +1,139 @@
+"""This module holds compiled versions of the per-sample hot paths: decoding
+a raw frame, the accelerometer and gyroscope terms of the fusion update, and
+the rotation matrix of dead reckoning. On single samples the NumPy code
+spends most of its time in call overhead on 3-element arrays, which
+the compiled kernels avoid.
+
+The kernels are written on scalars, in the subset of Python that Numba
+compiles. They are used when Numba is installed, see `load`, and compiled
+with `cache=True`, so that the machine code is saved next to this module, in
+__pycache__, and later launches only load it. Otherwise, or when the
+environment variable PIMU_DISABLE_JIT is set, `load` returns None and
+the callers keep the NumPy implementations of `decoding`, `sensorboard` and
+`geometry`, which are also the reference the kernels are tested against.
+"""
+import collections
+import logging
+import math
+import os
+import time
+
+import numpy as np
+
+_logger = logging.getLogger(__name__)
+
+_DISABLE_JIT_VARIABLE = 'PIMU_DISABLE_JIT'
+
+# The compiled functions. Each one has the signature of its plain Python
+# version below.
+Kernels = collections.namedtuple('Kernels',
+                                 ['decode_frame', 'pitch_and_roll',
+                                  'taitbryan_deltas', 'rotation_matrix'])
+
+
+def _decode_frame(frame, affine, out):
+    """Writes to `out`, with shape (7,), the sample of a raw frame, an array
+    of 14 bytes, as `RawFrameDecoder.decode` with the matrix `affine`, with
+    shape (7, 8).
+    """
+    for row in range(7):
+        value = affine[row, 7]
+        for column in range(7):
+            raw = int(frame[2 * column]) * 256 + int(frame[2 * column + 1])
+            if raw >= 32768:
+                raw -= 65536
+            value += affine[row, column] * raw
+        out[row] = value
+
+
+def _pitch_and_roll(acc_x, acc_y, acc_z):
+    """As `sensorboard.pitch_and_roll_from_accelerometer_data`."""
+    norm = math.sqrt(acc_x * acc_x + acc_y * acc_y + acc_z * acc_z)
+    if norm == 0:
+        # No direction, e.g. in free fall. NumPy divides to NaNs.
+        return math.nan, math.nan
+    gx = acc_x / norm
+    gy = acc_y / norm
+    gz = acc_z / norm
+    return math.atan2(-gx, math.sqrt(gy * gy + gz * gz)), math.atan2(gy, gz)
+
+
+def _taitbryan_deltas(gyro_x, gyro_y, gyro_z, delta_time_ms):
+    """As `sensorboard.gyroscope_data_to_taitbryan_deltas`."""
+    scale = math.pi / 180 * delta_time_ms / 1000
+    return gyro_z * scale, gyro_y * scale, gyro_x * scale
+
+
+def _rotation_matrix(yaw_rad, pitch_rad, roll_rad, out):
+    """Writes to `out`, with shape (3, 3), the matrix of
+    `geometry.build_rotation_matrix`.
+    """
+    cy, sy = math.cos(yaw_rad), math.sin(yaw_rad)
+    cp, sp = math.cos(pitch_rad), math.sin(pitch_rad)
+    cr, sr = math.cos(roll_rad), math.sin(roll_rad)
+    out[0, 0] = cy * cp
+    out[0, 1] = cy * sp * sr - sy * cr
+    out[0, 2] = cy * sp * cr + sy * sr
+    out[1, 0] = sy * cp
+    out[1, 1] = sy * sp * sr + cy * cr
+    out[1, 2] = sy * sp * cr - cy * sr
+    out[2, 0] = -sp
+    out[2, 1] = cp * sr
+    out[2, 2] = cp * cr
+
+
+# The kernels run by the Python interpreter, for the tests.
+_PYTHON_KERNELS = Kernels(decode_frame=_decode_frame,
+                          pitch_and_roll=_pitch_and_roll,
+                          taitbryan_deltas=_taitbryan_deltas,
+                          rotation_matrix=_rotation_matrix)
+
+_loaded = None
+_is_loaded = False
+
+
+def _warm_up(kernels):
+    """Calls every kernel with the argument types of the callers, so that
+    they are compiled, or loaded from the cache, before the first sample.
+    """
+    frame = np.frombuffer(bytes(14), dtype=np.uint8)
+    kernels.decode_frame(frame, np.zeros((7, 8)), np.empty(7))
+    kernels.pitch_and_roll(0., 0., 1.)
+    kernels.taitbryan_deltas(0., 0., 0., 1)
+    kernels.rotation_matrix(0., 0., 0., np.empty((3, 3)))
+
+
+def _compile():
+    if os.environ.get(_DISABLE_JIT_VARIABLE):
+        _logger.info('Compiled kernels disabled by {}'.format(
+            _DISABLE_JIT_VARIABLE))
+        return None
+    try:
+        # Slow to import, and optional.
+        import numba
+    except ImportError:
+        return None
+
+    start_s = time.monotonic()
+    kernels = Kernels(*(numba.njit(cache=True, nogil=True)(kernel)
+                        for kernel in _PYTHON_KERNELS))
+    try:
+        _warm_up(kernels)
+    except Exception as e:
+        _logger.warning('Kernels not compiled, NumPy is used: {}'.format(e))
+        return None
+    _logger.info('Kernels compiled with Numba {} in {:.1f} s'.format(
+        numba.__version__, time.monotonic() - start_s))
+    return kernels
+
+
+def load():
+    """Returns the compiled `Kernels`, or None if Numba is not available or
+    disabled. Numba is only imported, and the kernels compiled, on
+    the first call.
+    """
+    global _loaded, _is_loaded
+    if not _is_loaded:
+        _loaded = _compile()
+        _is_loaded = True
+    return _loaded
@@ -0,0 +1,103 @@
+import os
+import unittest
+from unittest import mock
+
+import numpy as np
+
+import pimu.geometry as geom
+import pimu.kernels as kernels
+import pimu.sensorboard as sb
+from pimu.mpu6050.decoding import RawFrameDecoder
+
+# The plain Python kernels always, the compiled ones when Numba is there.
+_IMPLEMENTATIONS = [('python', kernels._PYTHON_KERNELS)]
+if kernels.load() is not None:
+    _IMPLEMENTATIONS.append(('numba', kernels.load()))
+
+
+class KernelParityTest(unittest.TestCase):
+    """The kernels match the NumPy implementations they replace."""
+
+    def setUp(self):
+        self.rng = np.random.default_rng(0)
+
+    def test_decode_frame(self):
+        decoder = RawFrameDecoder(acc_sensitivity=8192, gyro_sensitivity=65.5,
+                                  acc_bias=(0.01, -0.02, 0.03),
+                                  gyro_bias=(1.5, -0.5, 0.25))
+        raw = self.rng.integers(-32768, 32768, size=(100, 7))
+        raw[:2] = [[-32768] * 7, [32767] * 7]
+        frames = raw.astype('>i2').view(np.uint8).reshape(-1, 14)
+        expected = decoder.decode_block(frames)
+
+        out = np.empty(7)
+        for name, implementation in _IMPLEMENTATIONS:
+            for frame, sample in zip(frames, expected):
+                with self.subTest(name):
+                    implementation.decode_frame(
+                        np.frombuffer(bytes(frame), dtype=np.uint8),
+                        decoder._affine, out)
+                    np.testing.assert_allclose(sample, out, rtol=1e-12,
+                                               atol=1e-12)
+
+    def test_pitch_and_roll(self):
+        acc = self.rng.normal(size=(200, 3))
+        acc[:3] = [[0, 0, 1], [0, 0, -1], [0, 0, 0]]
+        for name, implementation in _IMPLEMENTATIONS:
+            for acc_x, acc_y, acc_z in acc:
+                with self.subTest(name), np.errstate(invalid='ignore'):
+                    np.testing.assert_allclose(
+                        sb.pitch_and_roll_from_accelerometer_data(
+                            acc_x, acc_y, acc_z),
+                        implementation.pitch_and_roll(acc_x, acc_y, acc_z),
+                        rtol=1e-12, atol=1e-15)
+
+    def test_taitbryan_deltas(self):
+        gyro = self.rng.normal(scale=200, size=(50, 3))
+        for name, implementation in _IMPLEMENTATIONS:
+            for (gyro_x, gyro_y, gyro_z), delta_time_ms in \
+                    zip(gyro, self.rng.integers(0, 100, size=50)):
+                with self.subTest(name):
+                    np.testing.assert_allclose(
+                        sb.gyroscope_data_to_taitbryan_deltas(
+                            gyro_x, gyro_y, gyro_z, int(delta_time_ms)),
+                        implementation.taitbryan_deltas(
+                            gyro_x, gyro_y, gyro_z, int(delta_time_ms)),
+                        rtol=1e-12, atol=1e-15)
+
+    def test_rotation_matrix(self):
+        angles = self.rng.uniform(-np.pi, np.pi, size=(100, 3))
+        out = np.empty((3, 3))
+        for name, implementation in _IMPLEMENTATIONS:
+            for yaw_rad, pitch_rad, roll_rad in angles:
+                with self.subTest(name):
+                    implementation.rotation_matrix(yaw_rad, pitch_rad,
+                                                   roll_rad, out)
+                    np.testing.assert_allclose(
+                        geom.build_rotation_matrix(yaw_rad, pitch_rad,
+                                                   roll_rad),
+                        out, atol=1e-12)
+
+
+class LoadTest(unittest.TestCase):
+
+    def test_disabled_by_the_environment(self):
+        with mock.patch.dict(os.environ, {'PIMU_DISABLE_JIT': '1'}), \
+                mock.patch.object(kernels, '_is_loaded', False), \
+                mock.patch.object(kernels, '_loaded', None):
+            self.assertIsNone(kernels.load())
+
+    def test_decoder_loads_the_kernels_on_first_frame(self):
+        with mock.patch.object(kernels, 'load',
+                               return_value=None) as load:
+            decoder = RawFrameDecoder(acc_sensitivity=8192,
+                                      gyro_sensitivity=65.5)
+            decoder.decode_block(bytes(28))
+            load.assert_not_called()
+            decoder.decode(bytes(14))
+            decoder.decode(bytes(14))
+        load.assert_called_once_with()
+
+
+if __name__ == '__main__':
+    unittest.main()
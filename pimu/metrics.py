@@ -0,0 +1,135 @@
+"""This module contains counters and gauges that can be scraped by
+Prometheus from a small local HTTP endpoint.
+
+Updating a metric is a plain attribute update, cheap enough for the
+sampling loop: under the GIL, a concurrent scrape sees either the old or
+the new value. The text exposition format is only built when the endpoint
+is scraped.
+
+See:
+    https://prometheus.io/docs/instrumenting/exposition_formats/
+"""
+import logging
+import threading
+
+_logger = logging.getLogger(__name__)
+
+_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Counter:
+    """Monotonically increasing value."""
+
+    TYPE = 'counter'
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class Gauge:
+    """Value that can go up and down."""
+
+    TYPE = 'gauge'
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+
+class Registry:
+    """Collection of metrics rendered together."""
+
+    def __init__(self):
+        self._metrics = {}
+
+    def _register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError('Metric {} already registered'.format(metric.name))
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help_text):
+        return self._register(Counter(name, help_text))
+
+    def gauge(self, name, help_text):
+        return self._register(Gauge(name, help_text))
+
+    def get(self, name):
+        return self._metrics[name]
+
+    def render(self):
+        """Returns all the metrics in the Prometheus text format."""
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.append('# HELP {} {}'.format(metric.name, metric.help_text))
+            lines.append('# TYPE {} {}'.format(metric.name, metric.TYPE))
+            lines.append('{} {}'.format(metric.name, float(metric.value)))
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsServer:
+    """Serves the metrics of a registry at /metrics from a background thread.
+
+    Args:
+        registry (:obj:`Registry`): Metrics to serve.
+        port (int): TCP port to listen on.
+        host (str): Address to listen on. Only local clients by default.
+    """
+
+    def __init__(self, registry, port, host='127.0.0.1'):
+        # Imported here only, since the sampling loop updates a registry
+        # but must not load the HTTP stack, see run_tests.py.
+        import http.server
+
+        handler = self._build_handler(registry,
+                                      http.server.BaseHTTPRequestHandler)
+        self._server = http.server.ThreadingHTTPServer((host, port), handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        name=self.__class__.__name__,
+                                        daemon=True)
+
+    @property
+    def address(self):
+        """Tuple (host, port) the server listens on."""
+        return self._server.server_address
+
+    @staticmethod
+    def _build_handler(registry, base_handler):
+
+        class Handler(base_handler):
+
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', _CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                _logger.debug(format % args)
+
+        return Handler
+
+    def start(self):
+        self._thread.start()
+        _logger.info('Metrics served at http://{}:{}/metrics'.format(
+            *self.address))
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
@@ -0,0 +1,56 @@
+import unittest
+import urllib.error
+import urllib.request
+
+import pimu.metrics as metrics
+
+
+class RegistryTest(unittest.TestCase):
+
+    def test_render(self):
+        registry = metrics.Registry()
+        counter = registry.counter('pimu_samples_total', 'Samples read.')
+        gauge = registry.gauge('pimu_temperature_celsius', 'Temperature.')
+        counter.inc()
+        counter.inc(2)
+        gauge.set(36.5)
+
+        expected_text = ('# HELP pimu_samples_total Samples read.\n'
+                         '# TYPE pimu_samples_total counter\n'
+                         'pimu_samples_total 3.0\n'
+                         '# HELP pimu_temperature_celsius Temperature.\n'
+                         '# TYPE pimu_temperature_celsius gauge\n'
+                         'pimu_temperature_celsius 36.5\n')
+        self.assertEqual(expected_text, registry.render())
+
+    def test_duplicate_name(self):
+        registry = metrics.Registry()
+        registry.counter('pimu_samples_total', 'Samples read.')
+        with self.assertRaisesRegex(ValueError, r'already registered'):
+            registry.gauge('pimu_samples_total', 'Samples read.')
+
+
+class MetricsServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self._registry = metrics.Registry()
+        self._registry.counter('pimu_samples_total', 'Samples read.').inc(5)
+        self._server = metrics.MetricsServer(self._registry, port=0)
+        self._server.start()
+        self._url = 'http://{}:{}'.format(*self._server.address)
+
+    def tearDown(self):
+        self._server.stop()
+
+    def test_scrape(self):
+        with urllib.request.urlopen(self._url + '/metrics') as response:
+            body = response.read().decode('utf-8')
+        self.assertIn('pimu_samples_total 5.0', body)
+
+    def test_unknown_path(self):
+        with self.assertRaises(urllib.error.HTTPError):
+            urllib.request.urlopen(self._url + '/other')
+
+
+if __name__ == '__main__':
+    unittest.main()
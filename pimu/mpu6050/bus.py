@@ -0,0 +1,108 @@
+"""This module contains a wrapper of the I2C bus that survives transient
+errors.
+
+Reads and writes are retried with exponential backoff. When they keep
+failing, a `BusError` is raised so that the caller can drop the sample and
+carry on. After an error, or when the device stops producing samples, it
+may have been reset, losing its configuration: `recover` detects it from
+the PWR_MGMT_1 register and re-initializes the device.
+"""
+import collections
+import logging
+import time
+
+import pimu.mpu6050.registers as regs
+
+_logger = logging.getLogger(__name__)
+
+# After a reset the device is in sleep mode, with PWR_MGMT_1 = 0x40.
+_PWR_MGMT_1_SLEEP = 0x40
+
+
+class BusError(OSError):
+    """Raised when an I2C transfer still fails after all the retries."""
+
+
+class ResilientBus:
+    """Retries the transfers of an smbus-like bus.
+
+    Args:
+        bus: smbus-like object to wrap.
+        device_address (int): Address of the device on the bus.
+        reinitialize (callable): Called without arguments to configure again
+            the device after a reset.
+        max_retries (int): Number of retries after a failed transfer.
+        backoff_s (float): Wait before the first retry. It doubles at every
+            following retry.
+        max_backoff_s (float): Maximum wait between two retries.
+        sleep (callable): Function used to wait, replaceable in tests.
+    """
+
+    def __init__(self, bus, device_address, reinitialize, max_retries=3,
+                 backoff_s=0.001, max_backoff_s=0.05, sleep=time.sleep):
+        self._bus = bus
+        self._device_address = device_address
+        self._reinitialize = reinitialize
+        self._max_retries = max_retries
+        self._backoff_s = backoff_s
+        self._max_backoff_s = max_backoff_s
+        self._sleep = sleep
+
+        # Number of failed transfers per register.
+        self.errors_per_register = collections.Counter()
+        self.num_resets = 0
+
+        # Whether an error occurred since the device was last checked.
+        self.needs_recovery = False
+
+    @property
+    def num_errors(self):
+        return sum(self.errors_per_register.values())
+
+    def _transfer(self, register, func, *args):
+        backoff_s = self._backoff_s
+        for attempt in range(self._max_retries + 1):
+            try:
+                return func(*args)
+            except OSError as e:
+                self.errors_per_register[register] += 1
+                self.needs_recovery = True
+                if attempt == self._max_retries:
+                    raise BusError('I2C transfer on register 0x{:02X} failed '
+                                   '{} times: {}'.format(register,
+                                                         attempt + 1, e))
+                self._sleep(backoff_s)
+                backoff_s = min(2 * backoff_s, self._max_backoff_s)
+
+    def read_byte_data(self, device_address, register):
+        return self._transfer(register, self._bus.read_byte_data,
+                              device_address, register)
+
+    def write_byte_data(self, device_address, register, value):
+        return self._transfer(register, self._bus.write_byte_data,
+                              device_address, register, value)
+
+    def read_i2c_block_data(self, device_address, register, length):
+        return self._transfer(register, self._bus.read_i2c_block_data,
+                              device_address, register, length)
+
+    def recover(self):
+        """Re-initializes the device if it has been reset since the last
+        configuration.
+
+        Returns:
+            True if the device was re-initialized.
+
+        Raises:
+            BusError: The device is still not reachable.
+        """
+        power_management = self.read_byte_data(self._device_address,
+                                               regs.PWR_MGMT_1)
+        self.needs_recovery = False
+        if not power_management & _PWR_MGMT_1_SLEEP:
+            return False
+
+        _logger.warning('Device reset detected, re-initializing')
+        self._reinitialize()
+        self.num_resets += 1
+        return True
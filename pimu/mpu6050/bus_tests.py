@@ -0,0 +1,133 @@
+import math
+import unittest
+
+import pimu.mpu6050.registers as regs
+from pimu.mpu6050.bus import BusError, ResilientBus
+from pimu.mpu6050.fakebus import FakeBus
+from pimu.mpu6050.mpu6050 import MPU6050
+
+
+class _FailingBus(FakeBus):
+    """Fails the next `num_failures` transfers."""
+
+    def __init__(self):
+        super().__init__()
+        self.num_failures = 0
+
+    def _maybe_fail(self):
+        if self.num_failures > 0:
+            self.num_failures -= 1
+            raise OSError(121, 'Remote I/O error')
+
+    def read_byte_data(self, device_address, register):
+        self._maybe_fail()
+        return super().read_byte_data(device_address, register)
+
+    def write_byte_data(self, device_address, register, value):
+        self._maybe_fail()
+        super().write_byte_data(device_address, register, value)
+
+    def read_i2c_block_data(self, device_address, register, length):
+        self._maybe_fail()
+        return super().read_i2c_block_data(device_address, register, length)
+
+
+def _build_resilient_bus(bus, reinitialize=lambda: None, max_retries=3):
+    sleeps = []
+    resilient_bus = ResilientBus(bus, regs.MPU6050_ADDRESS,
+                                 reinitialize=reinitialize,
+                                 max_retries=max_retries,
+                                 backoff_s=0.001,
+                                 max_backoff_s=0.004,
+                                 sleep=sleeps.append)
+    return resilient_bus, sleeps
+
+
+class ResilientBusTest(unittest.TestCase):
+
+    def test_retries_until_success(self):
+        bus = _FailingBus()
+        bus.registers[regs.ACCEL_XOUT_H] = 42
+        bus.num_failures = 2
+        resilient_bus, sleeps = _build_resilient_bus(bus)
+
+        value = resilient_bus.read_byte_data(regs.MPU6050_ADDRESS,
+                                             regs.ACCEL_XOUT_H)
+        self.assertEqual(42, value)
+        self.assertEqual([0.001, 0.002], sleeps)
+        self.assertEqual(2, resilient_bus.num_errors)
+        self.assertTrue(resilient_bus.needs_recovery)
+
+    def test_raises_after_max_retries(self):
+        bus = _FailingBus()
+        bus.num_failures = 10
+        resilient_bus, sleeps = _build_resilient_bus(bus, max_retries=3)
+
+        with self.assertRaises(BusError):
+            resilient_bus.read_byte_data(regs.MPU6050_ADDRESS,
+                                         regs.GYRO_XOUT_H)
+        # The backoff doubles up to its maximum.
+        self.assertEqual([0.001, 0.002, 0.004], sleeps)
+        self.assertEqual({regs.GYRO_XOUT_H: 4},
+                         dict(resilient_bus.errors_per_register))
+
+    def test_recover_reinitializes_after_reset(self):
+        bus = _FailingBus()
+        reinitializations = []
+        resilient_bus, _ = _build_resilient_bus(
+            bus, reinitialize=lambda: reinitializations.append(True))
+
+        bus.registers[regs.PWR_MGMT_1] = 0x01
+        self.assertFalse(resilient_bus.recover())
+        self.assertEqual([], reinitializations)
+
+        bus.registers[regs.PWR_MGMT_1] = 0x40
+        self.assertTrue(resilient_bus.recover())
+        self.assertEqual([True], reinitializations)
+        self.assertEqual(1, resilient_bus.num_resets)
+        self.assertFalse(resilient_bus.needs_recovery)
+
+
+class MPU6050BusErrorTest(unittest.TestCase):
+
+    def test_invalid_sample_then_recovery(self):
+        bus = _FailingBus()
+        bus.set_raw_sample(acc=(0, 0, -16384), temperature=0, gyro=(0, 0, 0))
+        imu = MPU6050(gyro_sensitivity='250', acc_sensitivity='2g', bus=bus,
+                      max_retries=1)
+
+        bus.num_failures = 2
+        sample = imu.read_next()
+        self.assertTrue(all(math.isnan(v) for v in sample))
+        self.assertEqual(1, imu.num_invalid_samples)
+        self.assertTrue(math.isnan(imu.update(sample)[0]))
+
+        # Simulate a reset of the device during the failure.
+        bus.registers[regs.PWR_MGMT_1] = 0x40
+        sample = imu.read_next()
+        self.assertFalse(math.isnan(sample[0]))
+        self.assertEqual(1, imu.num_invalid_samples)
+        # Re-initialized: awake, with the gyroscope clock.
+        self.assertEqual(0x01, bus.registers[regs.PWR_MGMT_1])
+        self.assertEqual(2, imu.num_bus_errors)
+
+    def test_silent_reset_is_recovered(self):
+        bus = FakeBus()
+        imu = MPU6050(gyro_sensitivity='250', acc_sensitivity='2g', bus=bus,
+                      sample_rate_hz=1000)
+        bus.reset()
+        # No error, but DATA_RDY never sets while the device sleeps.
+        for _ in range(10):
+            if imu.wait_for_data(timeout_s=0.002):
+                break
+        self.assertEqual(0x01, bus.registers[regs.PWR_MGMT_1])
+        self.assertEqual(7, bus.registers[regs.SMPLRT_DIV])
+        self.assertEqual(0, imu.num_bus_errors)
+
+        bus.set_raw_sample(acc=(0, 0, 16384), temperature=0, gyro=(0, 0, 0))
+        self.assertTrue(imu.wait_for_data(timeout_s=0))
+        self.assertAlmostEqual(1, imu.read_next()[2])
+
+
+if __name__ == '__main__':
+    unittest.main()
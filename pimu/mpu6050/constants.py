@@ -13,6 +13,10 @@ AFS_SEL = {
     '16g': 3,
 }
 
+# AFS_SEL and FS_SEL are bits 3-4 of ACCEL_CONFIG and GYRO_CONFIG.
+FULL_SCALE_RANGE_SHIFT = 3
+FULL_SCALE_RANGE_MASK = 0x18
+
 # 16 bits are used for one measurement that is 2^16 bits.
 # If the range is [-2^k * g, 2^k * g] for k={1, 2, 3, 4}, and g Gravity,
 # then each bit accounts for: 2^16 / (2 * 2^k) = 2^(16 - 2k).
@@ -44,6 +48,63 @@ GYRO_SENSITIVITY = {
     '2000': 16.4,   # 2^12 / 250 = 16.384
 }
 
+# Conversion of the temperature sensor output, as indicated in the datasheet:
+#   temperature = raw / TEMPERATURE_SENSITIVITY + TEMPERATURE_OFFSET
+TEMPERATURE_SENSITIVITY = 340  # LSB/deg C
+TEMPERATURE_OFFSET_deg = 36.53
+
+# DLPF_CFG configures the Digital Low Pass Filter of both the accelerometer
+# and the gyroscope. The key is the accelerometer bandwidth in Hz; the
+# gyroscope bandwidth is close to it (256, 188, 98, 42, 20, 10, 5 Hz).
+# DLPF_CFG = 0 disables the filter.
+DLPF_CFG = {
+    '260': 0,
+    '184': 1,
+    '94': 2,
+    '44': 3,
+    '21': 4,
+    '10': 5,
+    '5': 6,
+}
+
+# Rate at which the gyroscope produces data, divided by 1 + SMPLRT_DIV to
+# obtain the sample rate. The accelerometer output rate is always 1 kHz, so
+# above it the accelerometer values are repeated.
+# Unit: Hz
+GYRO_OUTPUT_RATE_DLPF_DISABLED = 8000
+GYRO_OUTPUT_RATE_DLPF_ENABLED = 1000
+
+# SMPLRT_DIV is an 8 bits register.
+MAX_SAMPLE_RATE_DIVIDER = 255
+
+# Bit of INT_STATUS set when all the sensor registers have been written, and
+# cleared when INT_STATUS is read.
+DATA_RDY_INT = 0x01
+
+# Bits of INT_STATUS and INT_ENABLE of the motion detection interrupts.
+# MOT_INT is set when the acceleration exceeds MOT_THR for MOT_DUR. ZMOT_INT
+# is set both when the acceleration stays below ZRMOT_THR for ZRMOT_DUR and
+# when it exceeds it again: MOT_ZRMOT tells the two apart.
+MOT_INT = 0x40
+ZMOT_INT = 0x20
+
+# Bit of MOT_DETECT_STATUS set while zero motion is detected.
+MOT_ZRMOT = 0x01
+
+# Resolution of the motion detection registers. The thresholds are compared
+# with the accelerometer output after the digital high pass filter.
+MOTION_THRESHOLD_RESOLUTION_mg = 2
+MOTION_DURATION_RESOLUTION_ms = 1
+ZERO_MOTION_DURATION_RESOLUTION_ms = 64
+
+# Motion detection needs the digital high pass filter of the accelerometer,
+# set by bits 0-2 (ACCEL_HPF) of ACCEL_CONFIG, to remove gravity. 4 sets
+# a cutoff of 0.63 Hz. The filter does not affect the data registers.
+ACCEL_HPF_0_63HZ = 4
+
+# The motion registers are 8 bits.
+MAX_MOTION_REGISTER_VALUE = 255
+
 # Dimensions of the IMU board.
 # From: www.robotstore.it/Modulo-GY-521-MPU-6050
 BOARD_WIDTH_mm = 16.4   # along X axis
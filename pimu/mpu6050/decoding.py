@@ -0,0 +1,122 @@
+"""This module converts raw frames of the MPU6050 output registers into
+samples in one affine operation.
+
+A raw frame is the 14 bytes starting at ACCEL_XOUT_H: 7 big-endian signed
+16 bits values, in the order accelerometer X, Y, Z, temperature,
+gyroscope X, Y, Z. Turning it into a sample, as returned by
+`Imu.read_next`, takes:
+* scaling by the sensitivity of the full scale range;
+* the sign flip of the accelerometer described in `sensor`;
+* the remapping to the board system of `interface`;
+* the temperature conversion and the bias subtraction.
+All of these are linear, so they are folded into a 7x7 matrix and an offset
+vector, rebuilt only when the full scale range or the calibration changes:
+    sample = matrix @ raw + offset
+Single frames are decoded by a compiled kernel when available, see
+`pimu.kernels`, looked up on the first one: building a decoder for blocks
+never imports Numba.
+"""
+import numpy as np
+
+import pimu.kernels as kernels
+import pimu.mpu6050.constants as const
+
+FRAME_SIZE = 14
+
+_RAW_DTYPE = np.dtype('>i2')
+
+# Position of the values in a raw frame.
+_RAW_ACC_X, _RAW_ACC_Y, _RAW_ACC_Z, _RAW_TEMPERATURE, \
+    _RAW_GYRO_X, _RAW_GYRO_Y, _RAW_GYRO_Z = range(7)
+
+
+def _build_transform(acc_sensitivity, gyro_sensitivity, acc_bias, gyro_bias):
+    matrix = np.zeros((7, 7))
+
+    # The accelerometer values are negated, then remapped as in
+    # `interface.accelerometer_data_to_board_system`: (y, x, -z).
+    matrix[0, _RAW_ACC_Y] = -1 / acc_sensitivity
+    matrix[1, _RAW_ACC_X] = -1 / acc_sensitivity
+    matrix[2, _RAW_ACC_Z] = 1 / acc_sensitivity
+
+    # Remapped as in `interface.gyroscope_data_to_board_system`: (y, x, -z).
+    matrix[3, _RAW_GYRO_Y] = 1 / gyro_sensitivity
+    matrix[4, _RAW_GYRO_X] = 1 / gyro_sensitivity
+    matrix[5, _RAW_GYRO_Z] = -1 / gyro_sensitivity
+
+    matrix[6, _RAW_TEMPERATURE] = 1 / const.TEMPERATURE_SENSITIVITY
+
+    offset = -np.concatenate([acc_bias, gyro_bias, [0]]).astype(float)
+    offset[6] = const.TEMPERATURE_OFFSET_deg
+    return matrix, offset
+
+
+class RawFrameDecoder:
+    """Converts raw frames into samples in the board system.
+
+    Args:
+        acc_sensitivity (float): Accelerometer sensitivity in LSB/g.
+        gyro_sensitivity (float): Gyroscope sensitivity in LSB/deg/s.
+        acc_bias (tuple): Accelerometer X, Y, Z bias in the board system, in
+            g units.
+        gyro_bias (tuple): Gyroscope X, Y, Z bias in the board system, in
+            deg/s.
+    """
+
+    def __init__(self, acc_sensitivity, gyro_sensitivity, acc_bias=(0, 0, 0),
+                 gyro_bias=(0, 0, 0)):
+        matrix, self._offset = _build_transform(acc_sensitivity,
+                                                gyro_sensitivity,
+                                                acc_bias, gyro_bias)
+        # The transposed matrix, so that blocks of frames, one per row, are
+        # multiplied from the left.
+        self._matrix_t = np.ascontiguousarray(matrix.T)
+
+        # For single frames, the offset is folded in the matrix and a last
+        # raw value fixed to 1, so that decoding is a single product.
+        self._affine = np.hstack([matrix, self._offset[:, np.newaxis]])
+        self._raw = np.ones(8)
+        self._sample = np.empty(7)
+
+        self._decode_kernel = None
+        self._is_kernel_loaded = False
+
+    @staticmethod
+    def raw_values(frame):
+        """Returns the 7 signed raw values of a frame."""
+        return np.frombuffer(bytes(frame), dtype=_RAW_DTYPE)
+
+    def decode(self, frame):
+        """Converts a raw frame of 14 bytes, e.g. the list returned by
+        `read_i2c_block_data`, into the tuple (acc_x, acc_y, acc_z, gyro_x,
+        gyro_y, gyro_z, temperature).
+        """
+        if not self._is_kernel_loaded:
+            compiled = kernels.load()
+            self._decode_kernel = None if compiled is None \
+                else compiled.decode_frame
+            self._is_kernel_loaded = True
+        if self._decode_kernel is not None:
+            self._decode_kernel(np.frombuffer(bytes(frame), dtype=np.uint8),
+                                self._affine, self._sample)
+        else:
+            self._raw[:7] = self.raw_values(frame)
+            np.dot(self._affine, self._raw, out=self._sample)
+        return tuple(self._sample.tolist())
+
+    def decode_block(self, frames):
+        """Converts a block of raw frames, either bytes or an array with shape
+        (N, 14) of bytes, into an array of samples with shape (N, 7).
+        """
+        if not isinstance(frames, (bytes, bytearray, memoryview)):
+            frames = np.ascontiguousarray(frames, dtype=np.uint8)
+        raw = np.frombuffer(frames, dtype=_RAW_DTYPE).reshape(-1, 7)
+        return self.decode_raw_block(raw)
+
+    def decode_raw_block(self, raw):
+        """Converts an array of raw values with shape (N, 7), as returned by
+        `raw_values`, into an array of samples with shape (N, 7).
+        """
+        samples = raw @ self._matrix_t
+        samples += self._offset
+        return samples
@@ -0,0 +1,93 @@
+import struct
+import unittest
+
+import numpy as np
+
+import pimu.mpu6050.interface as interface
+import pimu.mpu6050.registers as regs
+import pimu.mpu6050.sensor as sensor
+from pimu.mpu6050.decoding import RawFrameDecoder
+from pimu.mpu6050.fakebus import FakeBus
+from pimu.mpu6050.mpu6050 import MPU6050
+
+_ACC_SENSITIVITY = 8192
+_GYRO_SENSITIVITY = 65.5
+_ACC_BIAS = (0.01, -0.02, 0.03)
+_GYRO_BIAS = (0.5, -1.5, 2.5)
+
+
+def _reference_sample(bus):
+    """Decodes the sample register by register, with the functions of
+    `sensor` and `interface`.
+    """
+    address = regs.MPU6050_ADDRESS
+    acc = interface.accelerometer_data_to_board_system(
+        *sensor.read_accelerometer_data(bus, address, _ACC_SENSITIVITY))
+    gyro = interface.gyroscope_data_to_board_system(
+        *sensor.read_gyroscope_data(bus, address, _GYRO_SENSITIVITY))
+    temperature = sensor.read_temperature_data(bus, address)
+    return tuple(np.subtract(acc, _ACC_BIAS)) + \
+        tuple(np.subtract(gyro, _GYRO_BIAS)) + (temperature,)
+
+
+def _random_raw_values(rng, num_frames):
+    # -32768 is left out: the per-register path reads it as +32768.
+    return rng.integers(-32767, 32768, size=(num_frames, 7))
+
+
+class RawFrameDecoderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.decoder = RawFrameDecoder(acc_sensitivity=_ACC_SENSITIVITY,
+                                       gyro_sensitivity=_GYRO_SENSITIVITY,
+                                       acc_bias=_ACC_BIAS,
+                                       gyro_bias=_GYRO_BIAS)
+
+    def test_matches_register_by_register_decoding(self):
+        rng = np.random.default_rng(0)
+        bus = FakeBus()
+        for raw in _random_raw_values(rng, 50):
+            bus.set_raw_sample(acc=raw[:3], temperature=raw[3], gyro=raw[4:])
+            frame = bus.read_i2c_block_data(regs.MPU6050_ADDRESS,
+                                            regs.ACCEL_XOUT_H, 14)
+            np.testing.assert_allclose(_reference_sample(bus),
+                                       self.decoder.decode(frame))
+
+    def test_block_matches_single_frames(self):
+        raw = _random_raw_values(np.random.default_rng(1), 20)
+        frames = [struct.pack('>7h', *values) for values in raw]
+        block = np.frombuffer(b''.join(frames), dtype=np.uint8).reshape(-1, 14)
+
+        samples = self.decoder.decode_block(block)
+        self.assertEqual((20, 7), samples.shape)
+        np.testing.assert_allclose(
+            [self.decoder.decode(frame) for frame in frames], samples)
+        np.testing.assert_allclose(samples,
+                                   self.decoder.decode_block(b''.join(frames)))
+
+
+class MPU6050DecodingTest(unittest.TestCase):
+
+    def test_single_block_read(self):
+        bus = FakeBus()
+        bus.set_raw_sample(acc=(0, 0, -16384), temperature=-340,
+                           gyro=(131, 0, 0))
+        calls = []
+        read_i2c_block_data = bus.read_i2c_block_data
+
+        def counted_read(*args):
+            calls.append(args)
+            return read_i2c_block_data(*args)
+
+        bus.read_i2c_block_data = counted_read
+        bus.read_byte_data = None
+
+        imu = MPU6050(gyro_sensitivity='250', acc_sensitivity='2g', bus=bus)
+        sample = imu.read_next()
+        self.assertEqual([(regs.MPU6050_ADDRESS, regs.ACCEL_XOUT_H, 14)],
+                         calls)
+        np.testing.assert_allclose((0, 0, -1, 0, 1, 0, 35.53), sample)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+"""This module contains an in-memory stand-in for `smbus.SMBus`, used to run
+the MPU6050 code without the device, e.g. in tests and benchmarks.
+"""
+import struct
+
+import pimu.mpu6050.constants as const
+import pimu.mpu6050.registers as regs
+
+# 7 big-endian 16 bits values starting at ACCEL_XOUT_H: accelerometer X, Y,
+# Z, temperature, gyroscope X, Y, Z.
+_RAW_FRAME = struct.Struct('>7h')
+
+
+class FakeBus:
+    """Emulates the register file of an MPU6050 on an I2C bus.
+
+    Every device address shares the same 256 registers. Writes are recorded
+    in `writes` as (device_address, register, value) tuples. As on the
+    device, reading INT_STATUS clears it.
+    """
+
+    def __init__(self):
+        self.registers = bytearray(256)
+        self.writes = []
+
+    def read_byte_data(self, device_address, register):
+        value = self.registers[register]
+        if register == regs.INT_STATUS:
+            self.registers[register] = 0
+        return value
+
+    def write_byte_data(self, device_address, register, value):
+        self.registers[register] = value
+        self.writes.append((device_address, register, value))
+
+    def read_i2c_block_data(self, device_address, register, length):
+        return list(self.registers[register:register + length])
+
+    def set_raw_sample(self, acc, temperature, gyro):
+        """Sets the sensor output registers and the DATA_RDY bit.
+
+        Args:
+            acc (tuple): Raw accelerometer X, Y, Z signed 16 bits values.
+            temperature (int): Raw temperature signed 16 bits value.
+            gyro (tuple): Raw gyroscope X, Y, Z signed 16 bits values.
+        """
+        _RAW_FRAME.pack_into(self.registers, regs.ACCEL_XOUT_H,
+                             *acc, temperature, *gyro)
+        self.registers[regs.INT_STATUS] |= const.DATA_RDY_INT
+
+    def reset(self):
+        """Resets the device as a brown-out does, without any bus error:
+        the registers are cleared and the device sleeps.
+        """
+        self.registers[:] = bytes(len(self.registers))
+        self.registers[regs.PWR_MGMT_1] = 0x40
+
+    def set_motion(self, is_moving):
+        """Raises the interrupt of the motion detection: MOT_INT when motion
+        starts, ZMOT_INT with MOT_ZRMOT when it stops.
+        """
+        if is_moving:
+            self.registers[regs.INT_STATUS] |= const.MOT_INT
+            self.registers[regs.MOT_DETECT_STATUS] = 0
+        else:
+            self.registers[regs.INT_STATUS] |= const.ZMOT_INT
+            self.registers[regs.MOT_DETECT_STATUS] = const.MOT_ZRMOT
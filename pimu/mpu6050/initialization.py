@@ -3,13 +3,100 @@
 See:
     https://43zrtwysvxb2gf29r5o0athu-wpengine.netdna-ssl.com/wp-content/uploads/2015/02/MPU-6000-Register-Map1.pdf
 """
+import collections
+
+import pimu.mpu6050.constants as const
 import pimu.mpu6050.registers as regs
 
+# Configuration of the motion and zero-motion interrupts.
+#   threshold_mg: acceleration above which motion is detected, in mg.
+#   duration_ms: how long the threshold must be exceeded.
+#   zero_motion_threshold_mg: acceleration below which zero motion is
+#       detected, in mg.
+#   zero_motion_duration_ms: how long the acceleration must stay below
+#       the zero-motion threshold.
+MotionDetection = collections.namedtuple(
+    'MotionDetection',
+    ['threshold_mg', 'duration_ms', 'zero_motion_threshold_mg',
+     'zero_motion_duration_ms'],
+    defaults=(40, 2, 20, 2000))
+
+# Settings of the MPU6050 that can be changed at runtime, see
+# `MPU6050.reconfigure`.
+#   sample_rate_hz: output rate of the sensor.
+#   gyro_sensitivity: key of `constants.GYRO_SENSITIVITY`.
+#   acc_sensitivity: key of `constants.ACCEL_SENSITIVITY`.
+#   dlpf_bandwidth: key of `constants.DLPF_CFG`.
+SensorSettings = collections.namedtuple(
+    'SensorSettings',
+    ['sample_rate_hz', 'gyro_sensitivity', 'acc_sensitivity',
+     'dlpf_bandwidth'])
+
+
+def gyroscope_output_rate(dlpf_cfg):
+    """Returns the rate in Hz at which the gyroscope produces data."""
+    if dlpf_cfg in (0, 7):
+        return const.GYRO_OUTPUT_RATE_DLPF_DISABLED
+    return const.GYRO_OUTPUT_RATE_DLPF_ENABLED
+
+
+def sample_rate_divider(target_rate_hz, dlpf_cfg):
+    """Returns the SMPLRT_DIV value giving the sample rate closest to
+    the target one. Rates out of the reachable range are clamped.
+    """
+    divider = int(round(gyroscope_output_rate(dlpf_cfg) / target_rate_hz)) - 1
+    return min(max(divider, 0), const.MAX_SAMPLE_RATE_DIVIDER)
+
+
+def sample_rate(divider, dlpf_cfg):
+    """Returns the sample rate in Hz obtained with the given SMPLRT_DIV."""
+    return gyroscope_output_rate(dlpf_cfg) / (1 + divider)
+
+
+def _motion_register_value(value, resolution):
+    """Returns the register value closest to a physical value, clamped to
+    the 8 bits range, and at least 1 so that the detection is never
+    disabled.
+    """
+    return min(max(int(round(value / resolution)), 1),
+               const.MAX_MOTION_REGISTER_VALUE)
+
+
+def configure_motion_detection(bus, device_address, motion_detection):
+    """Enables the motion and zero-motion interrupts, besides DATA_RDY.
+
+    Args:
+        motion_detection (:obj:`MotionDetection`): Thresholds and durations.
+    """
+    bus.write_byte_data(device_address, regs.MOT_THR, _motion_register_value(
+        motion_detection.threshold_mg,
+        const.MOTION_THRESHOLD_RESOLUTION_mg))
+    bus.write_byte_data(device_address, regs.MOT_DUR, _motion_register_value(
+        motion_detection.duration_ms, const.MOTION_DURATION_RESOLUTION_ms))
+    bus.write_byte_data(device_address, regs.ZRMOT_THR, _motion_register_value(
+        motion_detection.zero_motion_threshold_mg,
+        const.MOTION_THRESHOLD_RESOLUTION_mg))
+    bus.write_byte_data(device_address, regs.ZRMOT_DUR, _motion_register_value(
+        motion_detection.zero_motion_duration_ms,
+        const.ZERO_MOTION_DURATION_RESOLUTION_ms))
+
+    # The detection works on the high pass filtered acceleration, so that
+    # gravity is ignored. Only bits 0-2 (ACCEL_HPF) are changed.
+    accel_config = bus.read_byte_data(device_address, regs.ACCEL_CONFIG)
+    bus.write_byte_data(device_address, regs.ACCEL_CONFIG,
+                        (accel_config & ~0x07) | const.ACCEL_HPF_0_63HZ)
+
+    # Bit 6 is MOT_EN, bit 5 ZMOT_EN.
+    bus.write_byte_data(device_address, regs.INT_ENABLE,
+                        const.DATA_RDY_INT | const.MOT_INT | const.ZMOT_INT)
+
 
 def initialize(bus,
                device_address,
                gyro_full_scale_range,
-               acc_full_scale_range):
+               acc_full_scale_range,
+               sample_rate_divider=7,
+               dlpf_cfg=0):
 
     # Sample Rate Divider.
     # Specifies the divider from the gyroscope output rate used to generate
@@ -17,7 +104,7 @@ def initialize(bus,
     #   Sample Rate = Gyroscope Output Rate / (1 + SMPLRT_DIV)
     # where Gyroscope Output Rate = 8kHz when the DLPF is disabled
     # (DLPF_CFG = 0 or 7), and 1kHz when the DLPF is enabled (see Register 26).
-    bus.write_byte_data(device_address, regs.SMPLRT_DIV, 7)
+    bus.write_byte_data(device_address, regs.SMPLRT_DIV, sample_rate_divider)
 
     # Power Management 1.
     # This register allows the user to configure the power mode
@@ -39,15 +126,17 @@ def initialize(bus,
     # (bits 0-2) for both the gyroscopes and accelerometers. Bits 6-7 unused.
     # The accelerometer and gyroscope are filtered according to the value
     # of DLPF_CFG.
-    # By choosing DLPF_CFG = 0 we are setting the following:
+    # With DLPF_CFG = 0 (the default) we are setting the following:
     # * Accelerometer Bandwidth = 160 Hz (max)
     # * Accelerometer Delay = 0 ms (min)
     # * Gyroscope Bandwidth = 256 Hz (max)
     # * Gyroscope Delay = 0.98 ms (min)
     # * Gyroscope Fs = 8 kHz (max)
     # Bandwidth is the vibration the accelerometer can detect. It is filter by
-    # a filter with bandwidth set by DLPF_CFG.
-    bus.write_byte_data(device_address, regs.CONFIG, 0)
+    # a filter with bandwidth set by DLPF_CFG. Higher values of DLPF_CFG
+    # lower the bandwidth (see `constants.DLPF_CFG`) and the gyroscope
+    # output rate to 1 kHz.
+    bus.write_byte_data(device_address, regs.CONFIG, dlpf_cfg)
 
     # Gyroscope Configuration.
     # This register is used to trigger gyroscope self-test and configure
@@ -56,7 +145,8 @@ def initialize(bus,
     # Bits 3-4 set FS_SEL, which selects the full scale range of the gyroscope
     # outputs. The full scale range is the maximum angular velocity that the
     # gyro can read. FS_SEL = 3 sets +-2000 degree/s.
-    bus.write_byte_data(device_address, regs.GYRO_CONFIG, gyro_full_scale_range)
+    bus.write_byte_data(device_address, regs.GYRO_CONFIG,
+                        gyro_full_scale_range << const.FULL_SCALE_RANGE_SHIFT)
 
     # Accelerometer Configuration.
     # This register is used to trigger accelerometer self test and configure
@@ -64,7 +154,8 @@ def initialize(bus,
     # the Digital High Pass Filter (DHPF)
     # Bits 3-4 set AFS_SEL, which selects the full scale range of
     # the accelerometer outputs. AFS_SEL = 0 sets +-2g.
-    bus.write_byte_data(device_address, regs.ACCEL_CONFIG, acc_full_scale_range)
+    bus.write_byte_data(device_address, regs.ACCEL_CONFIG,
+                        acc_full_scale_range << const.FULL_SCALE_RANGE_SHIFT)
 
     # Interrupt Enable.
     # This register enables interrupt generation by interrupt sources.
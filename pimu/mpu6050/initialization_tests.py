@@ -0,0 +1,149 @@
+import unittest
+
+import pimu.mpu6050.constants as const
+import pimu.mpu6050.initialization as init
+import pimu.mpu6050.registers as regs
+from pimu.mpu6050.fakebus import FakeBus
+from pimu.mpu6050.mpu6050 import MPU6050
+
+
+class SampleRateDividerTest(unittest.TestCase):
+
+    def test_dlpf_enabled(self):
+        divider = init.sample_rate_divider(target_rate_hz=100, dlpf_cfg=3)
+        self.assertEqual(9, divider)
+        self.assertEqual(100, init.sample_rate(divider, dlpf_cfg=3))
+
+    def test_dlpf_disabled(self):
+        divider = init.sample_rate_divider(target_rate_hz=1000, dlpf_cfg=0)
+        self.assertEqual(7, divider)
+        self.assertEqual(1000, init.sample_rate(divider, dlpf_cfg=0))
+
+    def test_out_of_range_rates_are_clamped(self):
+        self.assertEqual(255, init.sample_rate_divider(1, dlpf_cfg=3))
+        self.assertEqual(0, init.sample_rate_divider(20000, dlpf_cfg=0))
+
+
+class SensorRateTest(unittest.TestCase):
+
+    def test_registers_and_actual_rate(self):
+        bus = FakeBus()
+        imu = MPU6050(gyro_sensitivity='250', acc_sensitivity='2g', bus=bus,
+                      sample_rate_hz=30, dlpf_bandwidth='10')
+
+        self.assertEqual(32, bus.registers[regs.SMPLRT_DIV])
+        self.assertEqual(5, bus.registers[regs.CONFIG])
+        self.assertAlmostEqual(1000 / 33, imu.sensor_rate_hz)
+
+    def test_each_sample_is_reported_once(self):
+        bus = FakeBus()
+        imu = MPU6050(gyro_sensitivity='250', acc_sensitivity='2g', bus=bus)
+
+        bus.set_raw_sample(acc=(0, 0, 16384), temperature=0, gyro=(0, 0, 0))
+        self.assertTrue(imu.wait_for_data(timeout_s=0))
+        self.assertFalse(imu.wait_for_data(timeout_s=0.001))
+
+
+class MotionDetectionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.bus = FakeBus()
+        self.imu = MPU6050(gyro_sensitivity='250', acc_sensitivity='2g',
+                           bus=self.bus, sample_rate_hz=1000,
+                           motion_detection=init.MotionDetection(
+                               threshold_mg=40, duration_ms=5,
+                               zero_motion_threshold_mg=1,
+                               zero_motion_duration_ms=100000))
+
+    def test_registers(self):
+        registers = self.bus.registers
+        self.assertEqual(20, registers[regs.MOT_THR])
+        self.assertEqual(5, registers[regs.MOT_DUR])
+        self.assertEqual(1, registers[regs.ZRMOT_THR])
+        self.assertEqual(255, registers[regs.ZRMOT_DUR])
+        self.assertEqual(const.ACCEL_HPF_0_63HZ, registers[regs.ACCEL_CONFIG])
+        self.assertEqual(0x61, registers[regs.INT_ENABLE])
+
+    def test_motion_interrupts_are_kept_while_waiting_for_data(self):
+        self.assertIsNone(self.imu.poll_motion())
+
+        self.bus.set_motion(is_moving=False)
+        self.bus.set_raw_sample(acc=(0, 0, 16384), temperature=0,
+                                gyro=(0, 0, 0))
+        self.assertTrue(self.imu.wait_for_data(timeout_s=0))
+        self.assertIs(False, self.imu.poll_motion())
+        self.assertIsNone(self.imu.poll_motion())
+
+        self.bus.set_motion(is_moving=True)
+        self.assertFalse(self.imu.wait_for_data(timeout_s=0))
+        self.assertIs(True, self.imu.poll_motion())
+
+    def test_set_sample_rate_writes_only_the_divider(self):
+        num_writes = len(self.bus.writes)
+        self.assertEqual(50, self.imu.set_sample_rate(50))
+        self.assertEqual([(regs.MPU6050_ADDRESS, regs.SMPLRT_DIV, 159)],
+                         self.bus.writes[num_writes:])
+
+
+class ReconfigureTest(unittest.TestCase):
+
+    def setUp(self):
+        self.bus = FakeBus()
+        self.imu = MPU6050(gyro_sensitivity='250', acc_sensitivity='2g',
+                           bus=self.bus, sample_rate_hz=1000,
+                           motion_detection=init.MotionDetection())
+        self.imu._acc_z_bias = 0.01
+        self.imu._gyro_x_bias = 1.5
+        self.imu._build_decoder()
+        self.num_writes = len(self.bus.writes)
+
+    def _new_writes(self):
+        return [(register, value) for _, register, value in
+                self.bus.writes[self.num_writes:]]
+
+    def test_only_the_changed_registers_are_written(self):
+        settings = self.imu.reconfigure(sample_rate_hz=1000,
+                                        gyro_sensitivity='250',
+                                        dlpf_bandwidth='44')
+        # The DLPF lowers the gyroscope output rate, so the divider changes.
+        self.assertEqual([(regs.CONFIG, 3), (regs.SMPLRT_DIV, 0)],
+                         self._new_writes())
+        self.assertEqual(init.SensorSettings(sample_rate_hz=1000,
+                                             gyro_sensitivity='250',
+                                             acc_sensitivity='2g',
+                                             dlpf_bandwidth='44'), settings)
+
+        self.num_writes = len(self.bus.writes)
+        self.assertEqual(settings, self.imu.reconfigure())
+        self.assertEqual([], self._new_writes())
+
+    def test_full_scale_range_keeps_the_calibration(self):
+        settings = self.imu.reconfigure(gyro_sensitivity=500,
+                                        acc_sensitivity='8g')
+        self.assertEqual(('500', '8g'), (settings.gyro_sensitivity,
+                                         settings.acc_sensitivity))
+        self.assertEqual(1 << 3, self.bus.registers[regs.GYRO_CONFIG])
+        # The high pass filter of the motion detection is kept.
+        self.assertEqual(2 << 3 | const.ACCEL_HPF_0_63HZ,
+                         self.bus.registers[regs.ACCEL_CONFIG])
+
+        # 1 g on the Z axis and 10 deg/s on the sensor Y axis, the board X
+        # axis.
+        self.bus.set_raw_sample(acc=(0, 0, 4096), temperature=0,
+                                gyro=(0, 655, 0))
+        acc_x, acc_y, acc_z, gyro_x, *_ = self.imu.read_next()
+        self.assertAlmostEqual(0.99, acc_z)
+        self.assertAlmostEqual(8.5, gyro_x)
+
+    def test_invalid_settings_write_nothing(self):
+        for changes in ({'acc_sensitivity': '3g'},
+                        {'dlpf_bandwidth': '100', 'sample_rate_hz': 100},
+                        {'gyro_sensitivity': '500', 'sample_rate_hz': 0}):
+            with self.assertRaises(ValueError):
+                self.imu.reconfigure(**changes)
+        self.assertEqual([], self._new_writes())
+        self.assertEqual('250', self.imu.settings.gyro_sensitivity)
+
+
+if __name__ == '__main__':
+    unittest.main()
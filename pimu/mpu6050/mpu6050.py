@@ -1,81 +1,388 @@
 import logging
-import smbus
+import math
+import time
 
 import pimu.mpu6050.constants as const
+import pimu.mpu6050.decoding as decoding
 import pimu.mpu6050.initialization as init
-import pimu.mpu6050.interface as interface
 import pimu.mpu6050.registers as regs
-import pimu.mpu6050.sensor as sensor
-from pimu.imu import Imu
+from pimu.imu import INVALID_SAMPLE, Imu
+from pimu.mpu6050.bus import BusError, ResilientBus
+from pimu.trace import SampledTrace
 
 _logger = logging.getLogger(__name__)
 
+# Number of sensor periods without DATA_RDY after which the device is
+# checked for a reset. A brown-out can reset it without any bus error, and
+# it then sleeps without ever raising DATA_RDY.
+_MAX_MISSED_PERIODS = 5
+
 
 def _log_values(values, values_label):
     _logger.debug('{}: {}'.format(values_label, ', '.join(
         '{:7.3f}'.format(v) for v in values)))
 
 
+def _register_value(table, key, setting):
+    """Returns the register value of a setting, e.g. `constants.FS_SEL`
+    for the gyroscope sensitivity, accepting numbers for the keys.
+    """
+    try:
+        return table[str(key)]
+    except KeyError:
+        raise ValueError('Unknown {} {}, expected one of {}'.format(
+            setting, key, ', '.join(table))) from None
+
+
+def _positive_rate(sample_rate_hz):
+    """Returns a sample rate as a float, raising ValueError if it is not
+    a positive finite number, e.g. a string sent by a client.
+    """
+    try:
+        rate_hz = float(sample_rate_hz)
+    except (TypeError, ValueError):
+        rate_hz = math.nan
+    if isinstance(sample_rate_hz, (bool, str)) or \
+            not 0 < rate_hz < math.inf:
+        raise ValueError('The sample rate must be a positive number, but {!r} '
+                         'was provided'.format(sample_rate_hz))
+    return rate_hz
+
+
+def _key(table, register_value):
+    return next(key for key, value in table.items()
+                if value == register_value)
+
+
 class MPU6050(Imu):
+    """
+    Args:
+        gyro_sensitivity (str): Gyroscope full scale range, a key of
+            `constants.GYRO_SENSITIVITY`.
+        acc_sensitivity (str): Accelerometer full scale range, a key of
+            `constants.ACCEL_SENSITIVITY`.
+        trace_every (int): When DEBUG logging is enabled, the values are
+            logged once every this many samples.
+        trace_sink (:obj:`pimu.trace.BinaryTraceSink`): If set, every sample
+            returned by `read_next` is written to it.
+        recorder (:obj:`pimu.recording.RecordingWriter`): If set, every raw
+            frame read is written to it, with the decoder parameters as
+            metadata.
+        instrumentation (:obj:`pimu.instrumentation.Instrumentation`): If set,
+            the latency of reading and fusing is measured.
+        bus: I2C bus the device is connected to. If None, the bus 1 of
+            the Raspberry Pi is opened with smbus.
+        max_retries (int): Number of retries of a failed I2C transfer before
+            the sample is marked invalid.
+        sample_rate_hz (float): Target output rate of the sensor. The closest
+            reachable rate is used, see `sensor_rate_hz`. If None, SMPLRT_DIV
+            is 7: 1 kHz with the DLPF disabled, 125 Hz with it enabled.
+        dlpf_bandwidth (str): Bandwidth of the digital low pass filter, a key
+            of `constants.DLPF_CFG`. '260' disables the filter.
+        motion_detection (:obj:`initialization.MotionDetection`): If set,
+            the motion and zero-motion interrupts are enabled, see
+            `poll_motion`.
+    """
+
+    def __init__(self, gyro_sensitivity, acc_sensitivity, trace_every=1,
+                 trace_sink=None, instrumentation=None, bus=None,
+                 max_retries=3, sample_rate_hz=None, dlpf_bandwidth='260',
+                 motion_detection=None, recorder=None):
+        super().__init__(instrumentation=instrumentation)
 
-    def __init__(self, gyro_sensitivity, acc_sensitivity):
-        super().__init__()
+        self._trace = SampledTrace(_logger, every=trace_every)
+        self._trace_sink = trace_sink
+        self._recorder = recorder
 
         self._gyro_sensitivity = const.GYRO_SENSITIVITY[gyro_sensitivity]
         self._acc_sensitivity = const.ACCEL_SENSITIVITY[acc_sensitivity]
 
-        # The argument is 0 for older versions of the board.
-        self._bus = smbus.SMBus(1)
+        if bus is None:
+            import smbus
+
+            # The argument is 0 for older versions of the board.
+            bus = smbus.SMBus(1)
         self._device_address = regs.MPU6050_ADDRESS
+        self._bus = ResilientBus(bus,
+                                 device_address=self._device_address,
+                                 reinitialize=self._initialize,
+                                 max_retries=max_retries)
 
-        gyro_full_scale_range = const.FS_SEL[gyro_sensitivity]
-        acc_full_scale_range = const.AFS_SEL[acc_sensitivity]
-        init.initialize(self._bus,
-                        self._device_address,
-                        gyro_full_scale_range=gyro_full_scale_range,
-                        acc_full_scale_range=acc_full_scale_range)
+        self._gyro_full_scale_range = const.FS_SEL[gyro_sensitivity]
+        self._acc_full_scale_range = const.AFS_SEL[acc_sensitivity]
+        self._dlpf_cfg = const.DLPF_CFG[dlpf_bandwidth]
+        self._sample_rate_divider = 7 if sample_rate_hz is None else \
+            init.sample_rate_divider(sample_rate_hz, self._dlpf_cfg)
+        self._motion_detection = motion_detection
+        # Interrupt bits other than DATA_RDY seen while waiting for data,
+        # since reading INT_STATUS clears all of them.
+        self._pending_interrupts = 0
+        self._initialize()
+        # Time of the last DATA_RDY, in seconds of the monotonic clock.
+        self._last_data_s = time.monotonic()
+        self._build_decoder()
+
+        # Samples that could not be read, in total and since the last valid
+        # one.
+        self.num_invalid_samples = 0
+        self._num_consecutive_invalid_samples = 0
 
         _logger.info('{} initialized'.format(self.__class__.__name__))
 
         _logger.debug('Gyroscope sensitivity {} deg/s'.format(gyro_sensitivity))
         _logger.debug('Accelerometer sensitivity: {}'.format(acc_sensitivity))
+        _logger.info('Sensor rate {:.2f} Hz, DLPF bandwidth {} Hz'.format(
+            self.sensor_rate_hz, dlpf_bandwidth))
+        if self._dlpf_cfg != 0 and float(dlpf_bandwidth) > \
+                self.sensor_rate_hz / 2:
+            _logger.warning('The DLPF bandwidth is above half the sensor '
+                            'rate: the readings are aliased')
+
+    @property
+    def sensor_rate_hz(self):
+        """Actual output rate of the sensor."""
+        return init.sample_rate(self._sample_rate_divider, self._dlpf_cfg)
+
+    @property
+    def settings(self):
+        """The current `initialization.SensorSettings`."""
+        return init.SensorSettings(
+            sample_rate_hz=self.sensor_rate_hz,
+            gyro_sensitivity=_key(const.FS_SEL, self._gyro_full_scale_range),
+            acc_sensitivity=_key(const.AFS_SEL, self._acc_full_scale_range),
+            dlpf_bandwidth=_key(const.DLPF_CFG, self._dlpf_cfg))
+
+    @property
+    def num_bus_errors(self):
+        """Number of failed I2C transfers, including the retried ones."""
+        return self._bus.num_errors
+
+    @property
+    def bus_errors_per_register(self):
+        return dict(self._bus.errors_per_register)
+
+    def _build_decoder(self):
+        """Rebuilds the conversion of raw frames, to be called whenever
+        the full scale range or the bias change.
+        """
+        acc_bias = (self._acc_x_bias, self._acc_y_bias, self._acc_z_bias)
+        gyro_bias = (self._gyro_x_bias, self._gyro_y_bias, self._gyro_z_bias)
+        self._decoder = decoding.RawFrameDecoder(
+            acc_sensitivity=self._acc_sensitivity,
+            gyro_sensitivity=self._gyro_sensitivity,
+            acc_bias=acc_bias,
+            gyro_bias=gyro_bias)
+        if self._recorder is not None:
+            self._recorder.set_metadata({
+                'acc_sensitivity': self._acc_sensitivity,
+                'gyro_sensitivity': self._gyro_sensitivity,
+                'acc_bias': [float(bias) for bias in acc_bias],
+                'gyro_bias': [float(bias) for bias in gyro_bias],
+                'sensor_rate_hz': self.sensor_rate_hz,
+            })
+
+    def calibrate(self):
+        super().calibrate()
+        self._build_decoder()
+
+    def _initialize(self):
+        init.initialize(self._bus,
+                        self._device_address,
+                        gyro_full_scale_range=self._gyro_full_scale_range,
+                        acc_full_scale_range=self._acc_full_scale_range,
+                        sample_rate_divider=self._sample_rate_divider,
+                        dlpf_cfg=self._dlpf_cfg)
+        if self._motion_detection is not None:
+            init.configure_motion_detection(self._bus, self._device_address,
+                                            self._motion_detection)
+
+    def set_sample_rate(self, sample_rate_hz):
+        """Changes the output rate of the sensor, writing only SMPLRT_DIV.
+
+        Returns:
+            The actual rate, see `sensor_rate_hz`.
+
+        Raises:
+            BusError: The register could not be written.
+        """
+        divider = init.sample_rate_divider(sample_rate_hz, self._dlpf_cfg)
+        if divider != self._sample_rate_divider:
+            self._bus.write_byte_data(self._device_address, regs.SMPLRT_DIV,
+                                      divider)
+            self._sample_rate_divider = divider
+        return self.sensor_rate_hz
+
+    def reconfigure(self, sample_rate_hz=None, gyro_sensitivity=None,
+                    acc_sensitivity=None, dlpf_bandwidth=None):
+        """Applies new settings without initializing the device again. Only
+        the registers whose value changes are written, and the calibration is
+        kept: the biases are in physical units, so rebuilding the decoder for
+        a new full scale range rescales them.
+
+        The arguments are as in the constructor. Settings left to None are
+        kept, and the sample rate too, as close as the DLPF allows.
+
+        Returns:
+            The `initialization.SensorSettings` in effect.
+
+        Raises:
+            ValueError: A setting is out of range. Nothing is written.
+            BusError: A register could not be written. The settings written
+                before it are in effect.
+        """
+        gyro_full_scale_range = self._gyro_full_scale_range \
+            if gyro_sensitivity is None else \
+            _register_value(const.FS_SEL, gyro_sensitivity,
+                            'gyroscope sensitivity')
+        acc_full_scale_range = self._acc_full_scale_range \
+            if acc_sensitivity is None else \
+            _register_value(const.AFS_SEL, acc_sensitivity,
+                            'accelerometer sensitivity')
+        dlpf_cfg = self._dlpf_cfg if dlpf_bandwidth is None else \
+            _register_value(const.DLPF_CFG, dlpf_bandwidth, 'DLPF bandwidth')
+        if sample_rate_hz is None:
+            sample_rate_hz = self.sensor_rate_hz
+        else:
+            sample_rate_hz = _positive_rate(sample_rate_hz)
+        divider = init.sample_rate_divider(sample_rate_hz, dlpf_cfg)
+
+        if dlpf_cfg != self._dlpf_cfg:
+            self._bus.write_byte_data(self._device_address, regs.CONFIG,
+                                      dlpf_cfg)
+            self._dlpf_cfg = dlpf_cfg
+        if divider != self._sample_rate_divider:
+            self._bus.write_byte_data(self._device_address, regs.SMPLRT_DIV,
+                                      divider)
+            self._sample_rate_divider = divider
+
+        is_range_changed = False
+        if gyro_full_scale_range != self._gyro_full_scale_range:
+            self._bus.write_byte_data(
+                self._device_address, regs.GYRO_CONFIG,
+                gyro_full_scale_range << const.FULL_SCALE_RANGE_SHIFT)
+            self._gyro_full_scale_range = gyro_full_scale_range
+            self._gyro_sensitivity = const.GYRO_SENSITIVITY[
+                _key(const.FS_SEL, gyro_full_scale_range)]
+            is_range_changed = True
+        if acc_full_scale_range != self._acc_full_scale_range:
+            # The other bits hold the high pass filter of the motion
+            # detection.
+            accel_config = self._bus.read_byte_data(self._device_address,
+                                                    regs.ACCEL_CONFIG)
+            self._bus.write_byte_data(
+                self._device_address, regs.ACCEL_CONFIG,
+                (accel_config & ~const.FULL_SCALE_RANGE_MASK) |
+                acc_full_scale_range << const.FULL_SCALE_RANGE_SHIFT)
+            self._acc_full_scale_range = acc_full_scale_range
+            self._acc_sensitivity = const.ACCEL_SENSITIVITY[
+                _key(const.AFS_SEL, acc_full_scale_range)]
+            is_range_changed = True
+        if is_range_changed:
+            # Also saves the new ranges to the recording, for the frames
+            # that follow.
+            self._build_decoder()
+
+        settings = self.settings
+        _logger.info('Reconfigured: {}'.format(settings))
+        return settings
+
+    def poll_motion(self):
+        """Reports the motion interrupts seen by `wait_for_data` since
+        the last call. INT_STATUS is not read here, so that no DATA_RDY is
+        missed.
+
+        Returns:
+            True if motion started, False if the board became still, None if
+            neither happened.
+        """
+        status = self._pending_interrupts
+        self._pending_interrupts = 0
+        if status & const.MOT_INT:
+            return True
+        if status & const.ZMOT_INT:
+            try:
+                motion_status = self._bus.read_byte_data(
+                    self._device_address, regs.MOT_DETECT_STATUS)
+            except BusError:
+                return None
+            return not motion_status & const.MOT_ZRMOT
+        return None
+
+    def wait_for_data(self, timeout_s, poll_interval_s=0.0002):
+        """Polls the DATA_RDY bit of INT_STATUS until a new sample is
+        available. Reading INT_STATUS clears the bit, so each sample is
+        reported once. When no sample arrived for a few sensor periods,
+        the device is checked and re-initialized if it has been reset.
+
+        Returns:
+            False if no new sample arrived within the timeout. True if one
+            arrived, or if the bus failed, so that the following read
+            reports the error.
+        """
+        deadline_s = time.monotonic() + timeout_s
+        while True:
+            try:
+                status = self._bus.read_byte_data(self._device_address,
+                                                  regs.INT_STATUS)
+            except BusError:
+                return True
+            self._pending_interrupts |= status & ~const.DATA_RDY_INT
+            if status & const.DATA_RDY_INT:
+                self._last_data_s = time.monotonic()
+                return True
+            now_s = time.monotonic()
+            if now_s >= deadline_s:
+                self._check_silent_device(now_s)
+                return False
+            time.sleep(poll_interval_s)
+
+    def _check_silent_device(self, now_s):
+        if now_s - self._last_data_s < \
+                _MAX_MISSED_PERIODS / self.sensor_rate_hz:
+            return
+        self._last_data_s = now_s
+        try:
+            self._bus.recover()
+        except BusError:
+            # The next read reports the error, and recovers again.
+            pass
 
     def read_next(self):
-        accelerometer_data = \
-            sensor.read_accelerometer_data(bus=self._bus,
-                                           device_address=self._device_address,
-                                           sensitivity=self._acc_sensitivity)
-        # Pass to conventional coordinate system.
-        acc_x, acc_y, acc_z = \
-            interface.accelerometer_data_to_board_system(*accelerometer_data)
-        acc_x -= self._acc_x_bias
-        acc_y -= self._acc_y_bias
-        acc_z -= self._acc_z_bias
-
-        gyroscope_data = \
-            sensor.read_gyroscope_data(bus=self._bus,
-                                       device_address=self._device_address,
-                                       sensitivity=self._gyro_sensitivity)
-        # Pass to conventional coordinate system.
-        gyro_x, gyro_y, gyro_z = \
-            interface.gyroscope_data_to_board_system(*gyroscope_data)
-        gyro_x -= self._gyro_x_bias
-        gyro_y -= self._gyro_y_bias
-        gyro_z -= self._gyro_z_bias
-
-        temperature_deg = \
-            sensor.read_temperature_data(bus=self._bus,
-                                         device_address=self._device_address)
-
-        _log_values(values=accelerometer_data,
-                    values_label=' Accelerometer raw')
-        _log_values(values=(acc_x, acc_y, acc_z),
-                    values_label='Accelerometer proc')
-        _log_values(values=gyroscope_data,
-                    values_label=' Gyroscope raw')
-        _log_values(values=(gyro_x, gyro_y, gyro_z),
-                    values_label='Gyroscope proc')
-        _log_values(values=(temperature_deg,),
-                    values_label='Temperature raw')
-
-        return acc_x, acc_y, acc_z, gyro_x, gyro_y, gyro_z, temperature_deg
+        """Returns the tuple (acc_x, acc_y, acc_z, gyro_x, gyro_y, gyro_z,
+        temperature) in the board system.
+
+        If the device cannot be read, `INVALID_SAMPLE` is returned, and
+        the device is checked and re-initialized if needed before the next
+        read.
+        """
+        try:
+            if self._bus.needs_recovery:
+                self._bus.recover()
+            sample = self._read_sample()
+            self._num_consecutive_invalid_samples = 0
+        except BusError as e:
+            if self._num_consecutive_invalid_samples == 0:
+                _logger.warning('Invalid sample: {}'.format(e))
+            self.num_invalid_samples += 1
+            self._num_consecutive_invalid_samples += 1
+            sample = INVALID_SAMPLE
+
+        if self._trace_sink is not None:
+            self._trace_sink.write(time.monotonic_ns(), sample)
+
+        return sample
+
+    def _read_sample(self):
+        frame = self._bus.read_i2c_block_data(self._device_address,
+                                              regs.ACCEL_XOUT_H,
+                                              decoding.FRAME_SIZE)
+        if self._recorder is not None:
+            self._recorder.write(time.monotonic_ns(), frame)
+        sample = self._decoder.decode(frame)
+
+        if self._trace():
+            _log_values(values=self._decoder.raw_values(frame),
+                        values_label='Raw')
+            _log_values(values=sample, values_label='Processed')
+
+        return sample
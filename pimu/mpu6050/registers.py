@@ -7,12 +7,18 @@ Registers, addresses and instructions documentation at:
 """
 
 MPU6050_ADDRESS = 0x68  # could also be 0x69
+MOT_THR = 0x1F
+MOT_DUR = 0x20
+ZRMOT_THR = 0x21
+ZRMOT_DUR = 0x22
+MOT_DETECT_STATUS = 0x61
 PWR_MGMT_1 = 0x6B
 SMPLRT_DIV = 0x19
 CONFIG = 0x1A
 GYRO_CONFIG = 0x1B
 ACCEL_CONFIG = 0x1C
 INT_ENABLE = 0x38
+INT_STATUS = 0x3A
 ACCEL_XOUT_H = 0x3B
 ACCEL_XOUT_L = 0x3C
 ACCEL_YOUT_H = 0x3D
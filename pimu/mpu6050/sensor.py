@@ -14,6 +14,7 @@ Note:
     to follow the opposite convention. That's why we negate all the values
     before returning them.
 """
+import pimu.mpu6050.constants as const
 import pimu.mpu6050.registers as regs
 
 
@@ -71,7 +72,8 @@ def _read_raw_temperature_data(bus, device_address):
 def read_temperature_data(bus, device_address):
     """The implemented conversion is indicated in the datasheet."""
     raw_temp = _read_raw_temperature_data(bus, device_address)
-    temp_deg = raw_temp / 340 + 36.53
+    temp_deg = raw_temp / const.TEMPERATURE_SENSITIVITY + \
+        const.TEMPERATURE_OFFSET_deg
     return temp_deg
 
 
@@ -0,0 +1,331 @@
+"""This module receives the streams of many IMU servers at once and
+resamples them on a common time grid.
+
+Every stream is received by its own `UDPClient`, all of them waited on
+from a single thread with `selectors`. The decoded samples are appended,
+with their time in the local monotonic clock, to a NumPy `RingBuffer` per
+stream. The time of a sample is its server timestamp mapped by the clock
+of the stream, see `pimu.clocksync`, or else its arrival time, taken by
+the kernel where supported, see `UDPClient.receive_pending`.
+
+Consumers call `MultiStreamReceiver.next_block`, which returns all the
+ticks of the grid elapsed since the previous call as one array with shape
+(T, streams, channels). The grid lags behind the current time by a fixed
+delay, so that the samples around every tick have most likely arrived:
+* the orientation, the first 3 channels (yaw, pitch, roll), is stored as
+  quaternions and interpolated with slerp, so that angles wrapping around
+  pi are handled;
+* the other channels are interpolated linearly;
+* ticks before the first sample of a stream, or too long after its last
+  one, are NaN.
+"""
+import argparse
+import collections
+import logging
+import selectors
+import threading
+import time
+
+import numpy as np
+
+import pimu.geometry as geom
+import pimu.network as net
+import pimu.transmission as tx
+from pimu.ringbuffer import RingBuffer
+
+_logger = logging.getLogger(__name__)
+
+_NUM_ORIENTATION_CHANNELS = 3
+_NUM_QUATERNION_VALUES = 4
+
+_DEFAULT_NUM_CHANNELS = 4
+_DEFAULT_CAPACITY = 4096
+_DEFAULT_DELAY_s = 0.1
+_DEFAULT_STALE_TIMEOUT_s = 0.5
+
+# Times in ns of the local monotonic clock with shape (T,), and values with
+# shape (T, streams, channels).
+AlignedBlock = collections.namedtuple('AlignedBlock', ['times_ns', 'values'])
+
+
+class _Stream:
+    """Samples of one stream, with the orientation as quaternions."""
+
+    def __init__(self, client, clock, num_channels, capacity):
+        self.client = client
+        self.decoder = tx.FrameDecoder()
+        self.clock = clock
+        self.num_channels = num_channels
+        self.times_ns = RingBuffer(capacity, dtype=np.int64)
+        self.values = RingBuffer(
+            capacity,
+            num_channels - _NUM_ORIENTATION_CHANNELS + _NUM_QUATERNION_VALUES)
+
+        self.num_received = 0
+        self.num_out_of_order = 0
+
+    def sample_time_ns(self, arrival_ns):
+        timestamp_ns = self.decoder.timestamp_ns
+        if timestamp_ns is None or self.clock is None:
+            return arrival_ns
+        local_ns = self.clock.to_local(timestamp_ns)
+        return arrival_ns if local_ns is None else int(local_ns)
+
+    def append(self, time_ns, values):
+        # Reordered packets are dropped, the times of a ring must increase.
+        # Equal times, of packets read from the socket within the clock
+        # resolution, are kept 1 ns apart.
+        if len(self.times_ns):
+            last_ns = self.times_ns.last(1)[0]
+            if time_ns < last_ns:
+                self.num_out_of_order += 1
+                return
+            time_ns = max(time_ns, last_ns + 1)
+        quaternion = geom.quaternions_from_tait_bryan_angles(
+            *values[:_NUM_ORIENTATION_CHANNELS])
+        row = np.concatenate([quaternion,
+                              values[_NUM_ORIENTATION_CHANNELS:]])
+        self.times_ns.append(time_ns)
+        self.values.append(row)
+
+    def resample(self, grid_ns, stale_timeout_ns, out):
+        """Writes the values of the stream at the given times into `out`,
+        an array with shape (T, channels).
+        """
+        num_samples = len(self.times_ns)
+        if num_samples == 0:
+            out[:] = np.nan
+            return
+        times_ns = self.times_ns.last(num_samples)
+        values = self.values.last(num_samples)
+
+        # Index of the last sample at or before every tick.
+        after = np.searchsorted(times_ns, grid_ns, side='right')
+        before = np.maximum(after - 1, 0)
+        after = np.minimum(after, num_samples - 1)
+        span_ns = times_ns[after] - times_ns[before]
+        fractions = np.divide(grid_ns - times_ns[before], span_ns,
+                              out=np.zeros(len(grid_ns)),
+                              where=span_ns > 0)
+        # Past the last sample the value is held.
+        fractions = np.minimum(fractions, 1)
+
+        quaternions = geom.slerp(values[before, :_NUM_QUATERNION_VALUES],
+                                 values[after, :_NUM_QUATERNION_VALUES],
+                                 fractions)
+        for channel, angles in enumerate(
+                geom.tait_bryan_angles_from_quaternions(quaternions)):
+            out[:, channel] = angles
+        others_before = values[before, _NUM_QUATERNION_VALUES:]
+        others_after = values[after, _NUM_QUATERNION_VALUES:]
+        out[:, _NUM_ORIENTATION_CHANNELS:] = others_before + \
+            fractions[:, np.newaxis] * (others_after - others_before)
+
+        is_missing = (grid_ns < times_ns[0]) | \
+            (grid_ns - times_ns[-1] > stale_timeout_ns)
+        out[is_missing] = np.nan
+
+
+class MultiStreamReceiver:
+    """Receives many IMU streams and resamples them on a common time grid.
+
+    Args:
+        addresses (list): Tuples (ip, port) the streams are received on.
+        rate_hz (float): Rate of the common time grid.
+        num_channels (int): Number of values of the frames, the first 3 being
+            yaw, pitch and roll in radians.
+        clocks (list): For every stream, an object mapping the server
+            timestamps into the local clock with a method `to_local`, as
+            `pimu.clocksync.ClockSyncClient`, or None to use the arrival
+            times, which include the network jitter.
+        capacity (int): Number of samples held per stream. It must cover the
+            delay plus the time between two calls of `next_block`.
+        delay_s (float): How long the grid lags behind the current time.
+        stale_timeout_s (float): How long the last value of a stream is
+            held when no more samples arrive.
+    """
+
+    # How often the receiving thread checks if it has to stop, in seconds.
+    _POLL_INTERVAL_s = 0.1
+
+    def __init__(self, addresses, rate_hz,
+                 num_channels=_DEFAULT_NUM_CHANNELS, clocks=None,
+                 capacity=_DEFAULT_CAPACITY, delay_s=_DEFAULT_DELAY_s,
+                 stale_timeout_s=_DEFAULT_STALE_TIMEOUT_s):
+        if num_channels < _NUM_ORIENTATION_CHANNELS:
+            raise ValueError('At least {} channels are expected, '
+                             'but {} were provided'.format(
+                                 _NUM_ORIENTATION_CHANNELS, num_channels))
+
+        clocks = clocks or [None] * len(addresses)
+        self._streams = [_Stream(net.UDPClient(ip, port), clock,
+                                 num_channels, capacity)
+                         for (ip, port), clock in zip(addresses, clocks)]
+        if any(stream.clock is None and not stream.client.has_receive_times
+               for stream in self._streams):
+            _logger.warning('Some streams have no clock and no kernel '
+                            'receive times: their samples are timed when '
+                            'read, the alignment needs clocks to be '
+                            'accurate')
+        self._num_channels = num_channels
+        self._period_ns = int(round(1e9 / rate_hz))
+        self._delay_ns = int(delay_s * 1e9)
+        self._stale_timeout_ns = int(stale_timeout_s * 1e9)
+
+        # Time of the next tick of the grid, set by the first sample.
+        self._next_tick_ns = None
+
+        self._selector = selectors.DefaultSelector()
+        for stream in self._streams:
+            self._selector.register(stream.client, selectors.EVENT_READ,
+                                    stream)
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._receive_loop,
+                                        name=self.__class__.__name__,
+                                        daemon=True)
+
+    @property
+    def num_streams(self):
+        return len(self._streams)
+
+    @property
+    def num_received(self):
+        """Number of samples received per stream."""
+        return tuple(stream.num_received for stream in self._streams)
+
+    @property
+    def num_out_of_order(self):
+        """Number of reordered samples dropped per stream."""
+        return tuple(stream.num_out_of_order for stream in self._streams)
+
+    def poll(self, timeout_s=None):
+        """Waits until some stream has data, then decodes and buffers all
+        the pending data of the ready streams.
+
+        Returns:
+            The number of samples buffered.
+        """
+        num_samples = 0
+        for key, _ in self._selector.select(timeout_s):
+            stream = key.data
+            pending = stream.client.receive_pending(with_times=True)
+            with self._lock:
+                for arrival_ns, data in pending:
+                    values = stream.decoder.decode(data)
+                    if values is None:
+                        continue
+                    stream.num_received += 1
+                    stream.append(stream.sample_time_ns(arrival_ns), values)
+                    num_samples += 1
+        return num_samples
+
+    def _receive_loop(self):
+        while not self._stop_event.is_set():
+            try:
+                self.poll(self._POLL_INTERVAL_s)
+            except ValueError as e:
+                _logger.warning('Invalid frame: {}'.format(e))
+
+    def start(self):
+        """Receives on a background thread."""
+        self._thread.start()
+        _logger.info('{} started on {} streams'.format(
+            self.__class__.__name__, self.num_streams))
+
+    def stop(self):
+        self._stop_event.set()
+        self._thread.join()
+        _logger.info('{} stopped'.format(self.__class__.__name__))
+
+    def close(self):
+        self._selector.close()
+        for stream in self._streams:
+            stream.client.close()
+
+    def next_block(self, now_ns=None):
+        """Returns the ticks of the grid elapsed since the previous call as
+        an `AlignedBlock`, or None if there are none yet.
+
+        Args:
+            now_ns (int): Current time of the local monotonic clock, by
+                default read from it.
+        """
+        if now_ns is None:
+            now_ns = time.monotonic_ns()
+        end_ns = now_ns - self._delay_ns
+
+        with self._lock:
+            if self._next_tick_ns is None:
+                first_times_ns = [stream.times_ns.last(len(stream.times_ns))[0]
+                                  for stream in self._streams
+                                  if len(stream.times_ns)]
+                if not first_times_ns:
+                    return None
+                # Ticks are aligned on multiples of the period.
+                self._next_tick_ns = -(-min(first_times_ns) //
+                                       self._period_ns) * self._period_ns
+            if end_ns < self._next_tick_ns:
+                return None
+
+            grid_ns = np.arange(self._next_tick_ns, end_ns + 1,
+                                self._period_ns, dtype=np.int64)
+            self._next_tick_ns = int(grid_ns[-1]) + self._period_ns
+
+            values = np.empty((len(grid_ns), self.num_streams,
+                               self._num_channels))
+            for idx, stream in enumerate(self._streams):
+                stream.resample(grid_ns, self._stale_timeout_ns,
+                                out=values[:, idx])
+        return AlignedBlock(times_ns=grid_ns, values=values)
+
+
+def _main():
+    parser = argparse.ArgumentParser(
+        description='Receives many IMU streams and resamples them on '
+                    'a common time grid.')
+    parser.add_argument('ports',
+                        type=int,
+                        nargs='+',
+                        help='Ports the streams are received on.')
+    parser.add_argument('--ip',
+                        type=str,
+                        default='',
+                        help='Address to listen on. All the interfaces by '
+                             'default.')
+    parser.add_argument('--rate',
+                        type=float,
+                        default=100,
+                        help='Rate of the common time grid in Hz.')
+    parser.add_argument('--delay',
+                        type=float,
+                        default=_DEFAULT_DELAY_s,
+                        help='Lag of the grid behind the current time in '
+                             'seconds.')
+    args = parser.parse_args()
+
+    receiver = MultiStreamReceiver([(args.ip, port) for port in args.ports],
+                                   rate_hz=args.rate, delay_s=args.delay)
+    receiver.start()
+    try:
+        while True:
+            time.sleep(1)
+            block = receiver.next_block()
+            if block is None:
+                continue
+            missing = np.isnan(block.values).any(axis=2).sum(axis=0)
+            _logger.info('{} ticks, missing per stream {}, '
+                         'received per stream {}'.format(
+                             len(block.times_ns), missing.tolist(),
+                             list(receiver.num_received)))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        receiver.stop()
+        receiver.close()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO,
+                        format='[%(levelname)s][%(name)s] %(message)s')
+    _main()
@@ -0,0 +1,113 @@
+import unittest
+
+import numpy as np
+
+import pimu.network as net
+import pimu.transmission as tx
+from pimu.multistream import MultiStreamReceiver
+
+_IP = '127.0.0.1'
+_PORTS = (50341, 50342)
+_BURST_PORT = 50343
+_MS_ns = 1000000
+
+
+class _IdentityClock:
+    """Server and client share the same clock."""
+
+    @staticmethod
+    def to_local(remote_ns):
+        return remote_ns
+
+
+class MultiStreamReceiverTest(unittest.TestCase):
+
+    def setUp(self):
+        self._receiver = MultiStreamReceiver(
+            [(_IP, port) for port in _PORTS], rate_hz=200,
+            clocks=[_IdentityClock()] * len(_PORTS), delay_s=0,
+            stale_timeout_s=0.015)
+        self._servers = [net.UDPServer(_IP, port) for port in _PORTS]
+
+    def tearDown(self):
+        for server in self._servers:
+            server.close()
+        self._receiver.close()
+
+    def _send(self, stream, timestamps_ns, frames):
+        for timestamp_ns, values in zip(timestamps_ns, frames):
+            self._servers[stream].send(tx.encode_full_frame(values,
+                                                            timestamp_ns))
+
+    def _receive(self, num_samples):
+        received = 0
+        while received < num_samples:
+            num_polled = self._receiver.poll(timeout_s=2)
+            self.assertGreater(num_polled, 0)
+            received += num_polled
+
+    def test_aligned_block(self):
+        # The yaw of the first stream crosses pi, the temperature of the
+        # second one rises by 1 degree every 10 ms, starting 5 ms later.
+        yaw_deg = (170, -170, -150)
+        self._send(0, [0, 10 * _MS_ns, 20 * _MS_ns],
+                   [(np.deg2rad(yaw), 0, 0, 30) for yaw in yaw_deg])
+        self._send(1, [5 * _MS_ns, 15 * _MS_ns, 25 * _MS_ns],
+                   [(0, 0.1, 0, temperature) for temperature in (30, 31, 32)])
+        self._receive(6)
+
+        block = self._receiver.next_block(now_ns=40 * _MS_ns)
+        np.testing.assert_array_equal(np.arange(0, 41, 5) * _MS_ns,
+                                      block.times_ns)
+        self.assertEqual((9, 2, 4), block.values.shape)
+
+        # Compared as unit vectors, 180 and -180 degrees being the same.
+        np.testing.assert_allclose(
+            np.exp(1j * np.deg2rad([170, 180, -170, -160, -150])),
+            np.exp(1j * block.values[:5, 0, 0]))
+        # Held for the stale timeout after the last sample, then missing.
+        np.testing.assert_allclose(-150, np.rad2deg(block.values[5:8, 0, 0]))
+        self.assertTrue(np.isnan(block.values[8:, 0]).all())
+
+        self.assertTrue(np.isnan(block.values[0, 1]).all())
+        np.testing.assert_allclose([30, 30.5, 31, 31.5, 32],
+                                   block.values[1:6, 1, 3])
+        np.testing.assert_allclose(0.1, block.values[1:6, 1, 1])
+
+        # The next block continues the grid.
+        block = self._receiver.next_block(now_ns=52 * _MS_ns)
+        np.testing.assert_array_equal([45 * _MS_ns, 50 * _MS_ns],
+                                      block.times_ns)
+        self.assertIsNone(self._receiver.next_block(now_ns=53 * _MS_ns))
+
+    def test_out_of_order_samples_are_dropped(self):
+        self._send(0, [10 * _MS_ns, 5 * _MS_ns], [(0, 0, 0, 30)] * 2)
+        self._receive(2)
+        self.assertEqual((2, 0), self._receiver.num_received)
+        self.assertEqual((1, 0), self._receiver.num_out_of_order)
+
+    def test_burst_without_clock_is_kept(self):
+        receiver = MultiStreamReceiver([(_IP, _BURST_PORT)], rate_hz=200)
+        self.addCleanup(receiver.close)
+        server = net.UDPServer(_IP, _BURST_PORT)
+        self.addCleanup(server.close)
+        # Sent before the receiver polls, so that they are read at once.
+        for temperature in range(10):
+            server.send(tx.encode_full_frame((0, 0, 0, temperature)))
+
+        num_received = 0
+        while num_received < 10:
+            num_polled = receiver.poll(timeout_s=2)
+            self.assertGreater(num_polled, 0)
+            num_received += num_polled
+        self.assertEqual((0,), receiver.num_out_of_order)
+        times_ns = receiver._streams[0].times_ns
+        self.assertEqual(10, len(times_ns))
+        self.assertTrue(np.all(np.diff(times_ns.last(10)) > 0))
+
+    def test_no_block_before_the_first_sample(self):
+        self.assertIsNone(self._receiver.next_block(now_ns=10 * _MS_ns))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,218 @@
+"""This module tracks the motion of the board over short time horizons by
+dead reckoning.
+
+The accelerometer reading in the board system is rotated into the world
+system with the current orientation, gravity is removed, and the linear
+acceleration left is integrated to velocity and then to displacement.
+Integration drift grows quickly, so the velocity is reset to zero whenever
+the board is detected as stationary (zero-velocity update, ZUPT).
+
+The board and world systems follow the conventions of `pimu.geometry`, with
+the Z axis pointing to the ground. As for `Imu.read_next`, the
+accelerometer reads +1 g along Z when the board lies flat and still, i.e.
+it measures gravity minus the linear acceleration:
+    reading = R^T (gravity - acceleration)
+so in the world system:
+    acceleration = gravity - R reading
+
+Two implementations are provided, with the same results: `dead_reckoning`
+processes a whole recording with batched NumPy operations, and
+`DeadReckoning` updates the state in place one sample at a time.
+"""
+import collections
+import math
+
+import numpy as np
+
+import pimu.geometry as geom
+import pimu.kernels as kernels
+
+STANDARD_GRAVITY_mps2 = 9.80665
+
+# Gravity in the world system, in g units.
+_GRAVITY_g = np.array([0., 0., 1.])
+
+_DEFAULT_ACC_THRESHOLD_g = 0.05
+_DEFAULT_GYRO_THRESHOLD_dps = 3
+
+# Arrays with shape (N, 3), except `stationary` with shape (N,).
+Trajectory = collections.namedtuple('Trajectory',
+                                    ['acceleration_mps2',
+                                     'velocity_mps',
+                                     'position_m',
+                                     'stationary'])
+
+
+def world_acceleration(acc_g, yaw_rad, pitch_rad, roll_rad):
+    """Returns the linear acceleration in m/s/s in the world system, with
+    shape (N, 3).
+
+    Args:
+        acc_g (:obj:`numpy.array`): Array with shape (N, 3) of accelerometer
+            readings in g units, in the board system.
+        yaw_rad (:obj:`numpy.array`): Array with shape (N,) of yaw angles.
+        pitch_rad (:obj:`numpy.array`): Array with shape (N,) of pitch
+            angles.
+        roll_rad (:obj:`numpy.array`): Array with shape (N,) of roll angles.
+    """
+    rotation_matrices = geom.build_rotation_matrices(yaw_rad, pitch_rad,
+                                                     roll_rad)
+    acc_world_g = np.einsum('nij,nj->ni', rotation_matrices, acc_g)
+    return (_GRAVITY_g - acc_world_g) * STANDARD_GRAVITY_mps2
+
+
+def detect_stationary(acc_g, gyro_dps,
+                      acc_threshold_g=_DEFAULT_ACC_THRESHOLD_g,
+                      gyro_threshold_dps=_DEFAULT_GYRO_THRESHOLD_dps):
+    """Returns a boolean array with shape (N,), True where the board measures
+    only gravity and does not rotate.
+
+    Args:
+        acc_g (:obj:`numpy.array`): Array with shape (N, 3) of accelerometer
+            readings in g units.
+        gyro_dps (:obj:`numpy.array`): Array with shape (N, 3) of gyroscope
+            readings in deg/s.
+        acc_threshold_g (float): Maximum difference between the norm of
+            the acceleration and 1 g.
+        gyro_threshold_dps (float): Maximum norm of the angular velocity.
+    """
+    acc_norm = np.sqrt(np.einsum('ij,ij->i', acc_g, acc_g))
+    gyro_norm = np.sqrt(np.einsum('ij,ij->i', gyro_dps, gyro_dps))
+    return (np.abs(acc_norm - 1) < acc_threshold_g) & \
+        (gyro_norm < gyro_threshold_dps)
+
+
+def integrate(acceleration_mps2, rate_hz, stationary=None):
+    """Integrates the acceleration to velocity and position, resetting
+    the velocity at the stationary samples.
+
+    Returns:
+        A tuple (velocity_mps, position_m) of arrays with shape (N, 3).
+    """
+    delta_time_s = 1 / rate_hz
+    velocity_mps = np.cumsum(acceleration_mps2 * delta_time_s, axis=0)
+    if stationary is not None and np.any(stationary):
+        # Subtract the velocity reached at the last stationary sample.
+        indices = np.where(stationary, np.arange(len(stationary)), -1)
+        last_stationary = np.maximum.accumulate(indices)
+        offsets = velocity_mps[np.maximum(last_stationary, 0)]
+        offsets[last_stationary < 0] = 0
+        velocity_mps -= offsets
+    position_m = np.cumsum(velocity_mps * delta_time_s, axis=0)
+    return velocity_mps, position_m
+
+
+def dead_reckoning(samples, angles_rad, rate_hz,
+                   acc_threshold_g=_DEFAULT_ACC_THRESHOLD_g,
+                   gyro_threshold_dps=_DEFAULT_GYRO_THRESHOLD_dps):
+    """Tracks the motion over a whole recording.
+
+    Invalid samples count as zero acceleration and never as stationary.
+
+    Args:
+        samples (:obj:`numpy.array`): Array with shape (N, 6) or (N, 7) of
+            samples, as returned by `Imu.read_next`.
+        angles_rad (:obj:`numpy.array`): Array with shape (N, 3) of yaw,
+            pitch and roll of every sample.
+        rate_hz (float): Rate of the samples.
+        acc_threshold_g (float): See `detect_stationary`.
+        gyro_threshold_dps (float): See `detect_stationary`.
+
+    Returns:
+        A `Trajectory`, starting from rest at the origin.
+    """
+    samples = np.asarray(samples, dtype=float)
+    angles_rad = np.asarray(angles_rad, dtype=float)
+    acc_g = samples[:, :3]
+    gyro_dps = samples[:, 3:6]
+
+    acceleration_mps2 = world_acceleration(acc_g, *angles_rad.T)
+    stationary = detect_stationary(acc_g, gyro_dps,
+                                   acc_threshold_g=acc_threshold_g,
+                                   gyro_threshold_dps=gyro_threshold_dps)
+    is_invalid = np.isnan(acceleration_mps2).any(axis=1)
+    acceleration_mps2[is_invalid] = 0
+
+    velocity_mps, position_m = integrate(acceleration_mps2, rate_hz,
+                                         stationary)
+    return Trajectory(acceleration_mps2=acceleration_mps2,
+                      velocity_mps=velocity_mps,
+                      position_m=position_m,
+                      stationary=stationary)
+
+
+class DeadReckoning:
+    """Tracks the motion one sample at a time, updating preallocated arrays.
+
+    Args:
+        rate_hz (float): Rate of the samples.
+        acc_threshold_g (float): See `detect_stationary`.
+        gyro_threshold_dps (float): See `detect_stationary`.
+    """
+
+    def __init__(self, rate_hz,
+                 acc_threshold_g=_DEFAULT_ACC_THRESHOLD_g,
+                 gyro_threshold_dps=_DEFAULT_GYRO_THRESHOLD_dps):
+        self._delta_time_s = 1 / rate_hz
+        self._acc_threshold_g = acc_threshold_g
+        self._gyro_threshold_dps = gyro_threshold_dps
+
+        self.acceleration_mps2 = np.zeros(3)
+        self.velocity_mps = np.zeros(3)
+        self.position_m = np.zeros(3)
+        self.stationary = False
+
+        self._rotation_matrix = np.empty((3, 3))
+        self._acc_g = np.empty(3)
+        self._delta = np.empty(3)
+
+        compiled = kernels.load()
+        self._build_rotation_matrix = geom.build_rotation_matrices \
+            if compiled is None else compiled.rotation_matrix
+
+    def reset(self):
+        """Restarts from rest at the origin."""
+        self.acceleration_mps2[:] = 0
+        self.velocity_mps[:] = 0
+        self.position_m[:] = 0
+        self.stationary = False
+
+    def _is_stationary(self, sample):
+        acc_x, acc_y, acc_z, gyro_x, gyro_y, gyro_z = sample[:6]
+        acc_norm = math.sqrt(acc_x * acc_x + acc_y * acc_y + acc_z * acc_z)
+        gyro_norm = math.sqrt(gyro_x * gyro_x + gyro_y * gyro_y +
+                              gyro_z * gyro_z)
+        return abs(acc_norm - 1) < self._acc_threshold_g and \
+            gyro_norm < self._gyro_threshold_dps
+
+    def step(self, sample, yaw_rad, pitch_rad, roll_rad):
+        """Updates the state with a sample, as returned by `Imu.read_next`,
+        and the orientation of the board.
+
+        Returns:
+            The position in meters, an array with shape (3,) updated in place
+            by the following steps.
+        """
+        if math.isnan(sample[0]):
+            self.acceleration_mps2[:] = 0
+            self.stationary = False
+        else:
+            self._build_rotation_matrix(yaw_rad, pitch_rad, roll_rad,
+                                        self._rotation_matrix)
+            self._acc_g[:] = sample[:3]
+            np.matmul(self._rotation_matrix, self._acc_g,
+                      out=self.acceleration_mps2)
+            np.subtract(_GRAVITY_g, self.acceleration_mps2,
+                        out=self.acceleration_mps2)
+            self.acceleration_mps2 *= STANDARD_GRAVITY_mps2
+            self.stationary = self._is_stationary(sample)
+
+        if self.stationary:
+            self.velocity_mps[:] = 0
+        else:
+            np.multiply(self.acceleration_mps2, self._delta_time_s,
+                        out=self._delta)
+            self.velocity_mps += self._delta
+        np.multiply(self.velocity_mps, self._delta_time_s, out=self._delta)
+        self.position_m += self._delta
+        return self.position_m
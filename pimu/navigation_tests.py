@@ -0,0 +1,80 @@
+import unittest
+
+import numpy as np
+
+import pimu.geometry as geom
+import pimu.navigation as nav
+
+_RATE_hz = 100
+_G = nav.STANDARD_GRAVITY_mps2
+
+
+def _readings(acceleration_mps2, angles_rad):
+    """Returns the accelerometer readings in g of a board with the given
+    orientations and linear accelerations in the world system.
+    """
+    rotation_matrices = geom.build_rotation_matrices(*angles_rad.T)
+    acc_world_g = np.array([0, 0, 1]) - acceleration_mps2 / _G
+    return np.einsum('nji,nj->ni', rotation_matrices, acc_world_g)
+
+
+def _session():
+    """Still for 0.5 s, accelerates forward at 1 m/s/s for 1 s while
+    tilted, decelerates for 1 s, then still for 0.5 s.
+    """
+    num_samples = 3 * _RATE_hz
+    acceleration_mps2 = np.zeros((num_samples, 3))
+    acceleration_mps2[50:150, 0] = 1
+    acceleration_mps2[150:250, 0] = -1
+    angles_rad = np.zeros((num_samples, 3))
+    angles_rad[50:250] = np.deg2rad((30, 10, -5))
+
+    samples = np.zeros((num_samples, 7))
+    samples[:, :3] = _readings(acceleration_mps2, angles_rad)
+    samples[50:250, 3] = 20  # Rotating while moving.
+    return samples, angles_rad, acceleration_mps2
+
+
+class DeadReckoningTest(unittest.TestCase):
+
+    def test_batched(self):
+        samples, angles_rad, acceleration_mps2 = _session()
+        trajectory = nav.dead_reckoning(samples, angles_rad, _RATE_hz)
+
+        np.testing.assert_allclose(acceleration_mps2,
+                                   trajectory.acceleration_mps2, atol=1e-9)
+        self.assertTrue(trajectory.stationary[:50].all())
+        self.assertFalse(trajectory.stationary[50:250].any())
+        self.assertTrue(trajectory.stationary[250:].all())
+        # 1 m/s after 1 s, then back to rest after 1 m.
+        self.assertAlmostEqual(1, trajectory.velocity_mps[149, 0], places=6)
+        np.testing.assert_allclose([0, 0, 0], trajectory.velocity_mps[-1])
+        self.assertAlmostEqual(1, trajectory.position_m[-1, 0], delta=0.02)
+
+    def test_zero_velocity_update_removes_drift(self):
+        samples, angles_rad, _ = _session()
+        # Accelerometer bias of 0.01 g along X.
+        samples[:, 0] += 0.01
+        trajectory = nav.dead_reckoning(samples, angles_rad, _RATE_hz)
+        np.testing.assert_allclose([0, 0, 0], trajectory.velocity_mps[-1])
+
+        velocity_mps, _ = nav.integrate(trajectory.acceleration_mps2,
+                                        _RATE_hz)
+        self.assertGreater(np.abs(velocity_mps[-1, 0]), 0.2)
+
+    def test_streaming_matches_batched(self):
+        samples, angles_rad, _ = _session()
+        samples[120] = np.nan
+        trajectory = nav.dead_reckoning(samples, angles_rad, _RATE_hz)
+
+        tracker = nav.DeadReckoning(_RATE_hz)
+        positions = np.array([tracker.step(sample, *angles).copy()
+                              for sample, angles in zip(samples, angles_rad)])
+        np.testing.assert_allclose(trajectory.position_m, positions,
+                                   atol=1e-9)
+        np.testing.assert_allclose(trajectory.velocity_mps[-1],
+                                   tracker.velocity_mps, atol=1e-9)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,9 +1,61 @@
+import collections
 import logging
+import os
 import socket
+import struct
+import sys
+import threading
+import time
 
 
 _logger = logging.getLogger(__name__)
 
+ReceiverStats = collections.namedtuple('ReceiverStats',
+                                       ['num_received', 'num_dropped',
+                                        'rate_hz'])
+
+# Backpressure policies of `StreamServer`, applied when the queue of frames
+# not yet sent is full:
+#   BLOCK: `send` waits for room, up to a timeout, then drops the frame.
+#   DROP_OLDEST: the oldest frame not yet sent is dropped.
+#   DROP_NEWEST: the frame being sent is dropped.
+BLOCK = 'block'
+DROP_OLDEST = 'drop_oldest'
+DROP_NEWEST = 'drop_newest'
+BACKPRESSURE_POLICIES = (BLOCK, DROP_OLDEST, DROP_NEWEST)
+
+# Header of the frames of a stream: payload length and sequence number.
+_FRAME_HEADER = struct.Struct('<IQ')
+# Sent by a stream client when it connects: session of the server and
+# sequence number of the first frame it wants. Then the server answers with
+# its session and the sequence number it resumes from. Sessions tell
+# a restarted server, which numbers the frames from 0 again, from a resumed
+# connection.
+_CHECKPOINT = struct.Struct('<QQ')
+# Larger frames are a protocol error.
+_MAX_FRAME_SIZE = 1 << 20
+
+# Socket option of the kernel receive timestamps, in the real time clock,
+# as a struct timespec. Not exposed by every Python version, its value is
+# the one of Linux.
+_SO_TIMESTAMPNS = getattr(socket, 'SO_TIMESTAMPNS',
+                          35 if sys.platform.startswith('linux') else None)
+_TIMESPEC = struct.Struct('@ll')
+_ANCILLARY_SIZE = socket.CMSG_SPACE(_TIMESPEC.size) \
+    if hasattr(socket, 'CMSG_SPACE') else 0
+
+
+def _receive_time_ns(ancillary):
+    """Returns the kernel receive timestamp of the ancillary data of
+    `recvmsg`, in ns of the real time clock, or None if there is none.
+    """
+    for level, kind, data in ancillary:
+        if level == socket.SOL_SOCKET and kind == _SO_TIMESTAMPNS and \
+                len(data) >= _TIMESPEC.size:
+            seconds, nanoseconds = _TIMESPEC.unpack_from(data)
+            return seconds * 1000000000 + nanoseconds
+    return None
+
 
 class _UDPSocket:
 
@@ -15,6 +67,10 @@ class _UDPSocket:
         self._port = port
         self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
 
+    def fileno(self):
+        """Allows waiting on the socket with `select` and `selectors`."""
+        return self._socket.fileno()
+
     def close(self):
         self._socket.close()
         _logger.info('UDP socket closed')
@@ -26,8 +82,10 @@ class UDPServer(_UDPSocket):
         encoded_bytes = bytes(data, self._ENCODING)
         num_sent_bytes = \
             self._socket.sendto(encoded_bytes, (self._ip, self._port))
-        _logger.debug('Sent {} bytes '
-                      'to {}:{}'.format(num_sent_bytes, self._ip, self._port))
+        if _logger.isEnabledFor(logging.DEBUG):
+            _logger.debug('Sent {} bytes to {}:{}'.format(num_sent_bytes,
+                                                          self._ip,
+                                                          self._port))
 
 
 class UDPClient(_UDPSocket):
@@ -37,11 +95,529 @@ class UDPClient(_UDPSocket):
         self._socket.bind((ip, port))
         _logger.info('UDP Client bound to {}:{}'.format(self._ip, self._port))
 
-    def receive(self):
+        # Address the last data was received from.
+        self.peer_address = None
+
+        # Whether the kernel timestamps the datagrams when they arrive.
+        self.has_receive_times = False
+        if _SO_TIMESTAMPNS is not None and _ANCILLARY_SIZE:
+            try:
+                self._socket.setsockopt(socket.SOL_SOCKET, _SO_TIMESTAMPNS,
+                                        1)
+                self.has_receive_times = True
+            except OSError as e:
+                _logger.warning('No receive timestamps: {}'.format(e))
+
+    def receive(self, timeout_s=None):
+        """Yields the received data as strings.
+
+        Args:
+            timeout_s (float): If set, None is yielded every time no data is
+                received for this many seconds.
+        """
+        self._socket.settimeout(timeout_s)
         while True:
-            encoded_data, from_address = \
-                self._socket.recvfrom(self._BUFFER_SIZE)
-            _logger.debug('Received {} bytes '
-                          'from {}'.format(len(encoded_data), from_address))
+            try:
+                encoded_data, from_address = \
+                    self._socket.recvfrom(self._BUFFER_SIZE)
+            except socket.timeout:
+                yield None
+                continue
+            self.peer_address = from_address
+            if _logger.isEnabledFor(logging.DEBUG):
+                _logger.debug('Received {} bytes '
+                              'from {}'.format(len(encoded_data),
+                                               from_address))
             data = encoded_data.decode(self._ENCODING)
             yield data
+
+    def receive_pending(self, with_times=False):
+        """Returns the list of all the data already received and not yet
+        read, without waiting for new data.
+
+        Args:
+            with_times (bool): If True, the items are tuples (time_ns, data)
+                where the time, in ns of the monotonic clock, is the one
+                the kernel received the datagram, see `has_receive_times`,
+                or else the one it is taken from the socket.
+        """
+        if with_times and self.has_receive_times:
+            return self._receive_pending_with_receive_times()
+        self._socket.setblocking(False)
+        pending = []
+        try:
+            while True:
+                encoded_data, _ = self._socket.recvfrom(self._BUFFER_SIZE)
+                data = encoded_data.decode(self._ENCODING)
+                pending.append((time.monotonic_ns(), data) if with_times
+                               else data)
+        except BlockingIOError:
+            pass
+        finally:
+            self._socket.setblocking(True)
+        return pending
+
+    def _receive_pending_with_receive_times(self):
+        # Maps the real time clock of the kernel to the monotonic one.
+        offset_ns = time.monotonic_ns() - time.time_ns()
+        self._socket.setblocking(False)
+        pending = []
+        try:
+            while True:
+                encoded_data, ancillary, _, _ = self._socket.recvmsg(
+                    self._BUFFER_SIZE, _ANCILLARY_SIZE)
+                receive_ns = _receive_time_ns(ancillary)
+                time_ns = time.monotonic_ns() if receive_ns is None \
+                    else receive_ns + offset_ns
+                pending.append((time_ns, encoded_data.decode(self._ENCODING)))
+        except BlockingIOError:
+            pass
+        finally:
+            self._socket.setblocking(True)
+        return pending
+
+
+class BufferedUDPClient(UDPClient):
+    """UDP client that receives on a background thread into a bounded buffer.
+
+    When the buffer is full the oldest data is dropped, so that a slow
+    consumer does not make the kernel buffer overflow and always reads
+    the most recent data.
+    """
+
+    _DEFAULT_MAX_PENDING = 10000
+
+    # How often the receiving thread checks if it has to stop, in seconds.
+    _POLL_INTERVAL_s = 0.1
+
+    def __init__(self, ip, port, max_pending=_DEFAULT_MAX_PENDING):
+        super().__init__(ip, port)
+        self._pending = collections.deque(maxlen=max_pending)
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._receive_loop,
+                                        name=self.__class__.__name__,
+                                        daemon=True)
+
+        self._num_received = 0
+        self._num_dropped = 0
+        self._rate_hz = 0
+        self._rate_num_received = 0
+        self._rate_time_s = time.monotonic()
+
+    def _receive_loop(self):
+        for data in self.receive(timeout_s=self._POLL_INTERVAL_s):
+            if self._stop_event.is_set():
+                break
+            if data is None:
+                continue
+            with self._lock:
+                if len(self._pending) == self._pending.maxlen:
+                    self._num_dropped += 1
+                self._pending.append(data)
+                self._num_received += 1
+
+    def start(self):
+        self._thread.start()
+        _logger.info('{} started'.format(self.__class__.__name__))
+
+    def stop(self):
+        self._stop_event.set()
+        self._thread.join()
+        _logger.info('{} stopped'.format(self.__class__.__name__))
+
+    def drain(self, max_items=None):
+        """Returns the received data not yet read, the oldest first.
+
+        Args:
+            max_items (int): If set, at most this many items are returned and
+                the others are kept for the next call.
+        """
+        with self._lock:
+            num_items = len(self._pending)
+            if max_items is not None:
+                num_items = min(num_items, max_items)
+            return [self._pending.popleft() for _ in range(num_items)]
+
+    def stats(self):
+        """Returns a `ReceiverStats` tuple. The receive rate is updated
+        at most once per second.
+        """
+        with self._lock:
+            num_received = self._num_received
+            num_dropped = self._num_dropped
+
+        now_s = time.monotonic()
+        elapsed_s = now_s - self._rate_time_s
+        if elapsed_s >= 1:
+            self._rate_hz = (num_received - self._rate_num_received) / elapsed_s
+            self._rate_num_received = num_received
+            self._rate_time_s = now_s
+
+        return ReceiverStats(num_received=num_received,
+                             num_dropped=num_dropped,
+                             rate_hz=self._rate_hz)
+
+
+def parse_stream_address(text):
+    """Returns the address of a stream from 'host:port', or the path of
+    a Unix-domain socket.
+    """
+    host, separator, port = text.rpartition(':')
+    if separator and port.isdigit():
+        return host, int(port)
+    return text
+
+
+def _stream_socket(address):
+    family = socket.AF_UNIX if isinstance(address, str) else socket.AF_INET
+    stream_socket = socket.socket(family, socket.SOCK_STREAM)
+    if family == socket.AF_INET:
+        stream_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return stream_socket
+
+
+def _receive_exactly(stream_socket, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = stream_socket.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError('Connection closed')
+        data += chunk
+    return bytes(data)
+
+
+class StreamServer:
+    """Sends frames to a consumer over TCP or a Unix-domain socket, without
+    losing them as long as the backpressure policy allows.
+
+    Every frame is prefixed with its length and a sequence number. Frames
+    are queued by `send` and written by a background thread, all the queued
+    ones in one write. The last `resend_window` frames written are kept:
+    when the consumer reconnects, it sends the sequence number of the next
+    frame it needs, and the stream resumes from there, so that the frames
+    lost in the socket buffers of the broken connection are sent again.
+    A new consumer starts from the oldest frame kept. One consumer is served
+    at a time, a new connection replaces the previous one.
+
+    Args:
+        address: Tuple (ip, port) to listen on over TCP, or the path of
+            a Unix-domain socket.
+        max_pending (int): Capacity of the queue of frames not yet sent.
+        policy (str): Backpressure policy, one of `BACKPRESSURE_POLICIES`.
+        block_timeout_s (float): With the BLOCK policy, maximum time `send`
+            waits for room in the queue.
+        resend_window (int): Number of frames kept after being sent.
+        max_batch_bytes (int): Maximum size of a write.
+    """
+
+    _POLL_INTERVAL_s = 0.1
+
+    # A write making no progress for this long drops the connection, and
+    # the consumer resumes from its checkpoint.
+    _SEND_TIMEOUT_s = 5.0
+
+    def __init__(self, address, max_pending=10000, policy=DROP_OLDEST,
+                 block_timeout_s=0.1, resend_window=10000,
+                 max_batch_bytes=1 << 16):
+        if policy not in BACKPRESSURE_POLICIES:
+            raise ValueError('Unknown backpressure policy {}, expected one '
+                             'of {}'.format(policy,
+                                            ', '.join(BACKPRESSURE_POLICIES)))
+        self._address = address
+        self._max_pending = max_pending
+        self._policy = policy
+        self._block_timeout_s = block_timeout_s
+        self._max_batch_bytes = max_batch_bytes
+
+        self._session = int.from_bytes(os.urandom(8), 'little') or 1
+        self._unsent = collections.deque()
+        self._sent = collections.deque(maxlen=resend_window)
+        self._next_sequence = 0
+        self._connection = None
+        self._condition = threading.Condition()
+        self._stop_event = threading.Event()
+
+        self.num_sent = 0
+        self.num_dropped = 0
+        self.num_connections = 0
+
+        if isinstance(address, str) and os.path.exists(address):
+            # Left by a previous run.
+            os.remove(address)
+        self._listener = _stream_socket(address)
+        if not isinstance(address, str):
+            self._listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR,
+                                      1)
+        self._listener.bind(address)
+        self._listener.listen(1)
+        self._listener.settimeout(self._POLL_INTERVAL_s)
+
+        self._threads = [
+            threading.Thread(target=target,
+                             name='{}.{}'.format(self.__class__.__name__,
+                                                 target.__name__),
+                             daemon=True)
+            for target in (self._accept_loop, self._send_loop)]
+
+    @property
+    def address(self):
+        return self._listener.getsockname()
+
+    @property
+    def num_pending(self):
+        with self._condition:
+            return len(self._unsent)
+
+    def start(self):
+        for thread in self._threads:
+            thread.start()
+        _logger.info('Stream server listening on {}'.format(self.address))
+
+    def send(self, data):
+        """Queues a frame, a string, applying the backpressure policy when
+        the queue is full.
+
+        Returns:
+            False if the frame was dropped.
+        """
+        payload = data.encode(_UDPSocket._ENCODING)
+        with self._condition:
+            if len(self._unsent) >= self._max_pending:
+                # Dropped frames are numbered too, so that the consumer
+                # sees the gap.
+                if self._policy == DROP_NEWEST:
+                    self._next_sequence += 1
+                    self.num_dropped += 1
+                    return False
+                if self._policy == BLOCK and not self._condition.wait_for(
+                        lambda: len(self._unsent) < self._max_pending,
+                        timeout=self._block_timeout_s):
+                    self._next_sequence += 1
+                    self.num_dropped += 1
+                    return False
+                if len(self._unsent) >= self._max_pending:
+                    self._unsent.popleft()
+                    self.num_dropped += 1
+            self._unsent.append((self._next_sequence, payload))
+            self._next_sequence += 1
+            self._condition.notify_all()
+        return True
+
+    def _accept_loop(self):
+        while not self._stop_event.is_set():
+            try:
+                connection, peer = self._listener.accept()
+            except socket.timeout:
+                continue
+            except OSError as e:
+                if not self._stop_event.is_set():
+                    _logger.warning('Stream accept failed: {}'.format(e))
+                continue
+            try:
+                connection.settimeout(self._SEND_TIMEOUT_s)
+                session, checkpoint = _CHECKPOINT.unpack(
+                    _receive_exactly(connection, _CHECKPOINT.size))
+                with self._condition:
+                    if session != self._session:
+                        checkpoint = 0
+                    resume_sequence = self._rewind(checkpoint)
+                    connection.sendall(_CHECKPOINT.pack(self._session,
+                                                        resume_sequence))
+                    if self._connection is not None:
+                        self._connection.close()
+                    self._connection = connection
+                    self.num_connections += 1
+                    self._condition.notify_all()
+            except OSError as e:
+                _logger.warning('Stream handshake failed: {}'.format(e))
+                connection.close()
+                continue
+            _logger.info('Stream consumer connected from {}, resuming at '
+                         'frame {}'.format(peer or 'local socket',
+                                           resume_sequence))
+
+    def _rewind(self, checkpoint):
+        """Queues again the frames sent from `checkpoint` on.
+
+        Returns:
+            The sequence number of the next frame sent.
+        """
+        while self._sent and self._sent[-1][0] >= checkpoint:
+            self._unsent.appendleft(self._sent.pop())
+        while self._unsent and self._unsent[0][0] < checkpoint:
+            self._unsent.popleft()
+        resume_sequence = self._unsent[0][0] if self._unsent \
+            else max(checkpoint, self._next_sequence)
+        if resume_sequence > checkpoint and checkpoint:
+            _logger.warning('Frames {} to {} are no longer available'.format(
+                checkpoint, resume_sequence - 1))
+        return resume_sequence
+
+    def _send_loop(self):
+        while not self._stop_event.is_set():
+            with self._condition:
+                if not self._condition.wait_for(
+                        lambda: self._connection is not None and
+                        self._unsent, timeout=self._POLL_INTERVAL_s):
+                    continue
+                connection = self._connection
+                batch = []
+                num_bytes = 0
+                while self._unsent and num_bytes < self._max_batch_bytes:
+                    sequence, payload = self._unsent.popleft()
+                    batch.append(_FRAME_HEADER.pack(len(payload), sequence))
+                    batch.append(payload)
+                    num_bytes += _FRAME_HEADER.size + len(payload)
+                    self._sent.append((sequence, payload))
+                # Room for the senders waiting with the BLOCK policy.
+                self._condition.notify_all()
+            try:
+                connection.sendall(b''.join(batch))
+            except OSError as e:
+                _logger.warning('Stream send failed: {}'.format(e))
+                self._drop(connection)
+                continue
+            with self._condition:
+                self.num_sent += len(batch) // 2
+
+    def _drop(self, connection):
+        with self._condition:
+            if self._connection is connection:
+                self._connection = None
+        connection.close()
+
+    def close(self):
+        self._stop_event.set()
+        for thread in self._threads:
+            if thread.is_alive():
+                thread.join()
+        with self._condition:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+        self._listener.close()
+        if isinstance(self._address, str) and os.path.exists(self._address):
+            os.remove(self._address)
+        _logger.info('Stream server closed, {} frames sent, {} '
+                     'dropped'.format(self.num_sent, self.num_dropped))
+
+
+class StreamClient:
+    """Receives the frames of a `StreamServer`, reconnecting when
+    the connection breaks and resuming after the last frame received.
+
+    Args:
+        address: Tuple (ip, port) of the server over TCP, or the path of its
+            Unix-domain socket.
+        reconnect_interval_s (float): Time between two connection attempts.
+        checkpoint (tuple): Value of `checkpoint` saved by a previous run, to
+            resume after the last frame it received. By default the stream
+            starts from the oldest frame the server keeps.
+    """
+
+    _RECEIVE_SIZE = 1 << 16
+    _HANDSHAKE_TIMEOUT_s = 5.0
+
+    def __init__(self, address, reconnect_interval_s=0.5, checkpoint=(0, 0)):
+        self._address = address
+        self._reconnect_interval_s = reconnect_interval_s
+        self._socket = None
+
+        self._session, self.next_sequence = checkpoint
+        self.num_received = 0
+        # Frames skipped because the server no longer had them.
+        self.num_lost = 0
+
+    @property
+    def checkpoint(self):
+        """Tuple (session, sequence number of the next frame)."""
+        return self._session, self.next_sequence
+
+    def _connect(self):
+        stream_socket = _stream_socket(self._address)
+        stream_socket.settimeout(self._HANDSHAKE_TIMEOUT_s)
+        try:
+            stream_socket.connect(self._address)
+            stream_socket.sendall(_CHECKPOINT.pack(*self.checkpoint))
+            session, resume_sequence = _CHECKPOINT.unpack(
+                _receive_exactly(stream_socket, _CHECKPOINT.size))
+        except OSError:
+            stream_socket.close()
+            raise
+        if session != self._session:
+            if self._session:
+                _logger.warning('The stream server restarted')
+            self._session = session
+        else:
+            self.num_lost += resume_sequence - self.next_sequence
+        self.next_sequence = resume_sequence
+        self._socket = stream_socket
+        _logger.info('Stream connected to {}, from frame {}'.format(
+            self._address, self.next_sequence))
+
+    def _disconnect(self):
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+    def receive(self, timeout_s=None):
+        """Yields the frames, as strings, in order.
+
+        Args:
+            timeout_s (float): If set, None is yielded every time no frame is
+                received for this many seconds, also while disconnected.
+        """
+        buffer = bytearray()
+        while True:
+            if self._socket is None:
+                try:
+                    self._connect()
+                except OSError as e:
+                    _logger.debug('Stream connection failed: {}'.format(e))
+                    time.sleep(self._reconnect_interval_s if timeout_s is None
+                               else min(timeout_s, self._reconnect_interval_s))
+                    if timeout_s is not None:
+                        yield None
+                    continue
+                buffer.clear()
+
+            self._socket.settimeout(timeout_s)
+            try:
+                data = self._socket.recv(self._RECEIVE_SIZE)
+            except socket.timeout:
+                yield None
+                continue
+            except OSError as e:
+                _logger.warning('Stream receive failed: {}'.format(e))
+                data = b''
+            if not data:
+                _logger.info('Stream disconnected, reconnecting')
+                self._disconnect()
+                continue
+
+            buffer += data
+            offset = 0
+            while len(buffer) - offset >= _FRAME_HEADER.size:
+                length, sequence = _FRAME_HEADER.unpack_from(buffer, offset)
+                if length > _MAX_FRAME_SIZE:
+                    _logger.warning('Invalid stream frame of {} '
+                                    'bytes'.format(length))
+                    self._disconnect()
+                    break
+                end = offset + _FRAME_HEADER.size + length
+                if end > len(buffer):
+                    break
+                payload = bytes(buffer[offset + _FRAME_HEADER.size:end])
+                offset = end
+                if sequence < self.next_sequence:
+                    # Already received before a reconnection.
+                    continue
+                self.num_lost += sequence - self.next_sequence
+                self.next_sequence = sequence + 1
+                self.num_received += 1
+                yield payload.decode(_UDPSocket._ENCODING)
+            del buffer[:offset]
+
+    def close(self):
+        self._disconnect()
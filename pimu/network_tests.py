@@ -0,0 +1,169 @@
+import os
+import shutil
+import socket
+import tempfile
+import time
+import unittest
+
+import pimu.network as net
+
+_IP = '127.0.0.1'
+_PORT = 50321
+_STREAM_PORT = 50322
+
+
+class BufferedUDPClientTest(unittest.TestCase):
+
+    def setUp(self):
+        self._client = net.BufferedUDPClient(_IP, _PORT, max_pending=3)
+        self._client.start()
+        self._server = net.UDPServer(_IP, _PORT)
+
+    def tearDown(self):
+        self._server.close()
+        self._client.stop()
+        self._client.close()
+
+    def _wait_for(self, num_received):
+        deadline = time.monotonic() + 2
+        while self._client.stats().num_received < num_received \
+                and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def test_oldest_data_is_dropped_when_full(self):
+        for idx in range(5):
+            self._server.send(str(idx))
+        self._wait_for(5)
+
+        stats = self._client.stats()
+        self.assertEqual(5, stats.num_received)
+        self.assertEqual(2, stats.num_dropped)
+        self.assertListEqual(['2', '3', '4'], self._client.drain())
+
+    def test_drain_at_most_max_items(self):
+        for idx in range(3):
+            self._server.send(str(idx))
+        self._wait_for(3)
+
+        self.assertListEqual(['0', '1'], self._client.drain(max_items=2))
+        self.assertListEqual(['2'], self._client.drain())
+
+
+def _receive(client, num_frames, timeout_s=5):
+    frames = []
+    deadline_s = time.monotonic() + timeout_s
+    for data in client.receive(timeout_s=0.05):
+        if data is not None:
+            frames.append(data)
+        if len(frames) == num_frames or time.monotonic() > deadline_s:
+            return frames
+
+
+class UDPClientTest(unittest.TestCase):
+
+    def test_pending_data_has_its_receive_times(self):
+        client = net.UDPClient(_IP, _PORT)
+        self.addCleanup(client.close)
+        if not client.has_receive_times:
+            self.skipTest('No kernel receive timestamps')
+        server = net.UDPServer(_IP, _PORT)
+        self.addCleanup(server.close)
+        start_ns = time.monotonic_ns()
+        for data in ('a', 'b'):
+            server.send(data)
+            time.sleep(0.05)
+        pending = client.receive_pending(with_times=True)
+        self.assertEqual(['a', 'b'], [data for _, data in pending])
+        # Not the time of the drain: the first datagram arrived about
+        # 0.05 s before the second.
+        (first_ns, _), (second_ns, _) = pending
+        self.assertLess(start_ns - 5000000, first_ns)
+        self.assertLess(30000000, second_ns - first_ns)
+        self.assertLess(second_ns, time.monotonic_ns())
+
+
+class StreamTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'imu.sock')
+
+    def _server(self, address=None, **kwargs):
+        server = net.StreamServer(address or self.path, **kwargs)
+        self.addCleanup(server.close)
+        server.start()
+        return server
+
+    def _client(self, address=None, **kwargs):
+        client = net.StreamClient(address or self.path,
+                                  reconnect_interval_s=0.01, **kwargs)
+        self.addCleanup(client.close)
+        return client
+
+    def test_frames_in_order_over_unix_socket_and_tcp(self):
+        for address in (self.path, (_IP, _STREAM_PORT)):
+            server = self._server(address)
+            client = self._client(address)
+            for idx in range(5000):
+                server.send(str(idx))
+            self.assertEqual([str(idx) for idx in range(5000)],
+                             _receive(client, 5000))
+            client.close()
+            server.close()
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_broken_connection_resumes_from_the_checkpoint(self):
+        server = self._server()
+        client = self._client()
+        for idx in range(100):
+            server.send(str(idx))
+        frames = _receive(client, 50)
+
+        # Frames written to the broken connection are sent again.
+        server._connection.shutdown(socket.SHUT_RDWR)
+        for idx in range(100, 2000):
+            server.send(str(idx))
+        frames += _receive(client, 1950)
+        self.assertEqual([str(idx) for idx in range(2000)], frames)
+        self.assertEqual(0, client.num_lost)
+        self.assertEqual(2, server.num_connections)
+
+        # A new consumer resuming after the last frame saved.
+        checkpoint = client.checkpoint
+        client.close()
+        server.send('2000')
+        self.assertEqual(['2000'], _receive(self._client(
+            checkpoint=checkpoint), 1))
+
+    def test_backpressure_policies(self):
+        for policy, expected in ((net.DROP_OLDEST, range(15, 25)),
+                                 (net.DROP_NEWEST, range(10)),
+                                 (net.BLOCK, range(10))):
+            server = self._server(max_pending=10, policy=policy,
+                                  block_timeout_s=0.001)
+            # Nobody consumes the stream.
+            sent = [server.send(str(idx)) for idx in range(25)]
+            self.assertEqual(15, server.num_dropped)
+            self.assertEqual(policy == net.DROP_OLDEST, all(sent))
+
+            client = self._client()
+            self.assertEqual([str(idx) for idx in expected],
+                             _receive(client, 10))
+            if policy != net.DROP_OLDEST:
+                server.send('25')
+                self.assertEqual(['25'], _receive(client, 1))
+                # The frames dropped in between.
+                self.assertEqual(15, client.num_lost)
+            client.close()
+            server.close()
+
+    def test_parse_stream_address(self):
+        self.assertEqual(('10.0.0.2', 5001),
+                         net.parse_stream_address('10.0.0.2:5001'))
+        self.assertEqual('/run/pimu.sock',
+                         net.parse_stream_address('/run/pimu.sock'))
+
+
+if __name__ == '__main__':
+    unittest.main()
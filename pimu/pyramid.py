@@ -0,0 +1,288 @@
+"""This module builds and queries overviews of long recordings, so that
+any time range can be plotted without touching every sample.
+
+The overview is a pyramid of levels. A bin of the first level summarizes
+2^base_level consecutive samples with the minimum, maximum and mean of
+every channel and its first and last timestamp; every bin of the next level
+summarizes two bins of the previous one, and so on up to a single bin.
+Plotting the minimum and maximum of one bin per pixel draws the same
+envelope as plotting all the samples, and a time range spanning W pixels
+only needs the finest level with at most W bins in it.
+
+The pyramid of a recording is stored next to it, in a directory with
+the same name and the `.pyramid` extension: a JSON description and one file
+per level with the bins as fixed-size records. The files are only
+appended to, so the pyramid can be built while recording, and they are
+memory-mapped when read, so a query costs a few binary searches whatever
+the length of the recording.
+"""
+import argparse
+import collections
+import json
+import logging
+import os
+
+import numpy as np
+
+_logger = logging.getLogger(__name__)
+
+_DESCRIPTION_FILE = 'pyramid.json'
+_EXTENSION = '.pyramid'
+
+# Every bin of the first level summarizes 2^8 samples, 0.256 s at 1 kHz.
+_DEFAULT_BASE_LEVEL = 8
+
+# Summary of a query. `level` is the log2 of the number of samples of a full
+# bin. The other fields are arrays with shape (B,), or (B, channels) for
+# the statistics.
+Overview = collections.namedtuple('Overview',
+                                  ['level', 'start_ns', 'end_ns', 'count',
+                                   'min', 'max', 'mean'])
+
+
+def pyramid_path(recording_path):
+    """Returns the directory of the pyramid of a recording."""
+    return recording_path + _EXTENSION
+
+
+def _bin_dtype(num_channels):
+    return np.dtype([('start_ns', '<i8'),
+                     ('end_ns', '<i8'),
+                     ('count', '<u4'),
+                     ('min', '<f4', (num_channels,)),
+                     ('max', '<f4', (num_channels,)),
+                     ('mean', '<f4', (num_channels,))])
+
+
+def _level_file(path, level):
+    return os.path.join(path, 'level_{:02d}.bin'.format(level))
+
+
+def _combine(groups):
+    """Returns the bins summarizing groups of bins, an array with shape
+    (G, K) of bins.
+    """
+    combined = np.empty(len(groups), dtype=groups.dtype)
+    combined['start_ns'] = groups['start_ns'][:, 0]
+    combined['end_ns'] = groups['end_ns'][:, -1]
+    counts = groups['count']
+    combined['count'] = counts.sum(axis=1)
+    combined['min'] = np.fmin.reduce(groups['min'], axis=1)
+    combined['max'] = np.fmax.reduce(groups['max'], axis=1)
+    combined['mean'] = np.einsum('gk,gkc->gc', counts, groups['mean']) / \
+        combined['count'][:, np.newaxis]
+    return combined
+
+
+class PyramidBuilder:
+    """Builds the pyramid of a stream of samples incrementally.
+
+    Args:
+        path (str): Directory of the pyramid, see `pyramid_path`. Created if
+            needed, and overwritten if it exists.
+        num_channels (int): Number of values of the samples.
+        base_level (int): log2 of the number of samples of the bins of
+            the first level.
+    """
+
+    def __init__(self, path, num_channels, base_level=_DEFAULT_BASE_LEVEL):
+        os.makedirs(path, exist_ok=True)
+        for name in os.listdir(path):
+            os.remove(os.path.join(path, name))
+        with open(os.path.join(path, _DESCRIPTION_FILE), 'w') as f:
+            json.dump({'num_channels': num_channels,
+                       'base_level': base_level}, f)
+
+        self._path = path
+        self._num_channels = num_channels
+        self._base_level = base_level
+        self._dtype = _bin_dtype(num_channels)
+
+        # Samples not yet summarized by a full bin of the first level.
+        self._pending_times_ns = np.empty(0, dtype=np.int64)
+        self._pending_samples = np.empty((0, num_channels))
+
+        # Per level, from the first one: file, number of bins written, and
+        # the bin not yet paired.
+        self._files = []
+        self._num_bins = []
+        self._pending_bins = []
+
+    def _summarize(self, timestamps_ns, samples):
+        """Returns the bins of groups of 2^base_level samples."""
+        bin_size = 1 << self._base_level
+        num_bins = len(timestamps_ns) // bin_size
+        times_ns = timestamps_ns.reshape(num_bins, bin_size)
+        values = samples.reshape(num_bins, bin_size, self._num_channels)
+
+        bins = np.empty(num_bins, dtype=self._dtype)
+        bins['start_ns'] = times_ns[:, 0]
+        bins['end_ns'] = times_ns[:, -1]
+        bins['count'] = bin_size
+        bins['min'] = np.fmin.reduce(values, axis=1)
+        bins['max'] = np.fmax.reduce(values, axis=1)
+        bins['mean'] = values.mean(axis=1)
+        return bins
+
+    def _write(self, level, bins):
+        if level == len(self._files):
+            self._files.append(open(_level_file(self._path, level), 'wb'))
+            self._num_bins.append(0)
+            self._pending_bins.append(np.empty(0, dtype=self._dtype))
+        self._files[level].write(bins.tobytes())
+        self._num_bins[level] += len(bins)
+
+    def _add_bins(self, level, bins):
+        while len(bins):
+            self._write(level, bins)
+            bins = np.concatenate([self._pending_bins[level], bins])
+            num_pairs = len(bins) // 2
+            self._pending_bins[level] = bins[2 * num_pairs:]
+            bins = _combine(bins[:2 * num_pairs].reshape(num_pairs, 2))
+            level += 1
+
+    def extend(self, timestamps_ns, samples):
+        """Adds a block of samples, an array with shape (N, channels), and
+        their increasing timestamps, with shape (N,).
+        """
+        timestamps_ns = np.concatenate([self._pending_times_ns,
+                                        timestamps_ns])
+        samples = np.concatenate([self._pending_samples, samples])
+        num_summarized = len(timestamps_ns) >> self._base_level \
+            << self._base_level
+        self._pending_times_ns = timestamps_ns[num_summarized:]
+        self._pending_samples = samples[num_summarized:]
+        if num_summarized:
+            self._add_bins(0, self._summarize(timestamps_ns[:num_summarized],
+                                              samples[:num_summarized]))
+
+    def close(self):
+        """Writes partial bins with the samples left, so that every level
+        covers the whole stream, up to a single bin.
+        """
+        carry = None
+        if len(self._pending_times_ns):
+            carry = np.empty(1, dtype=self._dtype)
+            carry['start_ns'] = self._pending_times_ns[0]
+            carry['end_ns'] = self._pending_times_ns[-1]
+            carry['count'] = len(self._pending_times_ns)
+            carry['min'] = np.fmin.reduce(self._pending_samples, axis=0)
+            carry['max'] = np.fmax.reduce(self._pending_samples, axis=0)
+            carry['mean'] = self._pending_samples.mean(axis=0)
+
+        level = 0
+        while level < len(self._files) or carry is not None:
+            if carry is not None:
+                self._write(level, carry)
+            if level == len(self._files) - 1 and self._num_bins[level] <= 1:
+                break
+            group = self._pending_bins[level]
+            if carry is not None:
+                group = np.concatenate([group, carry])
+            self._pending_bins[level] = group[:0]
+            carry = _combine(group[np.newaxis]) if len(group) else None
+            level += 1
+
+        for f in self._files:
+            f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class Pyramid:
+    """Queries a pyramid written by `PyramidBuilder`.
+
+    Args:
+        path (str): Directory of the pyramid, see `pyramid_path`.
+    """
+
+    def __init__(self, path):
+        with open(os.path.join(path, _DESCRIPTION_FILE)) as f:
+            description = json.load(f)
+        self.num_channels = description['num_channels']
+        self.base_level = description['base_level']
+
+        dtype = _bin_dtype(self.num_channels)
+        self._levels = []
+        while True:
+            level_path = _level_file(path, len(self._levels))
+            if not os.path.exists(level_path) or \
+                    os.path.getsize(level_path) < dtype.itemsize:
+                break
+            num_bins = os.path.getsize(level_path) // dtype.itemsize
+            self._levels.append(np.memmap(level_path, dtype=dtype, mode='r',
+                                          shape=(num_bins,)))
+
+    @property
+    def num_levels(self):
+        return len(self._levels)
+
+    def query(self, start_ns, end_ns, width_px):
+        """Returns the `Overview` of the bins of the finest level with at
+        most `width_px` bins overlapping [start_ns, end_ns), or None if
+        the pyramid is empty.
+
+        When `Overview.level` equals `base_level` and the bins are fewer
+        than the pixels, plotting the samples themselves is cheap too.
+        """
+        for level, bins in enumerate(self._levels):
+            first = np.searchsorted(bins['end_ns'], start_ns, side='left')
+            last = np.searchsorted(bins['start_ns'], end_ns, side='left')
+            if last - first <= width_px or level == len(self._levels) - 1:
+                selected = np.array(bins[first:last])
+                return Overview(level=self.base_level + level,
+                                start_ns=selected['start_ns'],
+                                end_ns=selected['end_ns'],
+                                count=selected['count'],
+                                min=selected['min'],
+                                max=selected['max'],
+                                mean=selected['mean'])
+        return None
+
+
+def build(recording_path, base_level=_DEFAULT_BASE_LEVEL):
+    """Builds the pyramid of an existing recording in one pass, a chunk at
+    a time.
+
+    Returns:
+        The directory of the pyramid.
+    """
+    # Avoids a circular import, the recording builds pyramids too.
+    from pimu.recording import RecordingReader
+
+    path = pyramid_path(recording_path)
+    with RecordingReader(recording_path) as reader:
+        builder = PyramidBuilder(path, num_channels=7, base_level=base_level)
+        with builder:
+            for timestamps_ns, samples in reader.iter_samples():
+                builder.extend(timestamps_ns, samples)
+    return path
+
+
+def _main():
+    parser = argparse.ArgumentParser(
+        description='Builds the overview pyramid of a recording.')
+    parser.add_argument('recording',
+                        type=str,
+                        help='File written with --record.')
+    parser.add_argument('--base-level',
+                        type=int,
+                        default=_DEFAULT_BASE_LEVEL,
+                        dest='base_level',
+                        help='log2 of the number of samples of the finest '
+                             'bins.')
+    args = parser.parse_args()
+
+    path = build(args.recording, base_level=args.base_level)
+    _logger.info('Pyramid with {} levels written to {}'.format(
+        Pyramid(path).num_levels, path))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO,
+                        format='[%(levelname)s][%(name)s] %(message)s')
+    _main()
@@ -0,0 +1,98 @@
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+import numpy as np
+
+import pimu.pyramid as pyr
+from pimu.recording import RecordingReader, RecordingWriter
+
+_PERIOD_ns = 1000000
+
+
+class PyramidTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'session.pyramid')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _build(self, samples, block_size):
+        timestamps_ns = np.arange(len(samples)) * _PERIOD_ns
+        with pyr.PyramidBuilder(self.path, num_channels=samples.shape[1],
+                                base_level=2) as builder:
+            for start in range(0, len(samples), block_size):
+                builder.extend(timestamps_ns[start:start + block_size],
+                               samples[start:start + block_size])
+        return timestamps_ns
+
+    def test_levels_summarize_all_the_samples(self):
+        samples = np.random.default_rng(0).normal(size=(1001, 2))
+        timestamps_ns = self._build(samples, block_size=37)
+        pyramid = pyr.Pyramid(self.path)
+        # 1001 samples in 251 bins of 4, then 126, 63, ... 1 bins.
+        self.assertEqual(9, pyramid.num_levels)
+
+        for width_px in (1, 10, 100, 1000):
+            overview = pyramid.query(0, timestamps_ns[-1] + 1, width_px)
+            self.assertLessEqual(len(overview.count), max(width_px, 1))
+            self.assertEqual(1001, overview.count.sum())
+            np.testing.assert_allclose(samples.min(axis=0),
+                                       overview.min.min(axis=0), rtol=1e-6)
+            np.testing.assert_allclose(samples.max(axis=0),
+                                       overview.max.max(axis=0), rtol=1e-6)
+            np.testing.assert_allclose(
+                samples.mean(axis=0),
+                overview.count @ overview.mean / 1001, atol=1e-6)
+
+        overview = pyramid.query(0, timestamps_ns[-1] + 1, 1)
+        self.assertEqual(10, overview.level)
+        self.assertEqual([timestamps_ns[-1]], overview.end_ns)
+
+    def test_query_of_a_time_range(self):
+        samples = np.arange(4096, dtype=float)[:, np.newaxis]
+        timestamps_ns = self._build(samples, block_size=1000)
+        pyramid = pyr.Pyramid(self.path)
+
+        overview = pyramid.query(timestamps_ns[1000], timestamps_ns[2000],
+                                 width_px=100)
+        # Bins of 16 samples, from the one holding the sample 992.
+        self.assertEqual(4, overview.level)
+        np.testing.assert_array_equal(np.arange(992, 2000, 16),
+                                      overview.min[:, 0])
+        np.testing.assert_array_equal(np.arange(1007, 2015, 16),
+                                      overview.max[:, 0])
+
+    def test_built_while_recording(self):
+        recording_path = os.path.join(self.directory, 'recording.pimu')
+        rng = np.random.default_rng(1)
+        raw = np.cumsum(rng.integers(-50, 51, size=(3000, 7)), axis=0)
+        with RecordingWriter(recording_path, chunk_duration_s=0.5,
+                             pyramid=True) as writer:
+            writer.set_metadata({'acc_sensitivity': 16384,
+                                 'gyro_sensitivity': 131,
+                                 'acc_bias': [0, 0, 0],
+                                 'gyro_bias': [0, 0, 0]})
+            for idx, values in enumerate(raw):
+                writer.write(idx * _PERIOD_ns, struct.pack('>7h', *values))
+
+        with RecordingReader(recording_path) as reader:
+            _, samples = reader.read()
+        overview = pyr.Pyramid(pyr.pyramid_path(recording_path)).query(
+            0, 3000 * _PERIOD_ns, width_px=1)
+        np.testing.assert_allclose(samples.min(axis=0), overview.min[0],
+                                   rtol=1e-6)
+        np.testing.assert_allclose(samples.max(axis=0), overview.max[0],
+                                   rtol=1e-6)
+
+        pyr.build(recording_path, base_level=4)
+        self.assertEqual(4, pyr.Pyramid(pyr.pyramid_path(recording_path))
+                         .query(0, 3000 * _PERIOD_ns, width_px=1000).level)
+
+
+if __name__ == '__main__':
+    unittest.main()
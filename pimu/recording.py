@@ -0,0 +1,493 @@
+"""This module stores the raw frames of the MPU6050 in compressed chunks,
+with an index to read any time window without decompressing the whole
+recording.
+
+A recording keeps the 7 raw int16 values of every frame, see
+`pimu.mpu6050.decoding`, instead of the decoded floats: together with the
+parameters of the decoder, saved as metadata, they give back the samples
+of `MPU6050.read_next` exactly, in a fraction of the space.
+
+The samples are grouped in chunks of a fixed duration. In a chunk the
+values are stored channel by channel and delta-encoded, with int16
+wraparound so that the encoding is lossless, and the timestamps are
+delta-encoded as int64. Slowly varying signals then become long runs of
+small numbers, which zlib or lzma compress well. Compression runs on
+a background thread, so that the read loop is not delayed when a chunk is
+complete.
+
+File layout, all integers little-endian:
+    header: magic, version, codec
+    blocks: type, payload size, payload
+        chunk: number of samples, first and last timestamp in ns, then
+            the compressed timestamps and values
+        metadata: JSON object, e.g. the decoder parameters
+        index: for every chunk, first and last timestamp, offset of the
+            block, number of samples and offset of the metadata block in
+            effect when the chunk was written
+    trailer: offset of the index block, offset of the last metadata block,
+        magic
+A file that was not closed, e.g. after a power loss, has no index: it is
+rebuilt by scanning the block headers, skipping the payloads.
+
+The decoder parameters can change during a recording, e.g. with the full
+scale range: every chunk is decoded with the metadata written before it,
+and the chunks written before any metadata with the first one.
+
+The writer can also build the overview pyramid of the decoded samples, see
+`pimu.pyramid`, next to the recording.
+"""
+import argparse
+import json
+import logging
+import lzma
+import os
+import queue
+import struct
+import threading
+import zlib
+
+import numpy as np
+
+from pimu.mpu6050.decoding import RawFrameDecoder
+from pimu.pyramid import PyramidBuilder, pyramid_path
+
+_logger = logging.getLogger(__name__)
+
+_MAGIC = b'PIMUREC1'
+_TRAILER_MAGIC = b'PIMUEND1'
+_VERSION = 1
+
+# Magic, version, codec.
+_HEADER = struct.Struct('<8sBB')
+# Block type, payload size.
+_BLOCK_HEADER = struct.Struct('<cI')
+# Number of samples, first and last timestamp.
+_CHUNK_HEADER = struct.Struct('<Iqq')
+# Offset of the index block, offset of the last metadata block or -1.
+_TRAILER = struct.Struct('<qq8s')
+
+_CHUNK_BLOCK = b'C'
+_METADATA_BLOCK = b'M'
+_INDEX_BLOCK = b'I'
+
+_INDEX_DTYPE = np.dtype([('start_ns', '<i8'),
+                         ('end_ns', '<i8'),
+                         ('offset', '<i8'),
+                         ('num_samples', '<u4'),
+                         ('metadata_offset', '<i8')])
+
+_NUM_VALUES = 7
+_RAW_DTYPE = np.dtype('>i2')
+
+_CODECS = {
+    'zlib': 0,
+    'lzma': 1,
+}
+_DEFAULT_CODEC = 'zlib'
+_DEFAULT_CHUNK_DURATION_s = 1.0
+_MAX_PENDING_CHUNKS = 16
+
+
+def _compress(codec, data):
+    if codec == _CODECS['lzma']:
+        return lzma.compress(data, preset=1)
+    return zlib.compress(data, 6)
+
+
+def _decompress(codec, data):
+    if codec == _CODECS['lzma']:
+        return lzma.decompress(data)
+    return zlib.decompress(data)
+
+
+def _encode_chunk(timestamps_ns, raw):
+    """Returns the bytes of the delta-encoded timestamps, with shape (N,),
+    followed by the delta-encoded values, with shape (N, 7), channel by
+    channel.
+    """
+    time_deltas = timestamps_ns.astype('<i8')
+    time_deltas[1:] = timestamps_ns[1:] - timestamps_ns[:-1]
+    # The int16 differences wrap around, as the sums of the decoding.
+    channels = raw.T.astype('<i2')
+    value_deltas = channels.copy()
+    value_deltas[:, 1:] = channels[:, 1:] - channels[:, :-1]
+    return time_deltas.tobytes() + value_deltas.tobytes()
+
+
+def _decode_chunk(data, num_samples):
+    time_deltas = np.frombuffer(data, dtype='<i8', count=num_samples)
+    value_deltas = np.frombuffer(data, dtype='<i2',
+                                 offset=time_deltas.nbytes).reshape(
+                                     _NUM_VALUES, num_samples)
+    timestamps_ns = np.cumsum(time_deltas)
+    raw = np.cumsum(value_deltas, axis=1, dtype=np.int16).T
+    return timestamps_ns, raw
+
+
+def _decoder_from_metadata(metadata):
+    return RawFrameDecoder(acc_sensitivity=metadata['acc_sensitivity'],
+                           gyro_sensitivity=metadata['gyro_sensitivity'],
+                           acc_bias=metadata['acc_bias'],
+                           gyro_bias=metadata['gyro_bias'])
+
+
+class RecordingWriter:
+    """Writes raw frames to a chunked compressed recording.
+
+    Args:
+        path (str): Output file. Overwritten if it exists.
+        chunk_duration_s (float): Time covered by every chunk. Shorter chunks
+            make the reading of short windows faster, longer ones compress
+            better.
+        codec (str): 'zlib', faster, or 'lzma', smaller.
+        pyramid (bool): If True, the overview pyramid is built while
+            recording, from the chunks written after the decoder parameters
+            are set.
+
+    Raises:
+        ValueError: Unknown codec.
+    """
+
+    def __init__(self, path, chunk_duration_s=_DEFAULT_CHUNK_DURATION_s,
+                 codec=_DEFAULT_CODEC, pyramid=False):
+        if codec not in _CODECS:
+            raise ValueError('Unknown codec {}, expected one of {}'.format(
+                codec, ', '.join(_CODECS)))
+        self._codec = _CODECS[codec]
+        self._chunk_duration_ns = int(chunk_duration_s * 1e9)
+
+        self._file = open(path, 'wb')
+        self._file.write(_HEADER.pack(_MAGIC, _VERSION, self._codec))
+        self._index = []
+        self._metadata_offset = -1
+        self._pyramid = PyramidBuilder(pyramid_path(path),
+                                       num_channels=_NUM_VALUES) \
+            if pyramid else None
+        self._decoder = None
+
+        # Frames of the current chunk.
+        self._timestamps_ns = []
+        self._frames = bytearray()
+        self._chunk_start_ns = None
+
+        # Complete chunks and metadata are written by a background thread,
+        # in order.
+        self._queue = queue.Queue(maxsize=_MAX_PENDING_CHUNKS)
+        self._thread = threading.Thread(target=self._write_loop,
+                                        name=self.__class__.__name__,
+                                        daemon=True)
+        self._thread.start()
+
+    def set_metadata(self, metadata):
+        """Stores a JSON-serializable dictionary, e.g. the parameters of
+        the decoder. It applies to the frames written after it, until it is
+        set again.
+        """
+        self._flush_chunk()
+        self._queue.put((_METADATA_BLOCK, json.dumps(metadata)))
+
+    def write(self, timestamp_ns, frame):
+        """Appends a raw frame, the 14 bytes read at ACCEL_XOUT_H, taken at
+        the given time in ns. Timestamps must increase.
+        """
+        if self._chunk_start_ns is None:
+            self._chunk_start_ns = timestamp_ns
+        elif timestamp_ns - self._chunk_start_ns >= self._chunk_duration_ns:
+            self._flush_chunk()
+            self._chunk_start_ns = timestamp_ns
+        self._timestamps_ns.append(timestamp_ns)
+        self._frames += bytes(frame)
+
+    def _flush_chunk(self):
+        if not self._timestamps_ns:
+            return
+        timestamps_ns = np.array(self._timestamps_ns, dtype=np.int64)
+        raw = np.frombuffer(bytes(self._frames), dtype=_RAW_DTYPE).reshape(
+            -1, _NUM_VALUES)
+        self._queue.put((_CHUNK_BLOCK, (timestamps_ns, raw)))
+        self._timestamps_ns = []
+        self._frames = bytearray()
+        self._chunk_start_ns = None
+
+    def _write_block(self, block_type, payload):
+        offset = self._file.tell()
+        self._file.write(_BLOCK_HEADER.pack(block_type, len(payload)))
+        self._file.write(payload)
+        return offset
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            block_type, data = item
+            try:
+                self._write_item(block_type, data)
+            except OSError as e:
+                # The queue keeps being drained, so that the read loop is
+                # never blocked.
+                _logger.error('Recording write failed: {}'.format(e))
+
+    def _write_item(self, block_type, data):
+        if block_type == _METADATA_BLOCK:
+            self._metadata_offset = self._write_block(_METADATA_BLOCK,
+                                                      data.encode('utf-8'))
+            if self._pyramid is not None:
+                self._decoder = _decoder_from_metadata(json.loads(data))
+            return
+
+        timestamps_ns, raw = data
+        header = _CHUNK_HEADER.pack(len(timestamps_ns), timestamps_ns[0],
+                                    timestamps_ns[-1])
+        payload = _compress(self._codec, _encode_chunk(timestamps_ns, raw))
+        offset = self._write_block(_CHUNK_BLOCK, header + payload)
+        self._index.append((timestamps_ns[0], timestamps_ns[-1], offset,
+                            len(timestamps_ns), self._metadata_offset))
+        if self._decoder is not None:
+            self._pyramid.extend(timestamps_ns,
+                                 self._decoder.decode_raw_block(raw))
+
+    def close(self):
+        """Writes the last chunk and the index."""
+        self._flush_chunk()
+        self._queue.put(None)
+        self._thread.join()
+
+        index = np.array(self._index, dtype=_INDEX_DTYPE)
+        index_offset = self._write_block(_INDEX_BLOCK, index.tobytes())
+        self._file.write(_TRAILER.pack(index_offset, self._metadata_offset,
+                                       _TRAILER_MAGIC))
+        self._file.close()
+        if self._pyramid is not None:
+            self._pyramid.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class RecordingReader:
+    """Reads time windows of a recording written by `RecordingWriter`.
+
+    Args:
+        path (str): Recording file.
+
+    Raises:
+        ValueError: The file is not a recording.
+    """
+
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        magic, version, self._codec = _HEADER.unpack(
+            self._file.read(_HEADER.size))
+        if magic != _MAGIC or version != _VERSION:
+            self._file.close()
+            raise ValueError('{} is not a recording, or of another '
+                             'version'.format(path))
+
+        self._file.seek(0, os.SEEK_END)
+        file_size = self._file.tell()
+        trailer = None
+        if file_size >= _HEADER.size + _TRAILER.size:
+            self._file.seek(file_size - _TRAILER.size)
+            trailer = _TRAILER.unpack(self._file.read(_TRAILER.size))
+        if trailer is not None and trailer[2] == _TRAILER_MAGIC:
+            index_offset, metadata_offset, _ = trailer
+            block_type, payload = self._read_block(index_offset)
+            self.index = np.frombuffer(payload, dtype=_INDEX_DTYPE)
+        else:
+            _logger.warning('{} was not closed, rebuilding its '
+                            'index'.format(path))
+            self.index, metadata_offset = self._scan(file_size)
+
+        # Metadata and decoders by block offset.
+        self._metadata = {}
+        self._decoders = {}
+        # The last metadata.
+        self.metadata = self._read_metadata(metadata_offset)
+        # The chunks written before any metadata use the first one.
+        offsets = self.index['metadata_offset']
+        self._first_metadata_offset = \
+            int(offsets[offsets >= 0][0]) if np.any(offsets >= 0) else \
+            metadata_offset
+
+    def _read_metadata(self, offset):
+        """Returns the metadata of the block at `offset`, or None if it is
+        negative.
+        """
+        if offset < 0:
+            return None
+        if offset not in self._metadata:
+            _, payload = self._read_block(offset)
+            self._metadata[offset] = json.loads(payload.decode('utf-8'))
+        return self._metadata[offset]
+
+    def _read_block(self, offset):
+        self._file.seek(offset)
+        block_type, size = _BLOCK_HEADER.unpack(
+            self._file.read(_BLOCK_HEADER.size))
+        return block_type, self._file.read(size)
+
+    def _scan(self, file_size):
+        """Rebuilds the index from the block headers. A block truncated at
+        the end of the file is ignored.
+        """
+        index = []
+        metadata_offset = -1
+        offset = _HEADER.size
+        while offset + _BLOCK_HEADER.size <= file_size:
+            self._file.seek(offset)
+            block_type, size = _BLOCK_HEADER.unpack(
+                self._file.read(_BLOCK_HEADER.size))
+            end = offset + _BLOCK_HEADER.size + size
+            if end > file_size:
+                break
+            if block_type == _CHUNK_BLOCK:
+                num_samples, start_ns, end_ns = _CHUNK_HEADER.unpack(
+                    self._file.read(_CHUNK_HEADER.size))
+                index.append((start_ns, end_ns, offset, num_samples,
+                              metadata_offset))
+            elif block_type == _METADATA_BLOCK:
+                metadata_offset = offset
+            offset = end
+        return np.array(index, dtype=_INDEX_DTYPE), metadata_offset
+
+    @property
+    def num_samples(self):
+        return int(self.index['num_samples'].sum())
+
+    @property
+    def time_range_ns(self):
+        """First and last timestamp, or None if the recording is empty."""
+        if len(self.index) == 0:
+            return None
+        return int(self.index['start_ns'][0]), int(self.index['end_ns'][-1])
+
+    def _read_chunk(self, position):
+        block_type, payload = self._read_block(
+            self.index['offset'][position])
+        num_samples, _, _ = _CHUNK_HEADER.unpack_from(payload)
+        data = _decompress(self._codec, payload[_CHUNK_HEADER.size:])
+        return _decode_chunk(data, num_samples)
+
+    def _iter_positions(self, start_ns, end_ns):
+        """Yields the position in the index of the chunks overlapping
+        the window, with their timestamps and raw values trimmed to it.
+        """
+        first = 0 if start_ns is None else \
+            int(np.searchsorted(self.index['end_ns'], start_ns, side='left'))
+        last = len(self.index) if end_ns is None else \
+            int(np.searchsorted(self.index['start_ns'], end_ns, side='left'))
+        for position in range(first, last):
+            timestamps_ns, raw = self._read_chunk(position)
+            begin = 0 if start_ns is None else \
+                np.searchsorted(timestamps_ns, start_ns, side='left')
+            end = len(timestamps_ns) if end_ns is None else \
+                np.searchsorted(timestamps_ns, end_ns, side='left')
+            yield position, timestamps_ns[begin:end], raw[begin:end]
+
+    def _chunk_metadata_offset(self, position):
+        offset = int(self.index['metadata_offset'][position])
+        return self._first_metadata_offset if offset < 0 else offset
+
+    def iter_chunks(self, start_ns=None, end_ns=None):
+        """Yields the tuples (timestamps_ns, raw) of the chunks overlapping
+        the window, trimmed to it. Only these chunks are decompressed.
+        """
+        for _, timestamps_ns, raw in self._iter_positions(start_ns, end_ns):
+            yield timestamps_ns, raw
+
+    def iter_chunks_with_metadata(self, start_ns=None, end_ns=None):
+        """Yields the tuples (timestamps_ns, raw, metadata) of the chunks
+        overlapping the window, as `iter_chunks`, with the metadata that
+        decodes every chunk, or None if the recording has none.
+        """
+        for position, timestamps_ns, raw in self._iter_positions(start_ns,
+                                                                 end_ns):
+            yield timestamps_ns, raw, self._read_metadata(
+                self._chunk_metadata_offset(position))
+
+    def read_raw(self, start_ns=None, end_ns=None):
+        """Returns the timestamps and the raw values of the samples in
+        the window [start_ns, end_ns), arrays with shape (N,) and (N, 7).
+        """
+        chunks = list(self.iter_chunks(start_ns, end_ns))
+        if not chunks:
+            return np.empty(0, dtype=np.int64), \
+                np.empty((0, _NUM_VALUES), dtype=np.int16)
+        timestamps_ns, raw = zip(*chunks)
+        return np.concatenate(timestamps_ns), np.concatenate(raw)
+
+    def iter_samples(self, start_ns=None, end_ns=None):
+        """Yields the tuples (timestamps_ns, samples) of the chunks
+        overlapping the window, as `iter_chunks` but decoded, every chunk
+        with its own metadata.
+
+        Raises:
+            ValueError: The recording has no decoder parameters.
+        """
+        if self.metadata is None:
+            raise ValueError('The recording has no decoder parameters')
+        for position, timestamps_ns, raw in self._iter_positions(start_ns,
+                                                                 end_ns):
+            offset = self._chunk_metadata_offset(position)
+            if offset not in self._decoders:
+                self._decoders[offset] = _decoder_from_metadata(
+                    self._read_metadata(offset))
+            yield timestamps_ns, self._decoders[offset].decode_raw_block(raw)
+
+    def read(self, start_ns=None, end_ns=None):
+        """Returns the timestamps and the samples in the window [start_ns,
+        end_ns), decoded as by `MPU6050.read_next` with the metadata.
+
+        Raises:
+            ValueError: The recording has no decoder parameters.
+        """
+        chunks = list(self.iter_samples(start_ns, end_ns))
+        if not chunks:
+            return np.empty(0, dtype=np.int64), np.empty((0, _NUM_VALUES))
+        timestamps_ns, samples = zip(*chunks)
+        return np.concatenate(timestamps_ns), np.concatenate(samples)
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def _main():
+    parser = argparse.ArgumentParser(
+        description='Summary of a recording.')
+    parser.add_argument('recording',
+                        type=str,
+                        help='File written with --record.')
+    args = parser.parse_args()
+
+    with RecordingReader(args.recording) as reader:
+        time_range_ns = reader.time_range_ns
+        if time_range_ns is None:
+            _logger.info('Empty recording')
+            return
+        duration_s = (time_range_ns[1] - time_range_ns[0]) / 1e9
+        file_size = os.path.getsize(args.recording)
+        # Timestamp and raw values of a sample.
+        uncompressed_size = reader.num_samples * (8 + 2 * _NUM_VALUES)
+        _logger.info('{} samples in {} chunks over {:.1f} s'.format(
+            reader.num_samples, len(reader.index), duration_s))
+        _logger.info('{} bytes, {:.2f} bytes per sample, compression '
+                     'ratio {:.1f}'.format(
+                         file_size, file_size / max(reader.num_samples, 1),
+                         uncompressed_size / file_size))
+        _logger.info('Metadata: {}'.format(reader.metadata))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO,
+                        format='[%(levelname)s][%(name)s] %(message)s')
+    _main()
@@ -0,0 +1,131 @@
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+import numpy as np
+
+from pimu.mpu6050.fakebus import FakeBus
+from pimu.mpu6050.mpu6050 import MPU6050
+from pimu.recording import RecordingReader, RecordingWriter
+
+_PERIOD_ns = 1000000
+
+
+def _raw_session(num_samples):
+    """Slowly varying raw values with noise, crossing the int16 limits."""
+    rng = np.random.default_rng(0)
+    time_s = np.arange(num_samples) / 1000
+    raw = 16000 * np.sin(2 * np.pi * time_s)[:, np.newaxis] + \
+        rng.normal(scale=20, size=(num_samples, 7))
+    raw[:, 0] = np.linspace(-32768, 32767, num_samples)
+    return np.clip(np.round(raw), -32768, 32767).astype(np.int16)
+
+
+class RecordingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'recording.pimu')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _record(self, raw, codec='zlib', close=True):
+        timestamps_ns = np.arange(len(raw)) * _PERIOD_ns + 10 ** 12
+        writer = RecordingWriter(self.path, chunk_duration_s=0.25,
+                                 codec=codec)
+        for timestamp_ns, values in zip(timestamps_ns, raw):
+            writer.write(int(timestamp_ns), struct.pack('>7h', *values))
+        if close:
+            writer.close()
+        else:
+            # Everything but the index and the trailer is written.
+            writer._flush_chunk()
+            writer._queue.put(None)
+            writer._thread.join()
+            writer._file.close()
+        return timestamps_ns
+
+    def test_round_trip_and_compression(self):
+        raw = _raw_session(2000)
+        for codec in ('zlib', 'lzma'):
+            timestamps_ns = self._record(raw, codec)
+            with RecordingReader(self.path) as reader:
+                self.assertEqual(8, len(reader.index))
+                self.assertEqual(2000, reader.num_samples)
+                read_timestamps_ns, read_raw = reader.read_raw()
+            np.testing.assert_array_equal(timestamps_ns, read_timestamps_ns)
+            np.testing.assert_array_equal(raw, read_raw)
+            # 22 bytes per sample uncompressed.
+            self.assertLess(os.path.getsize(self.path), 2000 * 22 / 2)
+
+    def test_time_window(self):
+        raw = _raw_session(2000)
+        timestamps_ns = self._record(raw)
+        start_ns, end_ns = timestamps_ns[600], timestamps_ns[1100]
+        with RecordingReader(self.path) as reader:
+            # Only the chunks of the samples 500-1249 are decompressed.
+            self.assertEqual(3, len(list(reader.iter_chunks(start_ns,
+                                                            end_ns))))
+            read_timestamps_ns, read_raw = reader.read_raw(start_ns, end_ns)
+            np.testing.assert_array_equal(timestamps_ns[600:1100],
+                                          read_timestamps_ns)
+            np.testing.assert_array_equal(raw[600:1100], read_raw)
+
+            self.assertEqual(0, len(reader.read_raw(0, 10)[0]))
+
+    def test_index_is_rebuilt_when_not_closed(self):
+        raw = _raw_session(1000)
+        self._record(raw, close=False)
+        # A chunk cut by a power loss.
+        with open(self.path, 'ab') as f:
+            f.write(b'C\xff\x00\x00\x00partial')
+        with RecordingReader(self.path) as reader:
+            self.assertEqual(4, len(reader.index))
+            np.testing.assert_array_equal(raw, reader.read_raw()[1])
+
+    def test_samples_match_read_next(self):
+        bus = FakeBus()
+        writer = RecordingWriter(self.path)
+        imu = MPU6050(gyro_sensitivity='500', acc_sensitivity='4g', bus=bus,
+                      recorder=writer)
+        samples = []
+        for values in _raw_session(50):
+            bus.set_raw_sample(acc=values[:3], temperature=values[3],
+                               gyro=values[4:])
+            samples.append(imu.read_next())
+        writer.close()
+
+        with RecordingReader(self.path) as reader:
+            self.assertEqual(8192, reader.metadata['acc_sensitivity'])
+            _, read_samples = reader.read()
+        np.testing.assert_allclose(samples, read_samples)
+
+    def test_chunks_keep_their_full_scale_range(self):
+        bus = FakeBus()
+        writer = RecordingWriter(self.path, chunk_duration_s=10)
+        imu = MPU6050(gyro_sensitivity='250', acc_sensitivity='2g', bus=bus,
+                      recorder=writer)
+        samples = []
+        for acc_sensitivity in ('2g', '4g', '2g'):
+            imu.reconfigure(acc_sensitivity=acc_sensitivity)
+            for _ in range(10):
+                bus.set_raw_sample(acc=(0, 0, 16384), temperature=0,
+                                   gyro=(0, 0, 0))
+                samples.append(imu.read_next())
+        writer.close()
+
+        with RecordingReader(self.path) as reader:
+            self.assertEqual(3, len(reader.index))
+            self.assertEqual(16384, reader.metadata['acc_sensitivity'])
+            _, read_samples = reader.read()
+            chunk_samples = [chunk for _, chunk in reader.iter_samples()]
+        np.testing.assert_allclose(samples, read_samples)
+        np.testing.assert_allclose([1, 2, 1], [chunk[0, 2]
+                                               for chunk in chunk_samples])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,350 @@
+"""This module recomputes the orientation of recorded sessions offline, in
+parallel, e.g. after a change of the calibration or of the fusion.
+
+Every recording, see `pimu.recording`, is processed by one worker of
+a process pool, a chunk at a time, with vectorized NumPy operations. The
+orientation of a recording is written to the output directory as a NumPy
+file with the same name, holding a structured array with the fields of
+`OUTPUT_DTYPE`, one record per sample. The subdirectories of
+the recordings below a root directory, the current one by default, are
+mirrored in the output directory, so that sessions of different
+directories with the same name do not collide.
+
+Processing is resumable: every output is written to a temporary file and
+renamed when complete, so the recordings whose output exists are skipped
+by the next run. The parameters and the root are saved in the output
+directory too, and a run with different ones is refused unless the outputs
+are overwritten.
+
+Usage:
+    python -m pimu.reprocess 'sessions/**/*.pimu' --output-dir orientation \\
+        --calibration static --fusion complementary --jobs 16
+"""
+import argparse
+import collections
+import concurrent.futures
+import glob
+import json
+import logging
+import os
+import sys
+import time
+
+import numpy as np
+
+import pimu.sensorboard as sb
+from pimu.filters import first_order_recursion
+from pimu.mpu6050.decoding import RawFrameDecoder
+from pimu.recording import RecordingReader
+
+_logger = logging.getLogger(__name__)
+
+# 'recorded' uses the biases saved with the recording, 'none' no bias, and
+# 'static' estimates them from the start of every session, where the board
+# is assumed to lie flat and still, as `Imu.calibrate`.
+CALIBRATIONS = ('recorded', 'none', 'static')
+
+# 'accelerometer' computes pitch and roll from the accelerometer alone, as
+# `Imu.update`. 'complementary' also integrates the gyroscope: the yaw
+# entirely, pitch and roll blended with the accelerometer angles with
+# weight `alpha` for the latter.
+FUSIONS = ('accelerometer', 'complementary')
+
+Parameters = collections.namedtuple(
+    'Parameters', ['calibration', 'static_duration_s', 'fusion', 'alpha'],
+    defaults=('recorded', 2.0, 'accelerometer', 0.8))
+
+OUTPUT_DTYPE = np.dtype([('timestamp_ns', '<i8'),
+                         ('yaw_rad', '<f4'),
+                         ('pitch_rad', '<f4'),
+                         ('roll_rad', '<f4'),
+                         ('temperature_deg', '<f4')])
+
+_OUTPUT_EXTENSION = '.npy'
+_PARTIAL_EXTENSION = '.partial'
+_PARAMETERS_FILE = 'reprocess.json'
+
+
+def _decoder(metadata, biases):
+    """Returns the decoder of a chunk, with the recorded biases if `biases`
+    is None, else with the tuple (acc_bias, gyro_bias).
+    """
+    acc_bias, gyro_bias = (metadata['acc_bias'], metadata['gyro_bias']) \
+        if biases is None else biases
+    return RawFrameDecoder(acc_sensitivity=metadata['acc_sensitivity'],
+                           gyro_sensitivity=metadata['gyro_sensitivity'],
+                           acc_bias=acc_bias,
+                           gyro_bias=gyro_bias)
+
+
+def _calibration_biases(reader, parameters):
+    """Returns the biases to decode every chunk with, as `_decoder`. They
+    are in physical units, so they hold across changes of the full scale
+    range.
+    """
+    if reader.metadata is None:
+        raise ValueError('The recording has no decoder parameters')
+    if parameters.calibration == 'recorded':
+        return None
+    no_biases = ((0, 0, 0), (0, 0, 0))
+    if parameters.calibration == 'none':
+        return no_biases
+
+    start_ns, _ = reader.time_range_ns
+    samples = [_decoder(metadata, no_biases).decode_raw_block(raw)
+               for _, raw, metadata in reader.iter_chunks_with_metadata(
+                   start_ns,
+                   start_ns + int(parameters.static_duration_s * 1e9))]
+    calibration = np.nanmean(np.concatenate(samples)[:, :6], axis=0)
+    # The Z axis of the board points to the ground.
+    calibration[2] -= 1
+    return calibration[:3], calibration[3:]
+
+
+class _Fusion:
+    """Computes the orientation of consecutive chunks of samples."""
+
+    def __init__(self, parameters):
+        self._parameters = parameters
+        self._last_timestamp_ns = None
+        # Yaw, pitch and roll after the last sample.
+        self._angles_rad = np.zeros(3)
+
+    def process(self, timestamps_ns, samples):
+        """Returns an array with shape (N, 3) of yaw, pitch and roll."""
+        acc_x, acc_y, acc_z, gyro_x, gyro_y, gyro_z = samples[:, :6].T
+        angles_rad = np.zeros((len(samples), 3))
+        acc_pitch_rad, acc_roll_rad = \
+            sb.pitch_and_roll_from_accelerometer_data(acc_x, acc_y, acc_z)
+        if self._parameters.fusion == 'accelerometer':
+            angles_rad[:, 1] = acc_pitch_rad
+            angles_rad[:, 2] = acc_roll_rad
+            return angles_rad
+
+        previous_ns = timestamps_ns[0] if self._last_timestamp_ns is None \
+            else self._last_timestamp_ns
+        delta_time_ms = np.diff(timestamps_ns, prepend=previous_ns) / 1e6
+        self._last_timestamp_ns = timestamps_ns[-1]
+        deltas_rad = np.column_stack(sb.gyroscope_data_to_taitbryan_deltas(
+            gyro_x, gyro_y, gyro_z, delta_time_ms=delta_time_ms))
+
+        angles_rad[:, 0] = first_order_recursion(
+            deltas_rad[:, 0], pole=1, initial=self._angles_rad[0])
+        # angle[n] = alpha * acc_angle[n] +
+        #            (1 - alpha) * (angle[n - 1] + gyro_delta[n])
+        alpha = self._parameters.alpha
+        acc_angles_rad = np.column_stack([acc_pitch_rad, acc_roll_rad])
+        angles_rad[:, 1:] = first_order_recursion(
+            alpha * acc_angles_rad + (1 - alpha) * deltas_rad[:, 1:],
+            pole=1 - alpha, initial=self._angles_rad[1:])
+        self._angles_rad = angles_rad[-1].copy()
+        return angles_rad
+
+
+def process_session(recording_path, output_path, parameters):
+    """Computes the orientation of every sample of a recording and writes it
+    to `output_path`, atomically.
+
+    Returns:
+        The number of samples.
+    """
+    partial_path = output_path + _PARTIAL_EXTENSION
+    with RecordingReader(recording_path) as reader:
+        biases = _calibration_biases(reader, parameters)
+        fusion = _Fusion(parameters)
+        output = np.lib.format.open_memmap(partial_path, mode='w+',
+                                           dtype=OUTPUT_DTYPE,
+                                           shape=(reader.num_samples,))
+        position = 0
+        for timestamps_ns, raw, metadata in \
+                reader.iter_chunks_with_metadata():
+            # The full scale ranges can change during a recording.
+            samples = _decoder(metadata, biases).decode_raw_block(raw)
+            angles_rad = fusion.process(timestamps_ns, samples)
+            records = output[position:position + len(samples)]
+            records['timestamp_ns'] = timestamps_ns
+            records['yaw_rad'] = angles_rad[:, 0]
+            records['pitch_rad'] = angles_rad[:, 1]
+            records['roll_rad'] = angles_rad[:, 2]
+            records['temperature_deg'] = samples[:, 6]
+            position += len(samples)
+        output.flush()
+        del output
+    os.replace(partial_path, output_path)
+    return position
+
+
+def _process_task(recording_path, output_path, parameters):
+    start_s = time.monotonic()
+    num_samples = process_session(recording_path, output_path, parameters)
+    return num_samples, time.monotonic() - start_s
+
+
+def output_path(recording_path, output_dir, root=None):
+    """Returns the output of a recording: its path relative to `root`, by
+    default the current directory, mirrored in `output_dir`.
+
+    Raises:
+        ValueError: The recording is not below `root`.
+    """
+    relative_path = os.path.relpath(os.path.abspath(recording_path),
+                                    os.path.abspath(root or os.curdir))
+    if relative_path.split(os.sep)[0] == os.pardir:
+        raise ValueError('{} is not below {}'.format(recording_path, root))
+    name = os.path.splitext(relative_path)[0]
+    return os.path.join(output_dir, name + _OUTPUT_EXTENSION)
+
+
+def _output_paths(recording_paths, output_dir, root):
+    """Returns the outputs of the recordings, mirroring the directories
+    below `root`.
+
+    Raises:
+        ValueError: A recording is not below `root`, or two recordings would
+            have the same output.
+    """
+    outputs = [output_path(path, output_dir, root)
+               for path in recording_paths]
+    duplicates = sorted(output for output, count in
+                        collections.Counter(outputs).items() if count > 1)
+    if duplicates:
+        raise ValueError('Several recordings have the output {}'.format(
+            ', '.join(duplicates)))
+    return outputs
+
+
+def _check_parameters(output_dir, parameters, root, overwrite):
+    """Saves the parameters and the root of the outputs, refusing to mix
+    outputs of different ones.
+    """
+    settings = dict(parameters._asdict(), root=root)
+    parameters_path = os.path.join(output_dir, _PARAMETERS_FILE)
+    if os.path.exists(parameters_path) and not overwrite:
+        with open(parameters_path) as f:
+            previous = json.load(f)
+        if previous != settings:
+            raise ValueError('{} was processed with the parameters {}, '
+                             'overwrite the outputs to change '
+                             'them'.format(output_dir, previous))
+    with open(parameters_path, 'w') as f:
+        json.dump(settings, f, indent=2)
+
+
+def reprocess(recording_paths, output_dir, parameters, jobs=None,
+              overwrite=False, root=None):
+    """Processes the recordings in parallel, skipping the ones already
+    processed unless `overwrite` is set. The directories of the recordings
+    below `root`, by default the current directory, are mirrored in
+    `output_dir`.
+
+    Returns:
+        A tuple (num_processed, num_failed).
+
+    Raises:
+        ValueError: The output directory holds results of other parameters
+            or of another root, a recording is not below the root, or two
+            recordings have the same output.
+    """
+    root = os.path.abspath(root or os.curdir)
+    outputs = _output_paths(recording_paths, output_dir, root)
+    os.makedirs(output_dir, exist_ok=True)
+    _check_parameters(output_dir, parameters, root, overwrite)
+
+    tasks = list(zip(recording_paths, outputs))
+    for output in outputs:
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+    num_skipped = len(tasks)
+    if not overwrite:
+        tasks = [(path, output) for path, output in tasks
+                 if not os.path.exists(output)]
+    num_skipped -= len(tasks)
+    _logger.info('{} recordings to process, {} already done'.format(
+        len(tasks), num_skipped))
+
+    num_processed = num_failed = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {pool.submit(_process_task, path, output, parameters): path
+                   for path, output in tasks}
+        for future in concurrent.futures.as_completed(futures):
+            path = futures[future]
+            try:
+                num_samples, elapsed_s = future.result()
+            except Exception as e:
+                num_failed += 1
+                _logger.error('{} failed: {}'.format(path, e))
+                continue
+            num_processed += 1
+            _logger.info('[{}/{}] {}: {} samples in {:.1f} s'.format(
+                num_processed + num_failed, len(tasks), path, num_samples,
+                elapsed_s))
+    return num_processed, num_failed
+
+
+def _main():
+    parser = argparse.ArgumentParser(
+        description='Recomputes the orientation of recorded sessions.')
+    parser.add_argument('patterns',
+                        type=str,
+                        nargs='+',
+                        help='Recordings, or glob patterns of recordings, '
+                             'with ** matching any subdirectory.')
+    parser.add_argument('--output-dir',
+                        type=str,
+                        required=True,
+                        dest='output_dir',
+                        help='Directory of the results, one file per '
+                             'recording.')
+    parser.add_argument('--root',
+                        type=str,
+                        default=None,
+                        help='Directory whose subdirectories holding '
+                             'the recordings are mirrored in the output '
+                             'directory. The current directory by default.')
+    parser.add_argument('--jobs', '-j',
+                        type=int,
+                        default=None,
+                        help='Number of worker processes. One per core by '
+                             'default.')
+    parser.add_argument('--calibration',
+                        choices=CALIBRATIONS,
+                        default=Parameters().calibration,
+                        help='Biases removed from the samples.')
+    parser.add_argument('--static-duration',
+                        type=float,
+                        default=Parameters().static_duration_s,
+                        dest='static_duration',
+                        help='With the static calibration, seconds at '
+                             'the start of every session used to estimate '
+                             'the biases.')
+    parser.add_argument('--fusion',
+                        choices=FUSIONS,
+                        default=Parameters().fusion,
+                        help='Algorithm computing the orientation.')
+    parser.add_argument('--alpha',
+                        type=float,
+                        default=Parameters().alpha,
+                        help='With the complementary fusion, weight of '
+                             'the accelerometer angles.')
+    parser.add_argument('--overwrite',
+                        action='store_true',
+                        help='Processes again the recordings already '
+                             'processed.')
+    args = parser.parse_args()
+
+    recording_paths = sorted({path for pattern in args.patterns
+                              for path in glob.glob(pattern, recursive=True)})
+    parameters = Parameters(calibration=args.calibration,
+                            static_duration_s=args.static_duration,
+                            fusion=args.fusion,
+                            alpha=args.alpha)
+    _, num_failed = reprocess(recording_paths, args.output_dir, parameters,
+                              jobs=args.jobs, overwrite=args.overwrite,
+                              root=args.root)
+    if num_failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO,
+                        format='[%(levelname)s][%(name)s] %(message)s')
+    _main()
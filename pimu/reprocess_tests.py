@@ -0,0 +1,199 @@
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+import numpy as np
+
+import pimu.reprocess as rep
+import pimu.sensorboard as sb
+from pimu.recording import RecordingReader, RecordingWriter
+
+_PERIOD_ns = 1000000
+_ACC_SENSITIVITY = 16384
+_GYRO_SENSITIVITY = 131
+
+
+def _record(path, num_samples, seed):
+    """Records a board tilting slowly, still and flat for the first second,
+    with a constant gyroscope bias."""
+    rng = np.random.default_rng(seed)
+    time_s = np.arange(num_samples) / 1000
+    tilt_rad = 0.5 * np.sin(np.pi * np.clip(time_s - 1, 0, None))
+    raw = np.zeros((num_samples, 7))
+    raw[:, 0] = -np.sin(tilt_rad) * _ACC_SENSITIVITY
+    raw[:, 2] = np.cos(tilt_rad) * _ACC_SENSITIVITY
+    raw[:, 3] = 1000
+    raw[:, 4:] = rng.normal(scale=5, size=(num_samples, 3)) + 200
+    raw = np.round(raw).astype(np.int16)
+
+    with RecordingWriter(path, chunk_duration_s=0.3) as writer:
+        writer.set_metadata({'acc_sensitivity': _ACC_SENSITIVITY,
+                             'gyro_sensitivity': _GYRO_SENSITIVITY,
+                             'acc_bias': [0, 0, 0],
+                             'gyro_bias': [0, 0, 0]})
+        for idx, values in enumerate(raw):
+            writer.write(idx * _PERIOD_ns, struct.pack('>7h', *values))
+
+
+class ReprocessTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.output_dir = os.path.join(self.directory, 'output')
+        self.paths = [os.path.join(self.directory, 'session{}.pimu'.format(i))
+                      for i in range(3)]
+        for seed, path in enumerate(self.paths):
+            _record(path, 2000 + 500 * seed, seed)
+        # The default root of the outputs.
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _load(self, path):
+        return np.load(rep.output_path(path, self.output_dir))
+
+    def test_accelerometer_fusion(self):
+        self.assertEqual((3, 0), rep.reprocess(
+            self.paths, self.output_dir, rep.Parameters(), jobs=2))
+
+        for path in self.paths:
+            with RecordingReader(path) as reader:
+                timestamps_ns, samples = reader.read()
+            output = self._load(path)
+            np.testing.assert_array_equal(timestamps_ns,
+                                          output['timestamp_ns'])
+            for idx in range(0, len(samples), 97):
+                pitch_rad, roll_rad = \
+                    sb.pitch_and_roll_from_accelerometer_data(
+                        *samples[idx, :3])
+                self.assertAlmostEqual(pitch_rad, output['pitch_rad'][idx],
+                                       places=6)
+                self.assertAlmostEqual(roll_rad, output['roll_rad'][idx],
+                                       places=6)
+            np.testing.assert_allclose(samples[:, 6],
+                                       output['temperature_deg'], rtol=1e-6)
+            self.assertFalse(np.any(output['yaw_rad']))
+
+    def test_complementary_fusion_matches_a_loop(self):
+        parameters = rep.Parameters(calibration='static',
+                                    static_duration_s=0.9,
+                                    fusion='complementary',
+                                    alpha=0.05)
+        rep.reprocess(self.paths[:1], self.output_dir, parameters, jobs=1)
+        output = self._load(self.paths[0])
+
+        with RecordingReader(self.paths[0]) as reader:
+            _, samples = reader.read()
+        samples[:, 3:6] -= samples[:900, 3:6].mean(axis=0)
+        yaw_rad = pitch_rad = roll_rad = 0
+        for idx, sample in enumerate(samples):
+            acc_x, acc_y, acc_z, gyro_x, gyro_y, gyro_z, _ = sample
+            acc_pitch_rad, acc_roll_rad = \
+                sb.pitch_and_roll_from_accelerometer_data(acc_x, acc_y, acc_z)
+            yaw_delta_rad, pitch_delta_rad, roll_delta_rad = \
+                sb.gyroscope_data_to_taitbryan_deltas(
+                    gyro_x, gyro_y, gyro_z, delta_time_ms=1 if idx else 0)
+            yaw_rad += yaw_delta_rad
+            pitch_rad = 0.05 * acc_pitch_rad + \
+                0.95 * (pitch_rad + pitch_delta_rad)
+            roll_rad = 0.05 * acc_roll_rad + \
+                0.95 * (roll_rad + roll_delta_rad)
+            self.assertAlmostEqual(yaw_rad, output['yaw_rad'][idx], places=5)
+            self.assertAlmostEqual(pitch_rad, output['pitch_rad'][idx],
+                                   places=5)
+            self.assertAlmostEqual(roll_rad, output['roll_rad'][idx],
+                                   places=5)
+        # The bias of the gyroscope is removed.
+        self.assertLess(abs(output['yaw_rad'][-1]), 0.01)
+
+    def test_resumes_and_checks_the_parameters(self):
+        rep.reprocess(self.paths[:2], self.output_dir, rep.Parameters())
+        mtime = os.path.getmtime(rep.output_path(self.paths[0],
+                                                 self.output_dir))
+        # A run interrupted before the last recording.
+        self.assertEqual((1, 0), rep.reprocess(self.paths, self.output_dir,
+                                               rep.Parameters()))
+        self.assertEqual(mtime, os.path.getmtime(
+            rep.output_path(self.paths[0], self.output_dir)))
+        self.assertEqual([], [name for name in os.listdir(self.output_dir)
+                              if name.endswith('.partial')])
+
+        other = rep.Parameters(fusion='complementary')
+        with self.assertRaises(ValueError):
+            rep.reprocess(self.paths, self.output_dir, other)
+        self.assertEqual((3, 0), rep.reprocess(self.paths, self.output_dir,
+                                               other, overwrite=True))
+
+    def test_chunks_are_decoded_with_their_metadata(self):
+        path = os.path.join(self.directory, 'reconfigured.pimu')
+        with RecordingWriter(path) as writer:
+            for idx in range(2000):
+                if idx % 1000 == 0:
+                    # 1 then 2 deg/s about Z, on the same raw values.
+                    writer.set_metadata({
+                        'acc_sensitivity': _ACC_SENSITIVITY,
+                        'gyro_sensitivity': _GYRO_SENSITIVITY / (
+                            1 + idx // 1000),
+                        'acc_bias': [0, 0, 0],
+                        'gyro_bias': [0, 0, 0]})
+                writer.write(idx * _PERIOD_ns, struct.pack(
+                    '>7h', 0, 0, _ACC_SENSITIVITY, 0, 0, 0,
+                    _GYRO_SENSITIVITY))
+        rep.reprocess([path], self.output_dir,
+                      rep.Parameters(fusion='complementary'))
+        self.assertAlmostEqual(-np.radians(2.999),
+                               self._load(path)['yaw_rad'][-1], places=6)
+
+    def test_subdirectories_are_mirrored(self):
+        paths = [os.path.join(self.directory, unit, 'session.pimu')
+                 for unit in ('unit1', 'unit2')]
+        for seed, path in enumerate(paths):
+            os.makedirs(os.path.dirname(path))
+            _record(path, 1000 + 500 * seed, seed)
+        self.assertEqual((2, 0), rep.reprocess(paths, self.output_dir,
+                                               rep.Parameters()))
+        for unit, num_samples in (('unit1', 1000), ('unit2', 1500)):
+            output = np.load(os.path.join(self.output_dir, unit,
+                                          'session.npy'))
+            self.assertEqual(num_samples, len(output))
+
+        other_path = os.path.join(self.directory, 'unit1', 'session.rec')
+        shutil.copy(paths[0], other_path)
+        with self.assertRaises(ValueError):
+            rep.reprocess(paths + [other_path], self.output_dir,
+                          rep.Parameters())
+
+    def test_root_is_kept_across_runs(self):
+        paths = [os.path.join(self.directory, 'unit1', 'session.pimu')]
+        os.makedirs(os.path.dirname(paths[0]))
+        _record(paths[0], 1000, 0)
+        # The outputs do not depend on the recordings of the run.
+        rep.reprocess(paths, self.output_dir, rep.Parameters())
+        self.assertTrue(os.path.exists(os.path.join(self.output_dir, 'unit1',
+                                                    'session.npy')))
+        self.assertEqual((3, 0), rep.reprocess(paths + self.paths,
+                                               self.output_dir,
+                                               rep.Parameters()))
+
+        with self.assertRaisesRegex(ValueError, 'root'):
+            rep.reprocess(paths, self.output_dir, rep.Parameters(),
+                          root=os.path.dirname(paths[0]))
+        with self.assertRaisesRegex(ValueError, 'not below'):
+            rep.reprocess(self.paths, self.output_dir, rep.Parameters(),
+                          root=os.path.dirname(paths[0]))
+
+    def test_failures_are_counted(self):
+        with open(self.paths[1], 'wb') as f:
+            f.write(b'not a recording')
+        self.assertEqual((2, 1), rep.reprocess(self.paths, self.output_dir,
+                                               rep.Parameters()))
+        self.assertFalse(os.path.exists(rep.output_path(self.paths[1],
+                                                        self.output_dir)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+"""This module contains a fixed-size circular buffer backed by a NumPy array.
+
+Every value is written twice, at position `i` and `i + capacity` of an array
+twice as long as the capacity. This way the last `capacity` values are always
+available as a contiguous view of the array, without copies, and inserting
+a value costs O(1).
+"""
+import numpy as np
+
+
+class RingBuffer:
+    """Circular buffer of the last `capacity` samples.
+
+    Args:
+        capacity (int): Maximum number of samples held.
+        num_channels (int): Number of values per sample. If None, every
+            sample is a scalar.
+        dtype: NumPy data type of the values.
+        fill_value: Value the buffer is initialized with.
+
+    Raises:
+        ValueError: Invalid capacity.
+    """
+
+    def __init__(self, capacity, num_channels=None, dtype=float, fill_value=0):
+        if capacity < 1:
+            raise ValueError('The capacity must be at least 1, '
+                             'but {} was provided'.format(capacity))
+
+        self._capacity = capacity
+        sample_shape = () if num_channels is None else (num_channels,)
+        self._data = np.full((2 * capacity,) + sample_shape, fill_value,
+                             dtype=dtype)
+
+        # Index where the next sample is written.
+        self._head = 0
+        self._num_written = 0
+
+    def __len__(self):
+        return min(self._num_written, self._capacity)
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    @property
+    def num_written(self):
+        """Total number of samples ever appended."""
+        return self._num_written
+
+    def append(self, sample):
+        self._data[self._head] = sample
+        self._data[self._head + self._capacity] = sample
+        self._head = (self._head + 1) % self._capacity
+        self._num_written += 1
+
+    def extend(self, samples):
+        """Appends a block of samples, the oldest first."""
+        samples = np.asarray(samples, dtype=self._data.dtype)
+        num_samples = len(samples)
+        if num_samples == 0:
+            return
+
+        # Only the last `capacity` samples can survive.
+        skipped = max(0, num_samples - self._capacity)
+        samples = samples[skipped:]
+        self._head = (self._head + skipped) % self._capacity
+
+        first = min(len(samples), self._capacity - self._head)
+        for offset in (0, self._capacity):
+            start = self._head + offset
+            self._data[start:start + first] = samples[:first]
+        rest = len(samples) - first
+        if rest:
+            self._data[:rest] = samples[first:]
+            self._data[self._capacity:self._capacity + rest] = samples[first:]
+
+        self._head = (self._head + len(samples)) % self._capacity
+        self._num_written += num_samples
+
+    def view(self):
+        """Returns a read-only view of the whole buffer, the oldest sample
+        first. Not yet written slots hold the fill value.
+
+        The view is invalidated by the next insertion.
+        """
+        view = self._data[self._head:self._head + self._capacity]
+        view.flags.writeable = False
+        return view
+
+    def last(self, num_samples):
+        """Returns a read-only view of the last `num_samples` samples,
+        the oldest first.
+        """
+        num_samples = min(num_samples, self._capacity)
+        end = self._head + self._capacity
+        view = self._data[end - num_samples:end]
+        view.flags.writeable = False
+        return view
@@ -0,0 +1,52 @@
+import unittest
+
+import numpy as np
+
+from pimu.ringbuffer import RingBuffer
+
+
+class RingBufferTest(unittest.TestCase):
+
+    def test_view_before_full(self):
+        buffer = RingBuffer(capacity=4)
+        buffer.append(1)
+        buffer.append(2)
+        self.assertEqual(2, len(buffer))
+        np.testing.assert_array_equal([0, 0, 1, 2], buffer.view())
+
+    def test_append_wraps_around(self):
+        buffer = RingBuffer(capacity=3)
+        for value in range(5):
+            buffer.append(value)
+        self.assertEqual(3, len(buffer))
+        self.assertEqual(5, buffer.num_written)
+        np.testing.assert_array_equal([2, 3, 4], buffer.view())
+
+    def test_extend_matches_append(self):
+        appended = RingBuffer(capacity=5, num_channels=2)
+        extended = RingBuffer(capacity=5, num_channels=2)
+        samples = np.arange(26).reshape(13, 2)
+        for block in (samples[:3], samples[3:4], samples[4:12], samples[12:]):
+            extended.extend(block)
+        for sample in samples:
+            appended.append(sample)
+        np.testing.assert_array_equal(appended.view(), extended.view())
+        np.testing.assert_array_equal(samples[-5:], extended.view())
+
+    def test_last(self):
+        buffer = RingBuffer(capacity=4)
+        buffer.extend([1, 2, 3, 4, 5])
+        np.testing.assert_array_equal([4, 5], buffer.last(2))
+
+    def test_view_is_read_only(self):
+        buffer = RingBuffer(capacity=2)
+        with self.assertRaises(ValueError):
+            buffer.view()[0] = 1
+
+    def test_invalid_capacity(self):
+        with self.assertRaisesRegex(ValueError, r'capacity'):
+            RingBuffer(capacity=0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -55,13 +55,15 @@ def pitch_and_roll_from_accelerometer_data(acc_x, acc_y, acc_z):
         acc_x (float): Acceleration in g units along the board's X axis.
         acc_y (float): Acceleration in g units along the board's Y axis.
         acc_z (float): Acceleration in g units along the board's Z axis.
+        The three can also be arrays with shape (N,), to process many
+        samples at once.
 
     Returns:
         A tuple (pitch, roll) in radians, describing the rotation of the
         board from the reference frame.
     """
     acc_vector = np.array([acc_x, acc_y, acc_z])
-    gravity = acc_vector / np.linalg.norm(acc_vector)
+    gravity = acc_vector / np.linalg.norm(acc_vector, axis=0)
     gx, gy, gz = gravity
     pitch_rad = np.arctan2(-gx, np.sqrt(gy ** 2 + gz ** 2))
     roll_rad = np.arctan2(gy, gz)
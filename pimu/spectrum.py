@@ -0,0 +1,281 @@
+"""This module contains a streaming spectrum analyzer, to monitor the
+vibrations measured by the accelerometer and the gyroscope.
+
+The last `window_size` samples of every axis are kept in a ring buffer.
+Every `hop` samples, the mean is removed, a Hann window is applied and the
+real FFT is computed, all on preallocated arrays. Each analysis reports
+the dominant frequencies and the RMS in a set of frequency bands per axis.
+Appending a sample costs a copy into the ring buffer, and the FFT cost is
+spread over the `hop` samples.
+
+The same analyzer runs live, fed with blocks from the server, or offline
+on a recording written by `pimu.trace.BinaryTraceSink`:
+    python -m pimu.spectrum trace.bin --rate 1000
+"""
+import argparse
+import collections
+import logging
+
+import numpy as np
+
+from pimu.ringbuffer import RingBuffer
+
+_logger = logging.getLogger(__name__)
+
+# Accelerometer and gyroscope axes, as returned by `Imu.read_next`.
+CHANNEL_NAMES = ('acc_x', 'acc_y', 'acc_z', 'gyro_x', 'gyro_y', 'gyro_z')
+
+_DEFAULT_BANDS_hz = ((1, 10), (10, 50), (50, 200), (200, 500))
+
+# `numpy.fft.rfft` writes into a given output only since NumPy 2.0.
+_RFFT_HAS_OUT = np.lib.NumpyVersion(np.__version__) >= '2.0.0'
+
+# Result of one analysis.
+#   sample_index: Number of samples appended when the analysis was run.
+#   peak_frequencies_hz: Array (num_peaks, num_channels) of the dominant
+#       frequencies, the strongest first.
+#   peak_amplitudes: Array (num_peaks, num_channels) of the amplitude of
+#       a sine at each dominant frequency, in the unit of the samples.
+#   band_rms: Array (num_bands, num_channels) of the RMS in each band.
+SpectrumReport = collections.namedtuple('SpectrumReport',
+                                        ['sample_index',
+                                         'peak_frequencies_hz',
+                                         'peak_amplitudes',
+                                         'band_rms'])
+
+
+class SpectrumAnalyzer:
+    """Computes the spectrum of a multi-channel stream over a sliding window.
+
+    Args:
+        rate_hz (float): Rate of the samples.
+        num_channels (int): Number of values per sample.
+        window_size (int): Number of samples of each analysis. The frequency
+            resolution is rate_hz / window_size.
+        hop (int): Number of samples between two analyses.
+        bands_hz (tuple): Tuples (low, high) of the frequency bands whose RMS
+            is reported. A band includes its low edge and excludes the high
+            one.
+        num_peaks (int): Number of dominant frequencies reported.
+
+    Raises:
+        ValueError: Invalid hop.
+    """
+
+    def __init__(self, rate_hz, num_channels=len(CHANNEL_NAMES),
+                 window_size=256, hop=64, bands_hz=_DEFAULT_BANDS_hz,
+                 num_peaks=3):
+        if not 1 <= hop <= window_size:
+            raise ValueError('The hop must be between 1 and the window size, '
+                             'but {} was provided'.format(hop))
+
+        self._rate_hz = rate_hz
+        self._num_channels = num_channels
+        self._window_size = window_size
+        self._hop = hop
+        self._num_peaks = num_peaks
+        self._bands_hz = tuple(bands_hz)
+
+        self._buffer = RingBuffer(window_size, num_channels)
+        self._num_since_analysis = 0
+
+        self._window = np.hanning(window_size)[:, np.newaxis]
+        self.frequencies_hz = np.fft.rfftfreq(window_size, d=1 / rate_hz)
+
+        # Scale from |X|^2 to the mean square of the signal, with the one
+        # sided spectrum counting every bin but DC and Nyquist twice.
+        num_bins = len(self.frequencies_hz)
+        self._power_scale = np.full((num_bins, 1), 2.0)
+        self._power_scale[0] = 1
+        if window_size % 2 == 0:
+            self._power_scale[-1] = 1
+        self._power_scale /= window_size * np.sum(self._window ** 2)
+        # Scale from |X| to the amplitude of a sine.
+        self._amplitude_scale = 2 / np.sum(self._window)
+
+        self._band_masks = [(self.frequencies_hz >= low) &
+                            (self.frequencies_hz < high)
+                            for low, high in self._bands_hz]
+
+        self._windowed = np.empty((window_size, num_channels))
+        self._spectrum = np.empty((num_bins, num_channels), dtype=complex)
+        self._power = np.empty((num_bins, num_channels))
+
+    @property
+    def bands_hz(self):
+        return self._bands_hz
+
+    @property
+    def hop(self):
+        return self._hop
+
+    def append(self, sample):
+        """Appends a sample and returns a `SpectrumReport` if an analysis was
+        due, None otherwise.
+        """
+        self._buffer.append(sample)
+        self._num_since_analysis += 1
+        if self._num_since_analysis < self._hop or \
+                len(self._buffer) < self._window_size:
+            return None
+        self._num_since_analysis = 0
+        return self._analyze()
+
+    def extend(self, samples):
+        """Appends a block of samples with shape (N, num_channels) and
+        returns the list of the reports of the analyses that were due.
+        """
+        samples = np.asarray(samples)
+        reports = []
+        start = 0
+        while start < len(samples):
+            # Number of samples until the next analysis.
+            num_samples = max(self._hop - self._num_since_analysis,
+                              self._window_size - len(self._buffer))
+            block = samples[start:start + num_samples]
+            self._buffer.extend(block)
+            self._num_since_analysis += len(block)
+            start += len(block)
+            if len(block) == num_samples:
+                self._num_since_analysis = 0
+                reports.append(self._analyze())
+        return reports
+
+    def _analyze(self):
+        window = self._buffer.view()
+        np.subtract(window, window.mean(axis=0), out=self._windowed)
+        np.multiply(self._windowed, self._window, out=self._windowed)
+
+        if _RFFT_HAS_OUT:
+            np.fft.rfft(self._windowed, axis=0, out=self._spectrum)
+        else:
+            self._spectrum[:] = np.fft.rfft(self._windowed, axis=0)
+        np.abs(self._spectrum, out=self._power)
+        peak_magnitudes = self._peaks(self._power)
+        np.square(self._power, out=self._power)
+
+        band_rms = np.empty((len(self._band_masks), self._num_channels))
+        scaled_power = self._power * self._power_scale
+        for band_idx, mask in enumerate(self._band_masks):
+            band_rms[band_idx] = np.sqrt(scaled_power[mask].sum(axis=0))
+
+        peak_bins, magnitudes = peak_magnitudes
+        return SpectrumReport(
+            sample_index=self._buffer.num_written,
+            peak_frequencies_hz=self.frequencies_hz[peak_bins],
+            peak_amplitudes=magnitudes * self._amplitude_scale,
+            band_rms=band_rms)
+
+    def _peaks(self, magnitudes):
+        """Returns the bins with the largest magnitudes, without DC, and
+        the magnitudes, as arrays with shape (num_peaks, num_channels).
+        """
+        # The bins right above DC still hold leakage from the removed mean.
+        num_peaks = min(self._num_peaks, len(magnitudes) - 2)
+        candidates = magnitudes[2:]
+        bins = np.argpartition(-candidates, num_peaks - 1,
+                               axis=0)[:num_peaks]
+        values = np.take_along_axis(candidates, bins, axis=0)
+        order = np.argsort(-values, axis=0)
+        bins = np.take_along_axis(bins, order, axis=0) + 2
+        return bins, np.take_along_axis(magnitudes, bins, axis=0)
+
+
+def analyze(samples, rate_hz, **kwargs):
+    """Runs a `SpectrumAnalyzer` over a recording.
+
+    Args:
+        samples (:obj:`numpy.array`): Array with shape (N, num_channels).
+        rate_hz (float): Rate of the samples.
+        **kwargs: Other arguments of `SpectrumAnalyzer`.
+
+    Returns:
+        The list of `SpectrumReport`.
+    """
+    samples = np.asarray(samples)
+    analyzer = SpectrumAnalyzer(rate_hz, num_channels=samples.shape[1],
+                                **kwargs)
+    return analyzer.extend(samples)
+
+
+class VibrationMetrics:
+    """Publishes the reports of an analyzer as metrics: the dominant
+    frequency and the RMS over all the bands of every axis.
+
+    Args:
+        registry (:obj:`pimu.metrics.Registry`): Registry the gauges are
+            added to.
+        channel_names (tuple): Name of every channel.
+    """
+
+    def __init__(self, registry, channel_names=CHANNEL_NAMES):
+        self._peak_gauges = []
+        self._rms_gauges = []
+        for name in channel_names:
+            self._peak_gauges.append(registry.gauge(
+                'pimu_vibration_{}_peak_hz'.format(name),
+                'Dominant vibration frequency of {}.'.format(name)))
+            self._rms_gauges.append(registry.gauge(
+                'pimu_vibration_{}_rms'.format(name),
+                'Vibration RMS of {} over all the bands.'.format(name)))
+
+    def update(self, report):
+        total_rms = np.sqrt(np.sum(report.band_rms ** 2, axis=0))
+        for channel_idx, (peak_gauge, rms_gauge) in \
+                enumerate(zip(self._peak_gauges, self._rms_gauges)):
+            peak_gauge.set(float(report.peak_frequencies_hz[0, channel_idx]))
+            rms_gauge.set(float(total_rms[channel_idx]))
+
+
+def _format_report(report, bands_hz, rate_hz):
+    lines = ['t={:.2f} s'.format(report.sample_index / rate_hz)]
+    for channel_idx, name in enumerate(CHANNEL_NAMES):
+        peaks = ', '.join('{:.1f} Hz ({:.3g})'.format(f, a) for f, a in zip(
+            report.peak_frequencies_hz[:, channel_idx],
+            report.peak_amplitudes[:, channel_idx]))
+        bands = ', '.join('{}-{} Hz: {:.3g}'.format(low, high, rms)
+                          for (low, high), rms in
+                          zip(bands_hz, report.band_rms[:, channel_idx]))
+        lines.append('  {:<7} peaks {} | rms {}'.format(name, peaks, bands))
+    return '\n'.join(lines)
+
+
+def _main():
+    # Only needed to read recordings.
+    from pimu.trace import read_trace
+
+    parser = argparse.ArgumentParser(
+        description='Vibration spectrum of a recorded trace.')
+    parser.add_argument('trace',
+                        type=str,
+                        help='File written by the server with --trace-file.')
+    parser.add_argument('--rate',
+                        required=True,
+                        type=float,
+                        help='Rate of the recorded samples, in Hertz.')
+    parser.add_argument('--window-size',
+                        type=int,
+                        default=1024,
+                        dest='window_size',
+                        help='Number of samples per analysis.')
+    parser.add_argument('--hop',
+                        type=int,
+                        default=None,
+                        help='Samples between two analyses. Defaults to '
+                             'the window size.')
+    args = parser.parse_args()
+
+    _, values = read_trace(args.trace)
+    samples = values[:, :len(CHANNEL_NAMES)]
+    samples = samples[~np.isnan(samples).any(axis=1)]
+    analyzer = SpectrumAnalyzer(args.rate,
+                                window_size=args.window_size,
+                                hop=args.hop or args.window_size)
+    for report in analyzer.extend(samples):
+        print(_format_report(report, analyzer.bands_hz, args.rate))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO,
+                        format='[%(levelname)s][%(name)s] %(message)s')
+    _main()
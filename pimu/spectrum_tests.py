@@ -0,0 +1,78 @@
+import unittest
+
+import numpy as np
+
+from pimu.metrics import Registry
+from pimu.spectrum import SpectrumAnalyzer, VibrationMetrics, analyze
+
+_RATE_hz = 1000
+
+
+def _vibration(num_samples):
+    """Accelerometer Z with gravity and a 120 Hz vibration of amplitude 0.2 g,
+    gyroscope X with a 35 Hz vibration of amplitude 3 deg/s.
+    """
+    times_s = np.arange(num_samples) / _RATE_hz
+    samples = np.zeros((num_samples, 6))
+    samples[:, 2] = 1 + 0.2 * np.sin(2 * np.pi * 120 * times_s)
+    samples[:, 3] = 3 * np.sin(2 * np.pi * 35 * times_s)
+    return samples
+
+
+class SpectrumAnalyzerTest(unittest.TestCase):
+
+    def test_dominant_frequencies_and_amplitudes(self):
+        reports = analyze(_vibration(1024), _RATE_hz, window_size=1000,
+                          hop=1000)
+        self.assertEqual(1, len(reports))
+        report = reports[0]
+        self.assertEqual(120, report.peak_frequencies_hz[0, 2])
+        self.assertEqual(35, report.peak_frequencies_hz[0, 3])
+        self.assertAlmostEqual(0.2, report.peak_amplitudes[0, 2], places=3)
+        self.assertAlmostEqual(3, report.peak_amplitudes[0, 3], places=3)
+
+    def test_band_rms(self):
+        analyzer = SpectrumAnalyzer(_RATE_hz, window_size=1000, hop=1000,
+                                    bands_hz=((10, 50), (50, 200)))
+        report = analyzer.extend(_vibration(1000))[0]
+        # RMS of a sine: amplitude / sqrt(2). Gravity is removed.
+        np.testing.assert_allclose([3 / np.sqrt(2), 0], report.band_rms[:, 3],
+                                   atol=1e-3)
+        np.testing.assert_allclose([0, 0.2 / np.sqrt(2)],
+                                   report.band_rms[:, 2], atol=1e-3)
+
+    def test_append_matches_extend(self):
+        samples = _vibration(700)
+        appended = SpectrumAnalyzer(_RATE_hz, window_size=256, hop=100)
+        reports = [appended.append(sample) for sample in samples]
+        reports = [report for report in reports if report is not None]
+
+        extended = SpectrumAnalyzer(_RATE_hz, window_size=256, hop=100)
+        blocks = [extended.extend(block)
+                  for block in np.split(samples, [10, 11, 300, 555])]
+        expected = [report for block in blocks for report in block]
+
+        self.assertEqual([256, 356, 456, 556, 656],
+                         [report.sample_index for report in reports])
+        self.assertEqual([r.sample_index for r in reports],
+                         [r.sample_index for r in expected])
+        for report, other in zip(reports, expected):
+            np.testing.assert_allclose(report.band_rms, other.band_rms)
+
+
+class VibrationMetricsTest(unittest.TestCase):
+
+    def test_gauges(self):
+        registry = Registry()
+        metrics = VibrationMetrics(registry)
+        metrics.update(analyze(_vibration(1000), _RATE_hz,
+                               window_size=1000)[0])
+        self.assertEqual(120,
+                         registry.get('pimu_vibration_acc_z_peak_hz').value)
+        self.assertAlmostEqual(3 / np.sqrt(2),
+                               registry.get('pimu_vibration_gyro_x_rms').value,
+                               places=3)
+
+
+if __name__ == '__main__':
+    unittest.main()
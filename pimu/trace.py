@@ -0,0 +1,106 @@
+"""This module contains helpers to trace per-sample values from hot loops
+without paying for it when tracing is disabled.
+
+Two complementary tools are provided:
+* `SampledTrace` decides whether the current sample has to be logged: only
+  when DEBUG is enabled for the logger, and then only every n-th sample.
+* `BinaryTraceSink` writes every sample to a compact binary file, to be
+  analysed offline with `read_trace`, when all of them are needed.
+"""
+import logging
+import struct
+
+import numpy as np
+
+_MAGIC = b'PIMUTRC1'
+
+# Magic, number of values per record.
+_HEADER = struct.Struct('<8sH')
+
+_BUFFER_SIZE = 1 << 16
+
+
+class SampledTrace:
+    """Tells which samples of a hot loop should be logged.
+
+    Args:
+        logger (:obj:`logging.Logger`): Logger the samples are logged to.
+        every (int): Only one sample every this many is logged.
+
+    Raises:
+        ValueError: Invalid sampling period.
+    """
+
+    def __init__(self, logger, every=1):
+        if every < 1:
+            raise ValueError('The trace sampling period must be at least 1, '
+                             'but {} was provided'.format(every))
+        self._logger = logger
+        self._every = every
+        self._count = 0
+
+    def __call__(self):
+        """Returns True if the current sample has to be logged."""
+        if not self._logger.isEnabledFor(logging.DEBUG):
+            return False
+        self._count += 1
+        return self._count % self._every == 0
+
+
+class BinaryTraceSink:
+    """Writes fixed-size records of a timestamp and float values to a file.
+
+    Each record is a little-endian int64 timestamp in nanoseconds followed
+    by `num_values` float64 values.
+
+    Args:
+        path (str): Output file. Overwritten if it exists.
+        num_values (int): Number of values per record.
+    """
+
+    def __init__(self, path, num_values):
+        self._record = struct.Struct('<q{}d'.format(num_values))
+        self._num_values = num_values
+        self._file = open(path, 'wb', buffering=_BUFFER_SIZE)
+        self._file.write(_HEADER.pack(_MAGIC, num_values))
+
+    def write(self, timestamp_ns, values):
+        self._file.write(self._record.pack(timestamp_ns, *values))
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def read_trace(path, mmap=False):
+    """Reads a file written by `BinaryTraceSink`.
+
+    Args:
+        path (str): Trace file.
+        mmap (bool): If True, the file is memory-mapped instead of loaded,
+            so that recordings larger than the memory can be processed.
+
+    Returns:
+        A tuple (timestamps_ns, values) of arrays with shape (N,) and
+        (N, num_values).
+
+    Raises:
+        ValueError: The file is not a trace file.
+    """
+    with open(path, 'rb') as f:
+        magic, num_values = _HEADER.unpack(f.read(_HEADER.size))
+    if magic != _MAGIC:
+        raise ValueError('{} is not a trace file'.format(path))
+
+    dtype = np.dtype([('timestamp_ns', '<i8'),
+                      ('values', '<f8', (num_values,))])
+    if mmap:
+        records = np.memmap(path, dtype=dtype, mode='r', offset=_HEADER.size)
+    else:
+        records = np.fromfile(path, dtype=dtype, offset=_HEADER.size)
+    return records['timestamp_ns'], records['values']
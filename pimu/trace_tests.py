@@ -0,0 +1,59 @@
+import logging
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+import pimu.trace as trace
+
+_logger = logging.getLogger(__name__)
+
+
+class SampledTraceTest(unittest.TestCase):
+
+    def tearDown(self):
+        _logger.setLevel(logging.NOTSET)
+
+    def test_disabled_when_debug_is_off(self):
+        _logger.setLevel(logging.INFO)
+        sampled_trace = trace.SampledTrace(_logger, every=1)
+        self.assertFalse(any(sampled_trace() for _ in range(10)))
+
+    def test_every_nth_sample(self):
+        _logger.setLevel(logging.DEBUG)
+        sampled_trace = trace.SampledTrace(_logger, every=3)
+        self.assertListEqual([False, False, True, False, False, True],
+                             [sampled_trace() for _ in range(6)])
+
+    def test_invalid_period(self):
+        with self.assertRaisesRegex(ValueError, r'sampling period'):
+            trace.SampledTrace(_logger, every=0)
+
+
+class BinaryTraceSinkTest(unittest.TestCase):
+
+    def test_roundtrip(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'trace.bin')
+            with trace.BinaryTraceSink(path, num_values=2) as sink:
+                sink.write(10, (0.5, -1.0))
+                sink.write(20, (1.5, 2.0))
+
+            timestamps_ns, values = trace.read_trace(path)
+
+        np.testing.assert_array_equal([10, 20], timestamps_ns)
+        np.testing.assert_array_equal([[0.5, -1.0], [1.5, 2.0]], values)
+
+    def test_invalid_file(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'trace.bin')
+            with open(path, 'wb') as f:
+                f.write(b'0123456789')
+
+            with self.assertRaisesRegex(ValueError, r'not a trace file'):
+                trace.read_trace(path)
+
+
+if __name__ == '__main__':
+    unittest.main()
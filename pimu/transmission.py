@@ -0,0 +1,183 @@
+"""This module contains the policies that decide what the IMU server sends
+to its clients and how the clients rebuild the stream.
+
+Two kinds of frames travel on the link:
+* full frame: a JSON list with all the channel values, e.g.
+    [yaw, pitch, roll, temperature]
+* delta frame: a JSON object with only the channels that changed, keyed by
+  their index in the full frame, e.g.
+    {"1": pitch}
+
+A client holds the last value of every channel and applies delta frames
+on top of it.
+
+Frames can carry the time of the sample, in ns of the server monotonic
+clock, under the key "t". A timestamped full frame is then a JSON object
+with the values under the key "v", e.g.
+    {"v": [yaw, pitch, roll, temperature], "t": 123456789}
+
+Frames computed from held samples, because the sensor could not be read,
+are flagged with the key "h", e.g.
+    {"v": [yaw, pitch, roll, temperature], "h": 1}
+"""
+import json
+
+
+_TIMESTAMP_KEY = 't'
+_VALUES_KEY = 'v'
+_HELD_KEY = 'h'
+
+
+def encode_full_frame(values, timestamp_ns=None, is_held=False):
+    if timestamp_ns is None and not is_held:
+        return json.dumps(list(values))
+    frame = {_VALUES_KEY: list(values)}
+    if timestamp_ns is not None:
+        frame[_TIMESTAMP_KEY] = int(timestamp_ns)
+    if is_held:
+        frame[_HELD_KEY] = 1
+    return json.dumps(frame)
+
+
+def encode_delta_frame(changes, timestamp_ns=None, is_held=False):
+    frame = {str(idx): value for idx, value in changes.items()}
+    if timestamp_ns is not None:
+        frame[_TIMESTAMP_KEY] = int(timestamp_ns)
+    if is_held:
+        frame[_HELD_KEY] = 1
+    return json.dumps(frame)
+
+
+class AlwaysSendPolicy:
+    """Sends a full frame for every sample."""
+
+    def encode(self, values, time_s, timestamp_ns=None, is_held=False):
+        return encode_full_frame(values, timestamp_ns, is_held)
+
+
+class DeadbandSendPolicy:
+    """Sends only the channels that changed by more than a threshold since
+    the value held by the client.
+
+    A full frame is sent when nothing was sent for longer than the keepalive
+    interval, and every `full_frame_every` packets, so that a client that
+    lost some packets resynchronizes quickly. A full frame is also sent
+    when the samples become held or valid again, so that the client sees
+    the sensor failures even when the values do not change.
+
+    Args:
+        thresholds (list): Per-channel absolute change that triggers
+            a transmission, in the unit of the channel.
+        keepalive_s (float): Maximum time in seconds between two packets.
+        full_frame_every (int): Every how many packets a full frame is sent.
+
+    Raises:
+        ValueError: Invalid keepalive interval or full frame period.
+    """
+
+    def __init__(self, thresholds, keepalive_s, full_frame_every):
+        if keepalive_s <= 0:
+            raise ValueError('The keepalive interval must be positive, '
+                             'but {} was provided'.format(keepalive_s))
+        if full_frame_every < 1:
+            raise ValueError('The full frame period must be at least 1, '
+                             'but {} was provided'.format(full_frame_every))
+
+        self._thresholds = tuple(thresholds)
+        self._keepalive_s = keepalive_s
+        self._full_frame_every = full_frame_every
+
+        # Values the client is assumed to hold.
+        self._held_values = None
+        self._last_sent_time_s = None
+        self._num_sent_packets = 0
+        self._is_held = False
+
+    def encode(self, values, time_s, timestamp_ns=None, is_held=False):
+        """Returns the frame to send for the given sample, or None if nothing
+        needs to be sent.
+
+        Args:
+            values (tuple): Channel values of the current sample.
+            time_s (float): Time of the sample in seconds, from any monotonic
+                clock.
+            timestamp_ns (int): If set, timestamp added to the frame.
+            is_held (bool): Whether the values were computed from held
+                samples.
+        """
+        num_channels = len(self._thresholds)
+        if len(values) != num_channels:
+            raise ValueError('Expected {} channel values, '
+                             'but {} were provided'.format(num_channels,
+                                                           len(values)))
+
+        if self._held_values is None or is_held != self._is_held \
+                or time_s - self._last_sent_time_s >= self._keepalive_s:
+            return self._send_full_frame(values, time_s, timestamp_ns,
+                                         is_held)
+
+        changes = {idx: value
+                   for idx, (value, held, threshold)
+                   in enumerate(zip(values, self._held_values,
+                                    self._thresholds))
+                   if abs(value - held) > threshold}
+        if not changes:
+            return None
+
+        if (self._num_sent_packets + 1) % self._full_frame_every == 0:
+            return self._send_full_frame(values, time_s, timestamp_ns,
+                                         is_held)
+
+        for idx, value in changes.items():
+            self._held_values[idx] = value
+        self._last_sent_time_s = time_s
+        self._num_sent_packets += 1
+        return encode_delta_frame(changes, timestamp_ns, is_held)
+
+    def _send_full_frame(self, values, time_s, timestamp_ns, is_held):
+        self._held_values = list(values)
+        self._last_sent_time_s = time_s
+        self._num_sent_packets += 1
+        self._is_held = is_held
+        return encode_full_frame(values, timestamp_ns, is_held)
+
+
+class FrameDecoder:
+    """Rebuilds the full sample from full and delta frames, holding the last
+    received value of every channel.
+    """
+
+    def __init__(self):
+        self._values = None
+
+        # Timestamp of the last frame, or None if it had none.
+        self.timestamp_ns = None
+        # Whether the last frame was computed from held samples.
+        self.is_held = False
+
+    @property
+    def values(self):
+        """Last known values of all the channels, or None if no full frame
+        has been received yet.
+        """
+        return None if self._values is None else tuple(self._values)
+
+    def decode(self, data):
+        """Applies a received frame and returns the updated values, or None
+        if no full frame has been received yet.
+        """
+        frame = json.loads(data)
+        if isinstance(frame, list):
+            self.timestamp_ns = None
+            self.is_held = False
+            self._values = list(map(float, frame))
+            return self.values
+
+        self.timestamp_ns = frame.pop(_TIMESTAMP_KEY, None)
+        self.is_held = bool(frame.pop(_HELD_KEY, False))
+        if _VALUES_KEY in frame:
+            self._values = list(map(float, frame[_VALUES_KEY]))
+        elif self._values is not None:
+            for idx, value in frame.items():
+                self._values[int(idx)] = float(value)
+        return self.values
@@ -0,0 +1,116 @@
+import json
+import unittest
+
+import pimu.transmission as tx
+
+
+class DeadbandSendPolicyTest(unittest.TestCase):
+
+    def _build_policy(self, keepalive_s=10, full_frame_every=100):
+        return tx.DeadbandSendPolicy(thresholds=(0.1, 0.1),
+                                     keepalive_s=keepalive_s,
+                                     full_frame_every=full_frame_every)
+
+    def test_first_sample_is_full_frame(self):
+        policy = self._build_policy()
+        data = policy.encode((1.0, 2.0), time_s=0)
+        self.assertListEqual([1.0, 2.0], json.loads(data))
+
+    def test_small_changes_are_not_sent(self):
+        policy = self._build_policy()
+        policy.encode((1.0, 2.0), time_s=0)
+        self.assertIsNone(policy.encode((1.05, 1.95), time_s=1))
+
+    def test_changes_accumulate_against_held_value(self):
+        policy = self._build_policy()
+        policy.encode((1.0, 2.0), time_s=0)
+        policy.encode((1.06, 2.0), time_s=1)
+        data = policy.encode((1.12, 2.0), time_s=2)
+        self.assertDictEqual({'0': 1.12}, json.loads(data))
+
+    def test_keepalive_sends_full_frame(self):
+        policy = self._build_policy(keepalive_s=1)
+        policy.encode((1.0, 2.0), time_s=0)
+        data = policy.encode((1.0, 2.0), time_s=1.5)
+        self.assertListEqual([1.0, 2.0], json.loads(data))
+
+    def test_full_frame_every_k_packets(self):
+        policy = self._build_policy(full_frame_every=3)
+        frames = [json.loads(policy.encode((float(idx), 2.0), time_s=idx))
+                  for idx in range(6)]
+        self.assertIsInstance(frames[0], list)
+        self.assertIsInstance(frames[1], dict)
+        self.assertIsInstance(frames[2], list)
+        self.assertIsInstance(frames[3], dict)
+        self.assertIsInstance(frames[4], dict)
+        self.assertIsInstance(frames[5], list)
+
+    def test_held_samples_are_flagged_in_full_frames(self):
+        policy = self._build_policy()
+        policy.encode((1.0, 2.0), time_s=0)
+        # The change of state is sent even without a change of values.
+        frame = json.loads(policy.encode((1.0, 2.0), time_s=1, is_held=True))
+        self.assertDictEqual({'v': [1.0, 2.0], 'h': 1}, frame)
+        frame = json.loads(policy.encode((1.5, 2.0), time_s=2, is_held=True))
+        self.assertDictEqual({'0': 1.5, 'h': 1}, frame)
+        self.assertIsNone(policy.encode((1.5, 2.0), time_s=3, is_held=True))
+        frame = json.loads(policy.encode((1.5, 2.0), time_s=4))
+        self.assertListEqual([1.5, 2.0], frame)
+
+    def test_invalid_arguments(self):
+        with self.assertRaisesRegex(ValueError, r'keepalive'):
+            self._build_policy(keepalive_s=0)
+
+        with self.assertRaisesRegex(ValueError, r'full frame'):
+            self._build_policy(full_frame_every=0)
+
+
+class FrameDecoderTest(unittest.TestCase):
+
+    def test_delta_before_full_frame_is_ignored(self):
+        decoder = tx.FrameDecoder()
+        self.assertIsNone(decoder.decode(tx.encode_delta_frame({0: 1.0})))
+
+    def test_delta_frame_updates_held_values(self):
+        decoder = tx.FrameDecoder()
+        decoder.decode(tx.encode_full_frame((1.0, 2.0, 3.0)))
+        values = decoder.decode(tx.encode_delta_frame({1: 5.0}))
+        self.assertTupleEqual((1.0, 5.0, 3.0), values)
+
+    def test_timestamps(self):
+        decoder = tx.FrameDecoder()
+        decoder.decode(tx.encode_full_frame((1.0, 2.0), timestamp_ns=10))
+        self.assertEqual(10, decoder.timestamp_ns)
+        values = decoder.decode(tx.encode_delta_frame({0: 3.0},
+                                                      timestamp_ns=20))
+        self.assertTupleEqual((3.0, 2.0), values)
+        self.assertEqual(20, decoder.timestamp_ns)
+        decoder.decode(tx.encode_full_frame((1.0, 2.0)))
+        self.assertIsNone(decoder.timestamp_ns)
+
+    def test_held_flag(self):
+        decoder = tx.FrameDecoder()
+        decoder.decode(tx.encode_full_frame((1.0, 2.0), is_held=True))
+        self.assertTrue(decoder.is_held)
+        decoder.decode(tx.encode_delta_frame({0: 3.0}, timestamp_ns=20,
+                                             is_held=True))
+        self.assertTrue(decoder.is_held)
+        self.assertEqual(20, decoder.timestamp_ns)
+        values = decoder.decode(tx.encode_delta_frame({0: 4.0}))
+        self.assertTupleEqual((4.0, 2.0), values)
+        self.assertFalse(decoder.is_held)
+
+    def test_roundtrip_with_deadband_policy(self):
+        policy = tx.DeadbandSendPolicy(thresholds=(0.5,),
+                                       keepalive_s=100,
+                                       full_frame_every=100)
+        decoder = tx.FrameDecoder()
+        for idx, value in enumerate([0.0, 0.2, 0.7, 0.8, 2.0]):
+            data = policy.encode((value,), time_s=idx)
+            if data is not None:
+                decoder.decode(data)
+            self.assertLessEqual(abs(decoder.values[0] - value), 0.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
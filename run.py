@@ -1,58 +1,241 @@
 import argparse
-import json
 import logging
+import time
 
-import pimu.debug.visual as vizdbg
+import numpy as np
+
+import pimu.clocksync as clocksync
+import pimu.control as control
 import pimu.imu_server as imu_server
+import pimu.mpu6050.constants as const
 import pimu.network as net
+import pimu.transmission as tx
+from pimu.instrumentation import Instrumentation, NULL_INSTRUMENTATION
+from pimu.trace import BinaryTraceSink
 
 _DEFAULT_RATE_hz = 10
-_LOGGING_LEVEL = logging.DEBUG
+_LOGGING_LEVEL = logging.INFO
 _CALIBRATE = True
 _GYRO_FULL_SCALE_RANGE = '250'
 _ACC_FULL_SCALE_RANGE = '2g'
+_DEFAULT_DLPF_BANDWIDTH = '260'
+_DEFAULT_KEEPALIVE_s = 1.0
+_DEFAULT_FULL_FRAME_EVERY = 10
+_DEADBAND_TEMPERATURE_deg = 0.5
+_DEFAULT_REPORT_INTERVAL_s = 10
+_SPECTRUM_WINDOW_SIZE = 1024
+_SPECTRUM_HOP = 256
+_DEFAULT_IDLE_RATE_hz = 50
 
 mpl_logger = logging.getLogger('matplotlib')
 mpl_logger.setLevel(logging.WARNING)
-logging.basicConfig(level=_LOGGING_LEVEL,
-                    format='[%(levelname)s][%(name)s] %(message)s')
 _logger = logging.getLogger(__name__)
 
 
-def _client_to_visual_debugger(client):
+def _client_to_visual_debugger(client, hold_timeout_s, instrumentation,
+                               clock, profile_s=None, profile_output=None):
+    decoder = tx.FrameDecoder()
+
+    def decode(data):
+        was_held = decoder.is_held
+        values = decoder.decode(data)
+        if decoder.is_held and not was_held:
+            _logger.warning('The server cannot read the sensor, the values '
+                            'are held')
+        # With a synchronized clock, the end-to-end latency of the sample is
+        # measured from its server timestamp.
+        if decoder.timestamp_ns is not None and clock is not None:
+            local_ns = clock.to_local(decoder.timestamp_ns)
+            if local_ns is not None:
+                instrumentation.record('latency',
+                                       int(time.monotonic_ns() - local_ns))
+        return values
+
+    def to_debugger_sample(values):
+        yaw_rad, pitch_rad, roll_rad, temperature_deg = values
+        return yaw_rad, pitch_rad, roll_rad, \
+               0, 0, 0, \
+               temperature_deg
+
+    def func():
+        # The profile covers the receive loop only, not the start-up.
+        if profile_s is not None:
+            instrumentation.profile(duration_s=profile_s,
+                                    output_path=profile_output)
+        last_received_s = time.monotonic()
+        while True:
+            start_ns = instrumentation.start()
+            samples = [decode(data) for data in client.drain()]
+            samples = [values for values in samples if values is not None]
+            if samples:
+                instrumentation.record(
+                    'decode',
+                    (instrumentation.start() - start_ns) // len(samples))
+            instrumentation.maybe_report()
+
+            # When no packet arrives the last received values are held, so
+            # that the plots keep scrolling while the server is in deadband
+            # mode.
+            now_s = time.monotonic()
+            if samples:
+                last_received_s = now_s
+            elif decoder.values is not None:
+                num_held = int((now_s - last_received_s) / hold_timeout_s)
+                samples = [decoder.values] * num_held
+                last_received_s += num_held * hold_timeout_s
+
+            yield [to_debugger_sample(values) for values in samples]
+    return func
+
+
+def _client_status(client, clock):
     def func():
-        for data in client.receive():
-            yaw_rad, pitch_rad, roll_rad, temperature_deg = \
-                map(float, json.loads(data))
-            yield yaw_rad, pitch_rad, roll_rad, \
-                  0, 0, 0, \
-                  temperature_deg
+        stats = client.stats()
+        status = 'rx {:.0f} Hz, dropped {}/{}'.format(stats.rate_hz,
+                                                     stats.num_dropped,
+                                                     stats.num_received)
+        if clock is not None and clock.estimator.is_synchronized:
+            status += ', clock offset {:.3f} ms, rtt {:.3f} ms'.format(
+                clock.estimator.offset_ns() / 1e6, clock.last_rtt_ns / 1e6)
+        return status
     return func
 
 
+def _build_send_policy(deadband_deg, keepalive_s, full_frame_every):
+    if deadband_deg is None:
+        return tx.AlwaysSendPolicy()
+
+    deadband_rad = np.deg2rad(deadband_deg)
+    thresholds = (deadband_rad, deadband_rad, deadband_rad,
+                  _DEADBAND_TEMPERATURE_deg)
+    return tx.DeadbandSendPolicy(thresholds=thresholds,
+                                 keepalive_s=keepalive_s,
+                                 full_frame_every=full_frame_every)
+
+
+def _monitor_vibrations(server):
+    from pimu.spectrum import CHANNEL_NAMES, SpectrumAnalyzer, VibrationMetrics
+
+    analyzer = SpectrumAnalyzer(rate_hz=server.sensor_rate_hz,
+                                window_size=_SPECTRUM_WINDOW_SIZE,
+                                hop=_SPECTRUM_HOP)
+    vibration_metrics = VibrationMetrics(server.metrics)
+
+    def on_samples(samples):
+        for report in analyzer.extend(samples[:, :len(CHANNEL_NAMES)]):
+            vibration_metrics.update(report)
+
+    # The analysis needs the full-rate samples.
+    server.subscribe(decimation=1, callback=on_samples)
+
+
 def _run_imu_server(ip,
                     port,
                     rate_hz,
                     calibrate,
                     gyro_fsr,
-                    acc_fsr):
+                    acc_fsr,
+                    sensor_rate_hz,
+                    dlpf_bandwidth,
+                    send_policy,
+                    trace_every,
+                    trace_file,
+                    instrumentation,
+                    metrics_port,
+                    spectrum,
+                    event_mode,
+                    record_file,
+                    control_enabled,
+                    stream_address,
+                    stream_policy,
+                    filter_taps,
+                    clock_sync,
+                    profile_s,
+                    profile_output):
     _logger.info('Starting IMU server')
 
-    server = imu_server.MPU6050Server(ip=ip,
-                                      port=port,
-                                      rate_hz=rate_hz,
-                                      calibrate=calibrate,
-                                      gyro_sensitivity=gyro_fsr,
-                                      acc_sensitivity=acc_fsr)
-    server.run()
+    trace_sink = None if trace_file is None \
+        else BinaryTraceSink(trace_file, num_values=7)
+    recorder = None
+    if record_file is not None:
+        from pimu.recording import RecordingWriter
+        recorder = RecordingWriter(record_file, pyramid=True)
+    control_port = control.control_port(port) if control_enabled else None
+    stream = None
+    if stream_address is not None:
+        stream = net.StreamServer(net.parse_stream_address(stream_address),
+                                  policy=stream_policy)
+        stream.start()
+    try:
+        server = imu_server.MPU6050Server(ip=ip,
+                                          port=port,
+                                          rate_hz=rate_hz,
+                                          calibrate=calibrate,
+                                          send_policy=send_policy,
+                                          trace_every=trace_every,
+                                          trace_sink=trace_sink,
+                                          instrumentation=instrumentation,
+                                          gyro_sensitivity=gyro_fsr,
+                                          acc_sensitivity=acc_fsr,
+                                          sample_rate_hz=sensor_rate_hz,
+                                          dlpf_bandwidth=dlpf_bandwidth,
+                                          event_mode=event_mode,
+                                          recorder=recorder,
+                                          control_port=control_port,
+                                          stream=stream,
+                                          filter_taps_per_phase=filter_taps)
+        if clock_sync:
+            clocksync.ClockSyncResponder(clocksync.sync_port(port)).start()
+        if spectrum:
+            _monitor_vibrations(server)
+        if metrics_port is not None:
+            from pimu.metrics import MetricsServer
+            MetricsServer(server.metrics, port=metrics_port).start()
+        server.run(profile_s=profile_s, profile_output=profile_output)
+    finally:
+        if trace_sink is not None:
+            trace_sink.close()
+        if recorder is not None:
+            recorder.close()
+        if stream is not None:
+            stream.close()
 
 
-def _run_imu_client(ip, port, rate_hz):
+def _run_imu_client(ip, port, rate_hz, instrumentation, clock_sync,
+                    profile_s, profile_output):
     _logger.info('Starting IMU client')
 
-    client = net.UDPClient(ip, port)
+    # The plotting libraries are slow to import and not needed by the server.
+    import pimu.debug.visual as vizdbg
+
+    client = net.BufferedUDPClient(ip, port)
+    client.start()
+
+    # The server address is known once its first packet arrives.
+    def clock_sync_address():
+        if client.peer_address is None:
+            return None
+        return client.peer_address[0], clocksync.sync_port(port)
+
+    clock = None
+    if clock_sync:
+        clock = clocksync.ClockSyncClient(clock_sync_address)
+        clock.start()
+
     debugger = vizdbg.VisualDebugger(rate=rate_hz)
-    debugger.run(updating_func=_client_to_visual_debugger(client))
+    try:
+        debugger.run(updating_func=_client_to_visual_debugger(
+                         client,
+                         hold_timeout_s=1 / rate_hz,
+                         instrumentation=instrumentation,
+                         clock=clock,
+                         profile_s=profile_s,
+                         profile_output=profile_output),
+                     status_func=_client_status(client, clock))
+    finally:
+        if clock is not None:
+            clock.stop()
+        client.stop()
 
 
 def _main():
@@ -80,10 +263,158 @@ def _main():
     parser.add_argument('--rate',
                         required=True,
                         type=float,
-                        help='IMU reading rate, in Hertz.')
+                        help='IMU reading rate, in Hertz. When the sensor '
+                             'runs faster, e.g. 31.25 Hz for 10 Hz, see '
+                             '--sensor-rate, the angles are delayed by '
+                             'the anti-aliasing filter, see --filter-taps.')
+    parser.add_argument('--sensor-rate',
+                        type=float,
+                        default=None,
+                        dest='sensor_rate',
+                        help='Output rate of the sensor, in Hertz. Samples '
+                             'are low pass filtered and decimated to --rate '
+                             'before fusion, which delays the angles by '
+                             'about --filter-taps / 2 periods of --rate. '
+                             'Defaults to --rate.')
+    parser.add_argument('--filter-taps',
+                        type=int,
+                        default=imu_server.DEFAULT_FILTER_TAPS_PER_PHASE,
+                        dest='filter_taps',
+                        help='Length of the anti-aliasing filter, in taps '
+                             'per unit of the ratio between the sensor rate '
+                             'and --rate, at least 1. The default, 1, delays '
+                             'the angles by half a period of --rate at most. '
+                             'More taps, e.g. 16 for 8 periods, let fewer '
+                             'vibrations alias.')
+    parser.add_argument('--dlpf',
+                        choices=sorted(const.DLPF_CFG, key=int),
+                        default=_DEFAULT_DLPF_BANDWIDTH,
+                        help='Bandwidth in Hertz of the digital low pass '
+                             'filter of the sensor. 260 disables it.')
+    parser.add_argument('--deadband',
+                        type=float,
+                        default=None,
+                        help='If set, the server sends an angle only when it '
+                             'changes by more than this many degrees.')
+    parser.add_argument('--keepalive',
+                        type=float,
+                        default=_DEFAULT_KEEPALIVE_s,
+                        help='In deadband and event mode, maximum time in '
+                             'seconds between two packets.')
+    parser.add_argument('--full-frame-every',
+                        type=int,
+                        default=_DEFAULT_FULL_FRAME_EVERY,
+                        dest='full_frame_every',
+                        help='In deadband mode, every how many packets all '
+                             'the values are sent.')
+    parser.add_argument('--verbose', '-v',
+                        action='store_true',
+                        help='Enables DEBUG logging.')
+    parser.add_argument('--trace-every',
+                        type=int,
+                        default=1,
+                        dest='trace_every',
+                        help='With --verbose, the per-sample values are '
+                             'logged once every this many samples.')
+    parser.add_argument('--instrument',
+                        action='store_true',
+                        help='Measures the latency of each processing stage '
+                             'and periodically logs a summary.')
+    parser.add_argument('--report-interval',
+                        type=float,
+                        default=_DEFAULT_REPORT_INTERVAL_s,
+                        dest='report_interval',
+                        help='With --instrument, seconds between two latency '
+                             'summaries.')
+    parser.add_argument('--profile',
+                        type=float,
+                        default=None,
+                        help='Runs cProfile for this many seconds from '
+                             'the start of the sampling loop, or of '
+                             'the receive loop of the client, then logs '
+                             'the top functions. Implies --instrument.')
+    parser.add_argument('--profile-output',
+                        type=str,
+                        default=None,
+                        dest='profile_output',
+                        help='With --profile, file where the profile '
+                             'statistics are written.')
+    parser.add_argument('--metrics-port',
+                        type=int,
+                        default=None,
+                        dest='metrics_port',
+                        help='If set, the server exposes Prometheus metrics '
+                             'at http://127.0.0.1:<port>/metrics.')
+    parser.add_argument('--spectrum',
+                        action='store_true',
+                        help='The server analyzes the vibrations of '
+                             'the full-rate samples and exposes them as '
+                             'metrics.')
+    parser.add_argument('--event-mode',
+                        action='store_true',
+                        dest='event_mode',
+                        help='The server enables the motion interrupts of '
+                             'the sensor and only sends keepalive samples '
+                             'while the board is still.')
+    parser.add_argument('--idle-rate',
+                        type=float,
+                        default=_DEFAULT_IDLE_RATE_hz,
+                        dest='idle_rate',
+                        help='In event mode, output rate of the sensor in '
+                             'Hertz while the board is still. Limited to '
+                             'the sensor rate.')
+    parser.add_argument('--record',
+                        type=str,
+                        default=None,
+                        help='If set, the server records the raw frames of '
+                             'the sensor to this compressed file, see '
+                             'pimu.recording, and builds its overview '
+                             'pyramid next to it, see pimu.pyramid.')
+    parser.add_argument('--control',
+                        action='store_true',
+                        help='The server accepts changes of the sensor '
+                             'settings while running on --port + 2, see '
+                             'pimu.control.')
+    parser.add_argument('--clock-sync',
+                        action='store_true',
+                        dest='clock_sync',
+                        help='The server answers, on --port + 1 of all its '
+                             'interfaces, the pings of the client, which '
+                             'then measures the latency of the samples, see '
+                             'pimu.clocksync. To be set on both sides.')
+    parser.add_argument('--stream',
+                        type=str,
+                        default=None,
+                        help='If set, the server also sends every raw '
+                             'sample read from the sensor, at the sensor '
+                             'rate, over a reliable stream, to consumers '
+                             'that must not lose any: host:port to listen on '
+                             'over TCP, or the path of a Unix-domain socket.')
+    parser.add_argument('--stream-policy',
+                        choices=net.BACKPRESSURE_POLICIES,
+                        default=net.DROP_OLDEST,
+                        dest='stream_policy',
+                        help='With --stream, what happens when the consumer '
+                             'falls behind and the queue is full. block '
+                             'holds the sampling loop, up to 0.1 s per '
+                             'sample.')
+    parser.add_argument('--trace-file',
+                        type=str,
+                        default=None,
+                        dest='trace_file',
+                        help='If set, the server writes every sensor sample '
+                             'to this binary file.')
 
     args = parser.parse_args()
 
+    logging.basicConfig(level=logging.DEBUG if args.verbose else _LOGGING_LEVEL,
+                        format='[%(levelname)s][%(name)s] %(message)s')
+
+    instrumentation = NULL_INSTRUMENTATION
+    if args.instrument or args.profile is not None:
+        instrumentation = \
+            Instrumentation(report_interval_s=args.report_interval)
+
     is_server = args.is_server
     is_client = args.is_client
     if is_server == is_client:
@@ -95,11 +426,38 @@ def _main():
                         rate_hz=args.rate,
                         calibrate=_CALIBRATE,
                         gyro_fsr=_GYRO_FULL_SCALE_RANGE,
-                        acc_fsr=_ACC_FULL_SCALE_RANGE)
+                        acc_fsr=_ACC_FULL_SCALE_RANGE,
+                        sensor_rate_hz=args.sensor_rate or args.rate,
+                        dlpf_bandwidth=args.dlpf,
+                        send_policy=_build_send_policy(
+                            deadband_deg=args.deadband,
+                            keepalive_s=args.keepalive,
+                            full_frame_every=args.full_frame_every),
+                        trace_every=args.trace_every,
+                        trace_file=args.trace_file,
+                        instrumentation=instrumentation,
+                        metrics_port=args.metrics_port,
+                        spectrum=args.spectrum,
+                        event_mode=imu_server.EventMode(
+                            idle_rate_hz=args.idle_rate,
+                            keepalive_s=args.keepalive)
+                        if args.event_mode else None,
+                        record_file=args.record,
+                        control_enabled=args.control,
+                        stream_address=args.stream,
+                        stream_policy=args.stream_policy,
+                        filter_taps=args.filter_taps,
+                        clock_sync=args.clock_sync,
+                        profile_s=args.profile,
+                        profile_output=args.profile_output)
     else:
         _run_imu_client(ip=args.ip,
                         port=args.port,
-                        rate_hz=args.rate)
+                        rate_hz=args.rate,
+                        instrumentation=instrumentation,
+                        clock_sync=args.clock_sync,
+                        profile_s=args.profile,
+                        profile_output=args.profile_output)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,51 @@
+import json
+import os
+import subprocess
+import sys
+import unittest
+
+_REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Modules that only the client and the calibration need.
+_HEAVY_MODULES = ('matplotlib', 'seaborn', 'mpl_toolkits', 'tqdm', 'scipy',
+                  'pandas', 'http.server', 'cProfile', 'numba')
+
+# Generous upper bound on a development machine. Importing NumPy alone
+# takes about 0.1 s.
+_IMPORT_TIME_BUDGET_s = 1.0
+
+_PROBE = '''
+import json
+import sys
+import time
+
+start_s = time.perf_counter()
+import run
+import pimu.imu_server
+elapsed_s = time.perf_counter() - start_s
+
+print(json.dumps({'elapsed_s': elapsed_s, 'modules': sorted(sys.modules)}))
+'''
+
+
+class ServerImportsTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # Run in a fresh interpreter, so that nothing is already imported.
+        output = subprocess.check_output([sys.executable, '-c', _PROBE],
+                                         cwd=_REPO_DIR)
+        cls._probe = json.loads(output)
+
+    def test_heavy_modules_are_not_imported(self):
+        imported_modules = set(self._probe['modules'])
+        imported_heavy_modules = [name for name in _HEAVY_MODULES
+                                  if name in imported_modules]
+        self.assertListEqual([], imported_heavy_modules)
+
+    def test_import_time_budget(self):
+        self.assertLess(self._probe['elapsed_s'], _IMPORT_TIME_BUDGET_s)
+
+
+if __name__ == '__main__':
+    unittest.main()